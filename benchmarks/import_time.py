@@ -0,0 +1,78 @@
+'''
+Import-time benchmark, to guard that using only the simulator stays lightweight.
+
+Each statement is imported in fresh interpreters, and the median time and peak memory are reported.
+Exits with an error if a physics-only import pulls in Panda3D, or exceeds the time budget:
+
+    python benchmarks/import_time.py --max-ms 150
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+# Statement, and whether it may import Panda3D
+IMPORTS = [
+    ("from dronesim import DroneSimulator", False),
+    ("from dronesim import DroneSimulator, DefaultDroneControl", False),
+    ("from dronesim.dataset import FrameSink, DatasetExporter", False),
+    ("from dronesim.app.headless import HeadlessRenderer", True),
+    ("from dronesim import SimulatorApplication", True),
+]
+
+PROBE = '''
+import json, resource, sys, time
+t = time.perf_counter()
+%s
+elapsed = time.perf_counter() - t
+print(json.dumps({
+    'seconds': elapsed,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'panda3d': sorted(m for m in sys.modules if m.split('.')[0] in ('panda3d', 'direct'))
+}))
+'''
+
+
+def measure(statement: str, repeat: int) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    runs = [json.loads(subprocess.check_output([sys.executable, '-c', PROBE % statement], env=env))
+            for _ in range(repeat)]
+    return {
+        'seconds': statistics.median(r['seconds'] for r in runs),
+        'max_rss_kb': max(r['max_rss_kb'] for r in runs),
+        'panda3d': runs[-1]['panda3d']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per statement")
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help="Fail if a physics-only import takes longer than this (median)")
+    args = parser.parse_args()
+
+    failures = []
+    for statement, allows_panda3d in IMPORTS:
+        result = measure(statement, args.repeat)
+        print("%-60s %8.1f ms %8.1f MB%s" % (
+            statement, result['seconds'] * 1e3, result['max_rss_kb'] / 1024,
+            '  (Panda3D)' if result['panda3d'] else ''))
+        if not allows_panda3d:
+            if result['panda3d']:
+                failures.append("%r imports Panda3D: %s" % (statement, ', '.join(result['panda3d'][:5])))
+            if args.max_ms is not None and result['seconds'] * 1e3 > args.max_ms:
+                failures.append("%r takes %.1f ms (budget %.1f ms)" % (
+                    statement, result['seconds'] * 1e3, args.max_ms))
+
+    for failure in failures:
+        print("FAIL: %s" % failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
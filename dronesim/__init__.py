@@ -1,18 +1,40 @@
 
-# Import major classes
-
 from dronesim.types import *
-from dronesim.app import SimulatorApplication, Panda3DEnvironment
-from dronesim.actor import VehicleModel, UAVDroneModel
 from dronesim.interface.default import DefaultDroneControl
 from dronesim.interface import IDroneControllable, DroneAction, DroneState
 from dronesim.simulator import DroneSimulator
 
+import importlib
 from typing import Tuple
 
 
-def make_uav() -> Tuple[DroneSimulator, IDroneControllable, VehicleModel]:
+# Major classes that need Panda3D. They are imported on first access, so that using only
+# the simulator (physics, controllers) does not import Panda3D, ShowBase, or set-up the assets
+_LAZY_ATTRIBUTES = {
+    'SimulatorApplication': 'dronesim.app',
+    'Panda3DEnvironment': 'dronesim.app',
+    'VehicleModel': 'dronesim.actor',
+    'UAVDroneModel': 'dronesim.actor',
+    'PandaFilePath': 'dronesim.panda3d_types'
+}
+
+
+def __getattr__(name: str):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
+def make_uav() -> Tuple[DroneSimulator, IDroneControllable, 'VehicleModel']:
     '''Simple method to create a UAV model with a simulator attached'''
+    from dronesim.actor import UAVDroneModel
     sim = DroneSimulator()
     controller = DefaultDroneControl(sim)
     uav = UAVDroneModel(controller)
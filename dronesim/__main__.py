@@ -1,19 +1,40 @@
 
 import argparse
+import time
 from dronesim.sensor.panda3d.camera import Panda3DCameraSensor
 from dronesim import SimulatorApplication, Panda3DEnvironment, make_uav
 import logging
 logging.basicConfig(level=logging.INFO)
 
+LOG = logging.getLogger(__name__)
+
 # Simulated drone and application
 
 # Sensors
 
 
+def run_headless(sim, drone, env, sensor_rate: float):
+    '''Render only the sensors, offscreen, at the given rate'''
+    from dronesim.app.headless import HeadlessRenderer
+
+    renderer = HeadlessRenderer(env, drone)
+    renderer.attach_sensor(
+        *(s for s in sim.sensors.values() if isinstance(s, Panda3DCameraSensor)))
+    sim.set_renderer(renderer)
+
+    while True:
+        sensor_state = sim.update_sensors()
+        LOG.debug("Sensors updated: %s" % ', '.join(sensor_state.keys()))
+        time.sleep(1.0 / sensor_rate)
+
+
 def main():
     parser = argparse.ArgumentParser()
-    # TODO: Having some options would be nice
-    parser.parse_args()
+    parser.add_argument('--headless', action='store_true',
+                        help="Don't open a window, only render the camera sensors offscreen (software renderer)")
+    parser.add_argument('--sensor-rate', type=float, default=10.0,
+                        help="Rate (Hz) at which sensors are rendered in headless mode")
+    args = parser.parse_args()
 
     # Add a single Quad UAV drone
     sim, controller, drone = make_uav()
@@ -21,23 +42,28 @@ def main():
     # Load a simple environment and default scene
     env = Panda3DEnvironment("basic_env")
 
-    # Application window with the drone entity added
-    simulator_window = SimulatorApplication(env, drone)
-
     # ** Configure the simulator by adding sensors **
 
     # Add a camera sensor facing down
     # NOTE: having texture of a power of 2 helps in memory optimization
     down_cam = Panda3DCameraSensor("downCameraRGB", size=(512, 512))
     sim.add_sensor(down_camera_rgb=down_cam)
-    # Insert camera into main app window and attach to the scene
-    # down_cam.attach_to_env(simulator_window.render, simulator_window.graphicsEngine, simulator_window.win)
 
     # Move and rotate camera with the UAV object
     down_cam.reparent_to(drone)
     # Face down
     down_cam.set_hpr(0, -90, 0)
 
+    if args.headless:
+        run_headless(sim, drone, env, args.sensor_rate)
+        return
+
+    # Application window with the drone entity added
+    simulator_window = SimulatorApplication(env, drone)
+
+    # Insert camera into main app window and attach to the scene
+    # down_cam.attach_to_env(simulator_window.render, simulator_window.graphicsEngine, simulator_window.win)
+
     # Start the app
     simulator_window.run()
 
@@ -0,0 +1,88 @@
+
+from panda3d.core import LPoint3f, LQuaternionf
+
+import math
+
+from typing import Optional, Tuple
+
+
+def quat_slerp(q0: LQuaternionf, q1: LQuaternionf, t: float) -> LQuaternionf:
+    '''Spherical linear interpolation between two unit quaternions, along the shortest path'''
+    dot = q0.dot(q1)
+    if dot < 0:
+        # q and -q are the same rotation; take the shorter way around
+        q1 = -q1
+        dot = -dot
+    if dot > 0.9995:
+        # Nearly the same rotation: normalized linear interpolation is accurate and stable
+        q = q0 + (q1 - q0) * t
+        q.normalize()
+        return q
+    theta = math.acos(dot)
+    sin_theta = math.sin(theta)
+    w0 = math.sin((1 - t) * theta) / sin_theta
+    w1 = math.sin(t * theta) / sin_theta
+    return q0 * w0 + q1 * w1
+
+
+class PoseInterpolator:
+    '''
+    Holds the two most recent timestamped poses (from physics ticks) of a vehicle, and samples its pose at
+    render time between them, so the model moves smoothly regardless of the physics tick rate.
+
+    Poses are rendered one tick behind: at time `now`, the pose is interpolated at `now - (t1 - t0)`, which
+    lies between the two samples while ticks keep arriving at a steady rate. If ticks stop, the latest pose
+    is held (there is no extrapolation).
+    '''
+
+    def __init__(self):
+        self._times = [None, None]
+        self._pos = [LPoint3f(), LPoint3f()]
+        self._quat = [LQuaternionf.ident_quat(), LQuaternionf.ident_quat()]
+        self._count = 0
+
+    def reset(self):
+        '''Forget the samples, such as when the vehicle is teleported'''
+        self._count = 0
+
+    @property
+    def has_sample(self) -> bool:
+        return self._count > 0
+
+    def push(self, timestamp: float, pos, hpr):
+        '''Add the pose at `timestamp` (seconds), with the heading/pitch/roll in degrees'''
+        if self._count > 0 and timestamp <= self._times[1]:
+            # Out of order or repeated sample: replace the latest one
+            self._pos[1] = LPoint3f(*pos)
+            self._quat[1].set_hpr(tuple(hpr))
+            return
+        self._times[0], self._times[1] = self._times[1], timestamp
+        self._pos[0], self._quat[0] = self._pos[1], self._quat[1]
+        self._pos[1] = LPoint3f(*pos)
+        self._quat[1] = LQuaternionf()
+        self._quat[1].set_hpr(tuple(hpr))
+        self._count = min(self._count + 1, 2)
+
+    def alpha(self, now: float) -> float:
+        '''Interpolation factor between the previous (0) and latest (1) sample at time `now`'''
+        if self._count < 2:
+            return 1.0
+        t0, t1 = self._times
+        period = t1 - t0
+        return min(max((now - period - t0) / period, 0.0), 1.0)
+
+    def sample(self, now: float) -> Optional[Tuple[LPoint3f, LQuaternionf]]:
+        '''Interpolated position and orientation at time `now`, or None if there are no samples yet'''
+        if self._count == 0:
+            return None
+        t = self.alpha(now)
+        if t >= 1.0:
+            return LPoint3f(self._pos[1]), LQuaternionf(self._quat[1])
+        pos = self._pos[0] + (self._pos[1] - self._pos[0]) * t
+        return LPoint3f(pos), quat_slerp(self._quat[0], self._quat[1], t)
+
+
+__all__ = [
+    'quat_slerp',
+    'PoseInterpolator'
+]
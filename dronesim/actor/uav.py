@@ -1,13 +1,21 @@
 
-from panda3d.core import NodePath, Filename
+from panda3d.core import NodePath, Filename, ClockObject
+from direct.interval.IntervalGlobal import LerpHprInterval, Parallel
 
 from .vehicle import VehicleModel
+from .interpolation import PoseInterpolator
 from dronesim.interface.control import IDroneControllable
 from dronesim.utils import rad2deg
-from dronesim.types import PandaFilePath, StateType
-from typing import Union, Dict
+from dronesim.sensor.panda3d.visibility import set_detail_level
+from dronesim.model_cache import ModelCache, DEFAULT_MODEL_CACHE
+from dronesim.types import StateType
+# Panda3D configuration and the virtual assets directory, to load models from
+from dronesim.app import config as _config
+from dronesim.panda3d_types import PandaFilePath
+from typing import Optional, Union, Dict, Callable
 
 import random
+import time
 
 
 class UAVDroneModel(VehicleModel):
@@ -28,14 +36,35 @@ class UAVDroneModel(VehicleModel):
 
     Default propeller layout is the 'Quad X' frame arrangement
 
+    Propeller spin is a single (C++) interval covering all propellers, so each update only sets the spin
+    phase of the drone from its thrust, instead of rotating each propeller bone from Python.
+
+    :param bool interpolate: Render the pose interpolated between the two latest physics ticks (see
+    `PoseInterpolator`), so that movement is smooth even when the physics tick rate is lower than the frame rate.
+    The states are timestamped with the 'timestamp' field of the state info if given (from `clock`), otherwise
+    with the time they were first seen.
+    :param clock: Function that returns the current time in seconds, on the same clock as the state timestamps.
+    :param ModelCache model_cache: Cache to load models given as file paths through, so that glTF models are
+    only converted once. None to let the Actor load them directly.
+
     '''
 
+    # Propeller revolutions per second per unit of thrust
+    PROPELLER_SPIN_RATE = 1e5 * 60 / 360
+
     def __init__(self,
                  control_source: IDroneControllable,
                  shell_model: Union[PandaFilePath, NodePath] = None,
                  propellers: Dict[str, Union[PandaFilePath, NodePath]] = None,
-                 propeller_spin: Dict[str, float] = None):
+                 propeller_spin: Dict[str, float] = None,
+                 interpolate: bool = True,
+                 clock: Callable[[], float] = time.monotonic,
+                 model_cache: Optional[ModelCache] = DEFAULT_MODEL_CACHE):
         self._control_source = control_source
+        self.interpolate = interpolate
+        self._clock = clock
+        self._pose_buffer = PoseInterpolator()
+        self._last_state = None
 
         if shell_model is None:
             shell_model = Filename("models/quad-shell.glb")
@@ -68,7 +97,13 @@ class UAVDroneModel(VehicleModel):
         # Prefix so that it doesn't clash with original bone node
         propeller_parts = {'p_%s' % k: v for k, v in propellers.items()}
 
+        if model_cache is not None:
+            # Give the Actor the (cached) converted models instead of the files
+            shell_model = self._load_cached(model_cache, shell_model)
+            propeller_parts = {k: self._load_cached(model_cache, v) for k, v in propeller_parts.items()}
+
         self.joints = {'propellers': {}}
+        spin_intervals = []
 
         super().__init__({
             'modelRoot': shell_model,
@@ -85,29 +120,64 @@ class UAVDroneModel(VehicleModel):
                 'bone': control_node,
                 'spinDir': propeller_spin[bone]
             }
-            # Random rotation
-            control_node.setH(random.randint(0, 360))
+            # Random rotation, and one revolution in the spin direction per cycle of the interval
+            start_h = random.randint(0, 360)
+            spin_intervals.append(LerpHprInterval(
+                control_node, 1.0, (start_h + 360 * propeller_spin[bone], 0, 0), (start_h, 0, 0)))
+            # Propellers are small, and the first to be skipped by simplified sensor views
+            set_detail_level(self.getPart('p_%s' % bone), 1)
+
+        self._propeller_spin = Parallel(*spin_intervals, name='propeller_spin_%d' % self.get_key())
+        self._propeller_phase = 0.0
+        self._propeller_rate = 0.0
+        self._last_update_time = None
+        self._propeller_spin.set_t(0.0)
+
+    @staticmethod
+    def _load_cached(model_cache: ModelCache, model: Union[PandaFilePath, NodePath]) -> Union[PandaFilePath, NodePath]:
+        if isinstance(model, NodePath):
+            return model
+        return model_cache.load_model(model)
 
     @property
     def controller(self) -> IDroneControllable:
         return self._control_source
 
+    def set_propeller_rate(self, rate: float):
+        '''Spin all propellers at the rate (revolutions per second, each in its own spin direction)'''
+        self._propeller_rate = rate
+
+    def _spin_propellers(self):
+        now = ClockObject.get_global_clock().get_frame_time()
+        if self._last_update_time is not None:
+            self._propeller_phase = (self._propeller_phase +
+                                     self._propeller_rate * (now - self._last_update_time)) % 1.0
+            self._propeller_spin.set_t(self._propeller_phase)
+        self._last_update_time = now
+
     def update(self):
         state: StateType = self._control_source.get_current_state()
         if state is not None:
             state_info = state[3]
             transformState = state_info.get('state')
             if transformState is not None:
-                self.setPos(*transformState['pos'])
                 rotx, roty, rotz = transformState['angle']
                 # TODO: Need more transformations for pitch and roll based on velocity
-                self.setHpr(rad2deg(rotz), rad2deg(roty), rad2deg(rotx))
+                hpr = (rad2deg(rotz), rad2deg(roty), rad2deg(rotx))
+                if not self.interpolate:
+                    self.setPos(*transformState['pos'])
+                    self.setHpr(*hpr)
+                else:
+                    now = self._clock()
+                    if state is not self._last_state:
+                        # New physics tick
+                        self._last_state = state
+                        self._pose_buffer.push(state_info.get('timestamp', now), transformState['pos'], hpr)
+                    pos, quat = self._pose_buffer.sample(now)
+                    self.setPos(pos)
+                    self.setQuat(quat)
                 thrust = transformState['thrust_vec']
-                prop_vel = thrust.z * 1e5
-
-                for bone in self.joints['propellers'].values():
-                    # Rotate with respect to spin direction and thrust
-                    bone['bone'].setH(bone['bone'].getH() +
-                                      prop_vel*bone['spinDir'])
+                self.set_propeller_rate(thrust.z * self.PROPELLER_SPIN_RATE)
 
+        self._spin_propellers()
         super().update()
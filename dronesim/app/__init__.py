@@ -1,3 +1,29 @@
 
-from .sim_app import SimulatorApplication
-from .environment import Panda3DEnvironment
+import importlib
+
+
+# Imported on first access, so that importing a submodule (such as `dronesim.app.headless`)
+# does not import the windowed application and ShowBase
+_LAZY_ATTRIBUTES = {
+    'SimulatorApplication': '.sim_app',
+    'Panda3DEnvironment': '.environment'
+}
+
+
+def __getattr__(name: str):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
+__all__ = [
+    'SimulatorApplication',
+    'Panda3DEnvironment'
+]
@@ -1,14 +1,31 @@
 
 from direct.showbase.Loader import Loader
+import panda3d.core as p3dc
 from panda3d.core import (
     VirtualFileSystem,
+    VirtualFileMountSystem,
     Filename,
+    NodePath,
+    Texture,
     Shader
 )
-from dronesim.types import PandaFilePath
+from dronesim._base import PACKAGE_BASE
+from dronesim.model_cache import DEFAULT_MODEL_CACHE
+from .bundle import MOUNTED_BUNDLES, mount_asset_bundle, bundle_variant
+from dronesim.panda3d_types import PandaFilePath
 
+import os
+import re
 import json
-from typing import Optional, Callable, Dict, Any
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Callable, Dict, Iterable, Tuple, Any
+
+
+LOG = logging.getLogger(__name__)
 
 
 class VFSFileReaderMixin:
@@ -35,6 +52,65 @@ def read_json_file(assets_file: PandaFilePath, vfs: Optional[VirtualFileSystem]
     return json.loads(asset_conf)
 
 
+# Variables that can be used in asset config files as '{name}'. Attributes can be accessed with
+# dotted names, such as '{p3dc.SamplerState.FT_nearest}'
+ASSET_VARIABLES: Dict[str, Any] = {
+    'PACKAGE_BASE': PACKAGE_BASE,
+    'p3dc': p3dc
+}
+
+_VARIABLE_PATTERN = re.compile(r'\{([A-Za-z_][\w.]*)\}')
+
+
+def resolve_variable(name: str, variables: Dict[str, Any]) -> Any:
+    root, *attributes = name.split('.')
+    if root not in variables:
+        raise KeyError("Unknown variable '%s' in asset config" % name)
+    value = variables[root]
+    for attribute in attributes:
+        value = getattr(value, attribute)
+    return value
+
+
+def substitute_variables(value: Any, variables: Dict[str, Any]) -> Any:
+    '''
+    Replace '{name}' in the strings of the config value (also within lists and dicts) with the variable's value.
+    A string that is just one '{name}' is replaced by the value itself, keeping its type (such as an enum value).
+    '''
+    if isinstance(value, str):
+        match = _VARIABLE_PATTERN.fullmatch(value)
+        if match:
+            return resolve_variable(match.group(1), variables)
+        return _VARIABLE_PATTERN.sub(lambda m: str(resolve_variable(m.group(1), variables)), value)
+    if isinstance(value, dict):
+        return {k: substitute_variables(v, variables) for k, v in value.items()}
+    if isinstance(value, list):
+        return [substitute_variables(v, variables) for v in value]
+    return value
+
+
+def mount_asset_path(vfs: VirtualFileSystem, path: str, mount_point: str) -> bool:
+    '''
+    Mount the physical directory, or asset bundle (`.mf`), to the VFS (read-only), unless it's already mounted
+    there. A directory is not mounted where an asset bundle is mounted, as it would shadow the bundle (the
+    bundle is built from the directory). Returns whether it was mounted
+    '''
+    path = os.path.normpath(path)
+    if path.lower().endswith('.mf'):
+        if any(os.path.normpath(b.multifile.get_multifile_name().to_os_specific()) == path for b in MOUNTED_BUNDLES):
+            return False
+        mount_asset_bundle(path, mount_point, vfs)
+        return True
+    if any(b.mount_point.strip('/') == mount_point.strip('/') for b in MOUNTED_BUNDLES):
+        return False
+    mount_dir = Filename(mount_point.strip('/'))
+    for mount in vfs.get_mounts():
+        if isinstance(mount, VirtualFileMountSystem) and mount.get_mount_point() == mount_dir and \
+                os.path.normpath(mount.get_physical_filename().to_os_specific()) == path:
+            return False
+    return vfs.mount(VirtualFileMountSystem(Filename.from_os_specific(path)), mount_point, VirtualFileSystem.MFReadOnly)
+
+
 def loader_load_shader(cfg: dict, loader: Loader):
     shader_program_language = Shader.SL_GLSL
     vertex_path: Filename = Filename(cfg.get('vertex_path', ''))
@@ -51,31 +127,270 @@ def loader_load_shader(cfg: dict, loader: Loader):
     return shader_program
 
 
+def loader_load_model(cfg: dict, loader: Loader):
+    # Through the converted model cache, as glTF models are slow to convert
+    return DEFAULT_MODEL_CACHE.load_model(Filename(cfg['path']), loader)
+
+
+def _loader_method_load(method_name: str, use_variants: bool = False) -> Callable[[dict, Loader], Any]:
+    '''
+    Loader of an asset type that calls the `Loader` method with the path, and the 'options' as arguments.
+    With `use_variants`, the pre-processed variant of the file from an asset bundle is loaded, if there is one.
+    '''
+    def _load(cfg: dict, loader: Loader):
+        path = bundle_variant(cfg['path']) if use_variants else cfg['path']
+        return getattr(loader, method_name)(Filename(path), **cfg.get('options', {}))
+    return _load
+
+
 ASSET_LOADERS: Dict[str, Callable[[dict, Loader], Any]] = {
-    'shader': loader_load_shader
+    'shader': loader_load_shader,
+    'model': loader_load_model,
+    'texture': _loader_method_load('loadTexture', use_variants=True),
+    '3d_texture': _loader_method_load('load3DTexture'),
+    'cube_map': _loader_method_load('loadCubeMap'),
+    'font': _loader_method_load('loadFont'),
+    'sfx': _loader_method_load('loadSfx'),
+    'sound': _loader_method_load('loadSfx'),
+    'music': _loader_method_load('loadMusic')
+}
+
+# Releases an asset of the type from the loader's caches when it is evicted
+ASSET_UNLOADERS: Dict[str, Callable[[Any, Loader], None]] = {
+    'model': lambda asset, loader: loader.unloadModel(asset),
+    'texture': lambda asset, loader: loader.unloadTexture(asset),
+    '3d_texture': lambda asset, loader: loader.unloadTexture(asset),
+    'cube_map': lambda asset, loader: loader.unloadTexture(asset),
+    'sfx': lambda asset, loader: loader.unloadSfx(asset),
+    'sound': lambda asset, loader: loader.unloadSfx(asset),
+    'music': lambda asset, loader: loader.unloadSfx(asset)
 }
 
+# Audio managers are not thread-safe, so these are loaded on the calling thread
+MAIN_THREAD_ASSET_TYPES = ('sfx', 'sound', 'music')
+
+
+def estimate_asset_size(asset: Any) -> int:
+    '''Approximate memory (bytes) used by the asset's textures and geometry. 0 if unknown'''
+    if isinstance(asset, Texture):
+        return asset.estimate_texture_memory()
+    if isinstance(asset, NodePath):
+        size = sum(tex.estimate_texture_memory() for tex in asset.find_all_textures())
+        for geom_node in asset.find_all_matches('**/+GeomNode'):
+            for geom in geom_node.node().get_geoms():
+                vdata = geom.get_vertex_data()
+                size += sum(vdata.get_array(i).get_data_size_bytes() for i in range(vdata.get_num_arrays()))
+                size += sum(geom.get_primitive(i).get_data_size_bytes() for i in range(geom.get_num_primitives()))
+        return size
+    return 0
+
 
 class AssetHolder(dict):
-    def __init__(selfs):
+    '''
+    Assets loaded from an asset config file (see `assets/assets.json`), by name.
+
+    All declared assets are loaded in parallel (`workers` threads; Panda3D releases the GIL while
+    reading files), and the time each took is kept in `load_times`. The 'data' of each asset in the config
+    is in `asset_data`.
+
+    Assets are reference counted with `acquire()` / `release()`. When the estimated memory of the loaded
+    assets exceeds `memory_budget` (bytes), the least recently used assets that are not acquired are evicted,
+    and are loaded again when accessed. Preloading stops at the budget, leaving the other assets to be
+    loaded when accessed. Evicted (or not yet loaded) assets are still `in` the holder, and are loaded by
+    `get()` and indexing, but are not in its keys.
+    '''
+
+    def __init__(self, memory_budget: Optional[int] = 256 * 2**20, workers: int = 4):
         super().__init__()
+        self.memory_budget = memory_budget
+        self.workers = workers
+        self.data: dict = {}
+        self.asset_data: Dict[str, dict] = {}
+        self.load_times: Dict[str, float] = {}
+
+        self._loader: Optional[Loader] = None
+        # Type and config of each declared asset, to load it again after eviction
+        self._declared: Dict[str, Tuple[str, dict]] = {}
+        self._refs: Dict[str, int] = {}
+        self._sizes: Dict[str, int] = {}
+        # Loaded assets, least recently used first
+        self._lru: 'OrderedDict[str, None]' = OrderedDict()
+        self._lock = threading.RLock()
+
+    def load_from_config(self,
+                         assets_file: PandaFilePath,
+                         loader: Loader,
+                         vfs: Optional[VirtualFileSystem] = None,
+                         variables: Optional[Dict[str, Any]] = None):
+        self.load(read_json_file(assets_file, vfs), loader, vfs, variables)
 
-    def load_from_config(self, assets_file: PandaFilePath, loader: Loader, vfs: Optional[VirtualFileSystem] = None):
-        self.load(read_json_file(assets_file, vfs), loader, vfs)
+    def load(self,
+             assets_config: dict,
+             loader: Loader,
+             vfs: Optional[VirtualFileSystem] = None,
+             variables: Optional[Dict[str, Any]] = None):
+        '''Mount the directories, and load all the (enabled) assets of the config'''
+        if vfs is None:
+            vfs = VirtualFileSystem.get_global_ptr()
+        variables = {**ASSET_VARIABLES, **(variables or {})}
+        self._loader = loader
 
-    def load(self, assets_config: dict, loader: Loader, vfs: Optional[VirtualFileSystem] = None):
         mounts: dict = assets_config.get('mounts', {})
         config_data: dict = assets_config.get('data', {})
         asset_load: dict = assets_config.get('load', {})
 
+        for mount_point, path in mounts.items():
+            mount_asset_path(vfs, substitute_variables(path, variables), mount_point)
+        self.data.update(substitute_variables(config_data, variables))
+
+        names = []
         for asset_type, asset_items in asset_load.items():
-            load_method = ASSET_LOADERS.get(asset_type)
-            if load_method:
-                for asset_name, asset_config in asset_items.items():
-                    is_enabled: bool = asset_config.pop('enabled', True)
-                    if is_enabled:
-                        asset = load_method(asset_config, loader)
-                        self[asset_name] = asset
+            if asset_type not in ASSET_LOADERS:
+                LOG.warning("Unknown asset type '%s' in asset config" % asset_type)
+                continue
+            for asset_name, asset_config in asset_items.items():
+                asset_config = substitute_variables(asset_config, variables)
+                is_enabled: bool = asset_config.pop('enabled', True)
+                if is_enabled:
+                    self.asset_data[asset_name] = asset_config.pop('data', {})
+                    self._declared[asset_name] = (asset_type, asset_config)
+                    names.append(asset_name)
+
+        self.preload(names)
+
+    def preload(self, names: Iterable[str]):
+        '''
+        Load the declared assets in parallel (in the given order), blocking till they are loaded. Stops loading
+        when the memory budget is reached, so that the loaded assets aren't evicted right away.
+        '''
+        start = time.perf_counter()
+        pending = deque(name for name in names if not dict.__contains__(self, name))
+        loaded = 0
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix='asset_loader') as pool:
+            futures = set()
+            while pending or futures:
+                while pending and len(futures) < max(1, self.workers) and not self._over_budget(len(futures)):
+                    name = pending.popleft()
+                    if self._declared[name][0] in MAIN_THREAD_ASSET_TYPES:
+                        self._load_asset(name)
+                        loaded += 1
+                    else:
+                        futures.add(pool.submit(self._load_asset, name))
+                if not futures:
+                    break
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                    loaded += 1
+        if loaded:
+            LOG.info("Loaded %d assets in %.3f s (%.1f MB)" % (
+                loaded, time.perf_counter() - start, self.memory_usage / 2**20))
+        if pending:
+            LOG.info("Memory budget reached, %d assets will be loaded when used" % len(pending))
+
+    def _over_budget(self, loading: int = 0) -> bool:
+        '''Whether the loaded assets, and `loading` assets of the average size, reach the memory budget'''
+        if self.memory_budget is None:
+            return False
+        with self._lock:
+            usage = self.memory_usage
+            average = usage / len(self._sizes) if self._sizes else 0
+        return usage + loading * average >= self.memory_budget
+
+    def _load_asset(self, name: str) -> Any:
+        asset_type, asset_config = self._declared[name]
+        start = time.perf_counter()
+        asset = ASSET_LOADERS[asset_type](asset_config, self._loader)
+        elapsed = time.perf_counter() - start
+        LOG.debug("Loaded %s asset '%s' in %.3f s" % (asset_type, name, elapsed))
+        with self._lock:
+            self.load_times[name] = elapsed
+            self._store(name, asset)
+        return asset
+
+    def _store(self, name: str, asset: Any):
+        dict.__setitem__(self, name, asset)
+        self._sizes[name] = estimate_asset_size(asset)
+        self._lru[name] = None
+        self._lru.move_to_end(name)
+
+    def __missing__(self, name: str) -> Any:
+        # Declared, but evicted
+        if name not in self._declared:
+            raise KeyError(name)
+        asset = self._load_asset(name)
+        self._evict(keep=name)
+        return asset
+
+    def __contains__(self, name: object) -> bool:
+        # Evicted assets are loaded again on access
+        return dict.__contains__(self, name) or name in self._declared
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self[name] if name in self else default
+
+    def __getitem__(self, name: str) -> Any:
+        with self._lock:
+            asset = super().__getitem__(name)
+            self._lru.move_to_end(name)
+            return asset
+
+    def __setitem__(self, name: str, asset: Any):
+        with self._lock:
+            self._store(name, asset)
+            self._evict(keep=name)
+
+    def __delitem__(self, name: str):
+        with self._lock:
+            super().__delitem__(name)
+            self._sizes.pop(name, None)
+            self._lru.pop(name, None)
+
+    def acquire(self, name: str) -> Any:
+        '''Get the asset (loading it if needed), and keep it loaded till it is released'''
+        with self._lock:
+            asset = self[name]
+            self._refs[name] = self._refs.get(name, 0) + 1
+            return asset
+
+    def release(self, name: str):
+        with self._lock:
+            refs = self._refs.get(name, 0) - 1
+            if refs < 0:
+                raise ValueError("Asset '%s' was released more times than acquired" % name)
+            self._refs[name] = refs
+            if refs == 0:
+                self._evict()
+
+    @property
+    def memory_usage(self) -> int:
+        '''Estimated memory (bytes) of the loaded assets'''
+        return sum(self._sizes.values())
+
+    def _evict(self, keep: Optional[str] = None):
+        '''Unload least recently used assets that are not acquired, till the memory usage is within the budget'''
+        if self.memory_budget is None:
+            return
+        with self._lock:
+            usage = self.memory_usage
+            for name in list(self._lru):
+                if usage <= self.memory_budget:
+                    break
+                if name == keep or self._refs.get(name, 0) > 0 or not self._sizes.get(name):
+                    # Acquired, or too small to matter
+                    continue
+                usage -= self._sizes.get(name, 0)
+                self._unload(name)
+
+    def _unload(self, name: str):
+        asset = dict.pop(self, name)
+        self._sizes.pop(name, None)
+        self._lru.pop(name, None)
+        asset_type = self._declared.get(name, (None,))[0]
+        unloader = ASSET_UNLOADERS.get(asset_type)
+        if unloader is not None and self._loader is not None:
+            unloader(asset, self._loader)
+        LOG.debug("Evicted asset '%s'" % name)
 
 
 GLOBAL_ASSET_HOLDER = AssetHolder()
@@ -0,0 +1,290 @@
+
+'''
+Packed asset bundles: the contents of an assets directory in a single Panda3D Multifile (`.mf`), mounted
+read-only to the VFS, so that loading assets does not need many small file system calls.
+
+A bundle is built with `build_asset_bundle()` (or `python -m dronesim.app.bundle`). glTF models can be
+pre-converted into the bundle, where they are found by the model cache (`dronesim.model_cache`) with the same
+content and converter version key, so they are only used while the converter versions match. Textures can be
+pre-compressed (DXT) into `.txo` variants, which the asset loader uses in place of the image file.
+
+The bundle has a manifest (`manifest.json`) with the size and hash of each file, which is used to check the
+bundle when it is mounted, and to look up files without going through the VFS.
+'''
+
+from panda3d.core import (
+    Multifile,
+    VirtualFileSystem,
+    VirtualFileMountMultifile,
+    Filename,
+    Texture,
+    TexturePool
+)
+from direct.showbase.Loader import Loader
+
+from dronesim._base import PACKAGE_BASE
+from dronesim.model_cache import ModelCache, DEFAULT_MODEL_CACHE, converter_version, model_cache_key
+
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import tempfile
+
+from typing import Optional, Dict, List
+
+
+LOG = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = 1
+BUNDLE_MANIFEST = 'manifest.json'
+# Directory in the bundle with the pre-converted models, named by their model cache key
+BUNDLE_MODEL_CACHE_DIR = '.model_cache'
+
+MODEL_EXTENSIONS = ('gltf', 'glb')
+TEXTURE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'tga', 'bmp')
+COMPRESSED_TEXTURE_SUFFIX = '.txo'
+# Files that are already compressed, so they are stored as is
+STORED_EXTENSIONS = ('png', 'jpg', 'jpeg', 'mf', 'txo')
+
+# Default bundle, mounted instead of the assets directory if it exists
+DEFAULT_ASSET_BUNDLE = os.path.join(PACKAGE_BASE, 'assets.mf')
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def build_asset_bundle(source_dir: str,
+                       output_file: str,
+                       convert_models: bool = True,
+                       compress_textures: bool = False,
+                       compression_level: int = 6,
+                       loader: Optional[Loader] = None) -> dict:
+    '''
+    Pack all files of the directory into a Multifile bundle, returning its manifest.
+
+    :param bool convert_models: Also store glTF models converted to BAM, for the model cache.
+    :param bool compress_textures: Also store textures with DXT compressed images, as `.txo` files.
+    Compressed textures are lossy, so don't use it for pixel-exact textures (such as UI atlases).
+    :param int compression_level: zlib compression of the files (0 to 9), except those already compressed.
+    '''
+    if loader is None:
+        loader = Loader(None)
+    version = converter_version()
+    files: Dict[str, dict] = {}
+    models: Dict[str, str] = {}
+    variants: Dict[str, str] = {}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        tmp_output = os.path.join(work_dir, 'bundle.mf')
+        mf = Multifile()
+        if not mf.open_write(Filename.from_os_specific(tmp_output)):
+            raise OSError("Could not create bundle %s" % tmp_output)
+
+        def add_file(name: str, path: str, data: bytes):
+            extension = name.rsplit('.', 1)[-1].lower()
+            level = 0 if extension in STORED_EXTENSIONS else compression_level
+            # The file must exist till the multifile is closed
+            mf.add_subfile(name, Filename.binary_filename(Filename.from_os_specific(path)), level)
+            files[name] = {'size': len(data), 'sha256': _sha256(data)}
+
+        for root, dirs, names in os.walk(source_dir):
+            dirs.sort()
+            for file_name in sorted(names):
+                path = os.path.abspath(os.path.join(root, file_name))
+                name = os.path.relpath(path, os.path.abspath(source_dir)).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                add_file(name, path, data)
+                extension = file_name.rsplit('.', 1)[-1].lower()
+
+                if convert_models and extension in MODEL_EXTENSIONS:
+                    key = model_cache_key(data, version)
+                    converted_path = os.path.join(work_dir, '%s.bam' % key)
+                    model = loader.load_model(Filename.from_os_specific(path), noCache=True)
+                    if not model.write_bam_file(Filename.from_os_specific(converted_path)):
+                        raise OSError("Could not write converted model of %s" % name)
+                    loader.unload_model(model)
+                    with open(converted_path, 'rb') as f:
+                        add_file('%s/%s.bam' % (BUNDLE_MODEL_CACHE_DIR, key), converted_path, f.read())
+                    models[name] = key
+
+                elif compress_textures and extension in TEXTURE_EXTENSIONS:
+                    tex = TexturePool.load_texture(Filename.from_os_specific(path))
+                    mode = Texture.CM_dxt5 if tex.get_num_components() == 4 else Texture.CM_dxt1
+                    if not tex.compress_ram_image(mode, Texture.QL_best, None):
+                        LOG.warning("Could not compress texture %s, storing it as is" % name)
+                        continue
+                    variant = name + COMPRESSED_TEXTURE_SUFFIX
+                    variant_path = os.path.join(work_dir, variant.replace('/', '_'))
+                    tex.write(Filename.from_os_specific(variant_path))
+                    TexturePool.release_texture(tex)
+                    with open(variant_path, 'rb') as f:
+                        add_file(variant, variant_path, f.read())
+                    variants[name] = variant
+
+        manifest = {
+            'format': BUNDLE_FORMAT,
+            'created': time.time(),
+            'converter_version': version,
+            'files': files,
+            'models': models,
+            'variants': variants
+        }
+        manifest_path = os.path.join(work_dir, BUNDLE_MANIFEST)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        mf.add_subfile(BUNDLE_MANIFEST, Filename.binary_filename(Filename.from_os_specific(manifest_path)), 0)
+
+        if not mf.flush():
+            raise OSError("Could not write bundle %s" % output_file)
+        mf.close()
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        os.replace(tmp_output, output_file)
+
+    LOG.info("Built asset bundle %s with %d files (%d converted models, %d compressed textures)" % (
+        output_file, len(files), len(models), len(variants)))
+    return manifest
+
+
+class AssetBundle:
+    '''A bundle (Multifile) opened for reading, with its manifest'''
+
+    def __init__(self, multifile: Multifile, manifest: dict, mount_point: Optional[str] = None):
+        self.multifile = multifile
+        self.manifest = manifest
+        self.mount_point = mount_point
+
+    @classmethod
+    def open(cls, bundle_file: str) -> 'AssetBundle':
+        mf = Multifile()
+        if not mf.open_read(Filename.from_os_specific(bundle_file)):
+            raise OSError("Could not open asset bundle %s" % bundle_file)
+        index = mf.find_subfile(BUNDLE_MANIFEST)
+        if index < 0:
+            raise ValueError("Asset bundle %s has no manifest" % bundle_file)
+        try:
+            manifest = json.loads(mf.read_subfile(index))
+        except ValueError as e:
+            raise ValueError("Asset bundle %s has a corrupt manifest: %s" % (bundle_file, e)) from e
+        if manifest.get('format') != BUNDLE_FORMAT:
+            raise ValueError("Asset bundle %s has format %r, expected %d" % (
+                bundle_file, manifest.get('format'), BUNDLE_FORMAT))
+        return cls(mf, manifest)
+
+    @property
+    def files(self) -> Dict[str, dict]:
+        return self.manifest['files']
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.files
+
+    def check_sizes(self) -> List[str]:
+        '''Files whose size doesn't match the manifest (or are missing). Fast, doesn't read the files'''
+        bad = []
+        for name, info in self.files.items():
+            index = self.multifile.find_subfile(name)
+            if index < 0 or self.multifile.get_subfile_length(index) != info['size']:
+                bad.append(name)
+        return bad
+
+    def verify(self) -> List[str]:
+        '''Files whose content doesn't match the hash in the manifest (or are missing)'''
+        bad = []
+        for name, info in self.files.items():
+            index = self.multifile.find_subfile(name)
+            if index < 0 or _sha256(self.multifile.read_subfile(index)) != info['sha256']:
+                bad.append(name)
+        return bad
+
+    def vfs_path(self, name: str) -> str:
+        return '%s/%s' % (self.mount_point.rstrip('/'), name)
+
+    def variant(self, name: str) -> Optional[str]:
+        '''Name of the pre-processed variant (compressed texture) of the file in the bundle, if any'''
+        return self.manifest['variants'].get(name)
+
+
+# Bundles mounted with `mount_asset_bundle()`
+MOUNTED_BUNDLES: List[AssetBundle] = []
+
+
+def mount_asset_bundle(bundle_file: str,
+                       mount_point: str = '/assets/',
+                       vfs: Optional[VirtualFileSystem] = None,
+                       verify: bool = False,
+                       model_cache: Optional[ModelCache] = DEFAULT_MODEL_CACHE) -> AssetBundle:
+    '''
+    Mount the bundle read-only to the VFS. The sizes of the files are checked against the manifest, and
+    with `verify`, their content too (which reads the whole bundle). Raises ValueError if the bundle is corrupt.
+    '''
+    if vfs is None:
+        vfs = VirtualFileSystem.get_global_ptr()
+    bundle = AssetBundle.open(bundle_file)
+    bad = bundle.verify() if verify else bundle.check_sizes()
+    if bad:
+        raise ValueError("Asset bundle %s is corrupt: %s" % (bundle_file, ', '.join(bad[:10])))
+
+    if not vfs.mount(VirtualFileMountMultifile(bundle.multifile), mount_point, VirtualFileSystem.MFReadOnly):
+        raise OSError("Could not mount asset bundle %s to %s" % (bundle_file, mount_point))
+    bundle.mount_point = mount_point
+    if model_cache is not None and bundle.manifest['models']:
+        model_cache.add_search_path(bundle.vfs_path(BUNDLE_MODEL_CACHE_DIR))
+    MOUNTED_BUNDLES.append(bundle)
+    LOG.info("Mounted asset bundle %s to %s" % (bundle_file, mount_point))
+    return bundle
+
+
+def bundle_variant(path: str) -> str:
+    '''The VFS path of the pre-processed variant of the file, if it is in a mounted bundle, otherwise the path itself'''
+    for bundle in MOUNTED_BUNDLES:
+        prefix = bundle.mount_point.rstrip('/') + '/'
+        if path.startswith(prefix):
+            variant = bundle.variant(path[len(prefix):])
+            if variant is not None:
+                return bundle.vfs_path(variant)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack an assets directory into a bundle (Multifile)")
+    parser.add_argument('source', nargs='?', default=os.path.join(PACKAGE_BASE, 'assets'),
+                        help="Assets directory (default: the package's assets)")
+    parser.add_argument('output', nargs='?', default=DEFAULT_ASSET_BUNDLE,
+                        help="Bundle file to write (default: %(default)s, which is mounted instead of the assets directory)")
+    parser.add_argument('--no-convert-models', action='store_true', help="Don't pre-convert glTF models")
+    parser.add_argument('--compress-textures', action='store_true', help="Also store DXT compressed textures")
+    parser.add_argument('--compression-level', type=int, default=6, help="zlib compression level (0-9)")
+    parser.add_argument('--verify', metavar='BUNDLE', help="Only verify the bundle against its manifest")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.verify:
+        bad = AssetBundle.open(args.verify).verify()
+        for name in bad:
+            print("Corrupt: %s" % name)
+        raise SystemExit(1 if bad else 0)
+
+    build_asset_bundle(args.source, args.output,
+                       convert_models=not args.no_convert_models,
+                       compress_textures=args.compress_textures,
+                       compression_level=args.compression_level)
+
+
+__all__ = [
+    'BUNDLE_FORMAT',
+    'BUNDLE_MANIFEST',
+    'DEFAULT_ASSET_BUNDLE',
+    'build_asset_bundle',
+    'AssetBundle',
+    'MOUNTED_BUNDLES',
+    'mount_asset_bundle',
+    'bundle_variant'
+]
+
+
+if __name__ == '__main__':
+    main()
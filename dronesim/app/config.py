@@ -0,0 +1,71 @@
+
+'''
+Panda3D configuration and the virtual assets directory, set up when this module is first imported.
+Modules that load assets or open windows import this, so that the set-up only happens when Panda3D is used.
+'''
+
+from panda3d.core import (
+    loadPrcFileData,
+    VirtualFileSystem,
+    VirtualFileMountSystem,
+    Filename,
+    getModelPath
+)
+
+from dronesim._base import PACKAGE_BASE
+from .bundle import DEFAULT_ASSET_BUNDLE, mount_asset_bundle
+
+import os
+
+
+# Default config data for the app. You can set your own by using
+# loadPrcFileData or a config file before creating the Application.
+DEFAULT_CONFIG_VARS = """
+vfs-case-sensitive 0
+
+window-title Drone Simulator
+win-size 1280 720
+
+textures-power-2 up
+texture-minfilter mipmap
+texture-anisotropic-degree 8
+"""
+loadPrcFileData("", DEFAULT_CONFIG_VARS)
+
+ASSETS_VFS = VirtualFileSystem.get_global_ptr()
+
+
+# Asset bundle to mount instead of the `assets/` folder. The package's bundle (see `dronesim.app.bundle`)
+# is used if it was built
+ASSET_BUNDLE = os.environ.get('DRONESIM_ASSET_BUNDLE', DEFAULT_ASSET_BUNDLE)
+
+
+def mount_assets_folder(vfs: VirtualFileSystem = ASSETS_VFS):
+    '''
+    Instruct the Virtual File System to mount the real `assets/` folder (or the packed asset bundle,
+    if there is one) to the virtual directory `/assets/`
+    '''
+    if ASSET_BUNDLE and os.path.isfile(ASSET_BUNDLE):
+        mount_asset_bundle(ASSET_BUNDLE, '/assets/', vfs)
+    else:
+        vfs.mount(
+            VirtualFileMountSystem(Filename.from_os_specific(
+                os.path.join(PACKAGE_BASE, 'assets/')
+            )),
+            '/assets/',
+            VirtualFileSystem.MFReadOnly
+        )
+
+    # Add virtual assets directory to load models and scenes from to the loader's search path
+    getModelPath().prepend_directory('/assets')
+
+
+mount_assets_folder()
+
+
+__all__ = [
+    'DEFAULT_CONFIG_VARS',
+    'ASSETS_VFS',
+    'ASSET_BUNDLE',
+    'mount_assets_folder'
+]
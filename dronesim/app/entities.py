@@ -0,0 +1,133 @@
+
+import itertools
+
+import pyee
+
+from direct.actor.Actor import Actor
+
+from dronesim.actor import VehicleModel
+
+from typing import Optional, Dict, Iterator, Tuple, Type, TypeVar, Union
+
+
+EntityT = TypeVar('EntityT')
+
+
+class EntityRegistry(pyee.EventEmitter):
+    '''
+    Holds the entities of the application, with an index of entities by each of their types (classes)
+    and a stable ID for each entity. Adding, removing and looking up entities of a type does not depend on
+    the number of entities.
+
+    One of the vehicles is the active (selected) vehicle. The first vehicle added becomes active, and
+    if the active vehicle is removed, the next one is selected.
+
+    Events (with pyee):
+        'added' (entity_id, entity), 'removed' (entity_id, entity),
+        'active_vehicle' (vehicle or None) when the active vehicle changes.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self._ids = itertools.count(1)
+        self._entities: Dict[int, Actor] = {}
+        # Entity IDs by the identity of the entity object
+        self._entity_ids: Dict[int, int] = {}
+        # For each class, the entities that are instances of it (in insertion order)
+        self._by_type: Dict[type, Dict[int, Actor]] = {}
+        self._active_vehicle_id: Optional[int] = None
+        # Tuples returned by `of_type()`, dropped when entities of the type change
+        self._of_type_cache: Dict[type, tuple] = {}
+
+    def add(self, entity: Actor) -> int:
+        '''Add the entity (if not added yet), returning its ID'''
+        entity_id = self._entity_ids.get(id(entity))
+        if entity_id is not None:
+            return entity_id
+        entity_id = next(self._ids)
+        self._entities[entity_id] = entity
+        self._entity_ids[id(entity)] = entity_id
+        for cls in type(entity).__mro__:
+            self._by_type.setdefault(cls, {})[entity_id] = entity
+            self._of_type_cache.pop(cls, None)
+        self.emit('added', entity_id, entity)
+
+        if self._active_vehicle_id is None and isinstance(entity, VehicleModel):
+            self.set_active_vehicle(entity)
+        return entity_id
+
+    def remove(self, entity: Union[Actor, int]) -> Optional[Actor]:
+        '''Remove the entity (or the entity with the ID). Returns the removed entity, or None if it wasn't added'''
+        entity_id = entity if isinstance(entity, int) else self._entity_ids.get(id(entity))
+        entity = self._entities.pop(entity_id, None)
+        if entity is None:
+            return None
+        del self._entity_ids[id(entity)]
+        for cls in type(entity).__mro__:
+            self._by_type[cls].pop(entity_id, None)
+            self._of_type_cache.pop(cls, None)
+        self.emit('removed', entity_id, entity)
+
+        if entity_id == self._active_vehicle_id:
+            self._active_vehicle_id = None
+            # Select the next vehicle (in ID order), wrapping around
+            vehicles = self._by_type.get(VehicleModel, {})
+            next_id = next((vid for vid in vehicles if vid > entity_id), next(iter(vehicles), None))
+            self.set_active_vehicle(vehicles.get(next_id))
+        return entity
+
+    def get(self, entity_id: int) -> Optional[Actor]:
+        return self._entities.get(entity_id)
+
+    def id_of(self, entity: Actor) -> Optional[int]:
+        return self._entity_ids.get(id(entity))
+
+    def of_type(self, cls: Type[EntityT]) -> Tuple[EntityT, ...]:
+        '''Entities that are instances of the class. The tuple is cached till an entity of the class is added or removed'''
+        entities = self._of_type_cache.get(cls)
+        if entities is None:
+            entities = self._of_type_cache[cls] = tuple(self._by_type.get(cls, {}).values())
+        return entities
+
+    def count_of_type(self, cls: type) -> int:
+        return len(self._by_type.get(cls, ()))
+
+    def __iter__(self) -> Iterator[Actor]:
+        return iter(self._entities.values())
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    def __contains__(self, entity: Actor) -> bool:
+        return id(entity) in self._entity_ids
+
+    @property
+    def active_vehicle(self) -> Optional[VehicleModel]:
+        if self._active_vehicle_id is None:
+            return None
+        return self._entities[self._active_vehicle_id]
+
+    def set_active_vehicle(self, vehicle: Optional[VehicleModel]):
+        vehicle_id = self.id_of(vehicle) if vehicle is not None else None
+        if vehicle is not None and (vehicle_id is None or not isinstance(vehicle, VehicleModel)):
+            raise ValueError("%r is not a vehicle added to the registry" % vehicle)
+        if vehicle_id != self._active_vehicle_id:
+            self._active_vehicle_id = vehicle_id
+            self.emit('active_vehicle', vehicle)
+
+    def cycle_active_vehicle(self, step: int = 1) -> Optional[VehicleModel]:
+        '''Make the next (or `step`-th next) vehicle active, and return it'''
+        vehicle_ids = list(self._by_type.get(VehicleModel, {}).keys())
+        if not vehicle_ids:
+            return None
+        if self._active_vehicle_id in vehicle_ids:
+            idx = (vehicle_ids.index(self._active_vehicle_id) + step) % len(vehicle_ids)
+        else:
+            idx = 0
+        self.set_active_vehicle(self._entities[vehicle_ids[idx]])
+        return self.active_vehicle
+
+
+__all__ = [
+    'EntityRegistry'
+]
@@ -12,7 +12,10 @@ from direct.showbase.Loader import Loader
 from direct.task import Task, TaskManagerGlobal
 
 from os import PathLike
-from dronesim.types import PandaFilePath
+# Panda3D configuration and the virtual assets directory, to load models from
+from dronesim.app import config as _config
+from dronesim.panda3d_types import PandaFilePath
+from dronesim.model_cache import ModelCache, DEFAULT_MODEL_CACHE
 from typing import Optional, Union, List
 
 
@@ -28,11 +31,14 @@ class Panda3DEnvironment(NodePath):
                  attach_lights: List[Union[Light, NodePath]] = [],
                  enable_dull_ambient_light: bool = True,
                  loader: Loader = DEFAULT_LOADER,
-                 task_mgr: Task.TaskManager = TaskManagerGlobal.taskMgr):
+                 task_mgr: Task.TaskManager = TaskManagerGlobal.taskMgr,
+                 model_cache: Optional[ModelCache] = DEFAULT_MODEL_CACHE):
         super().__init__(name)
 
         self._attach_lights = attach_lights
         self._loader = loader
+        # Converted (glTF) scenes are cached on disk, so that they are only converted on the first load
+        self._model_cache = model_cache
 
         # Add ambient lighting (minimum scene light)
         if enable_dull_ambient_light:
@@ -56,7 +62,10 @@ class Panda3DEnvironment(NodePath):
         or a File path to the model (physical or virtual file)'''
         if isinstance(scene_path, (str, PathLike, Filename)):
             # Load scene from given path
-            scene_model = await self._loader.load_model(scene_path, blocking=False)
+            if self._model_cache is not None:
+                scene_model = await self._model_cache.load_model_async(scene_path, self._loader)
+            else:
+                scene_model = await self._loader.load_model(scene_path, blocking=False)
         elif isinstance(scene_path, NodePath):
             scene_model = scene_path
         elif isinstance(scene_path, PandaNode):
@@ -0,0 +1,164 @@
+
+from panda3d.core import (
+    GraphicsEngine,
+    GraphicsPipe,
+    GraphicsPipeSelection,
+    GraphicsOutput,
+    loadPrcFileData,
+    FrameBufferProperties,
+    WindowProperties,
+    NodePath
+)
+
+from direct.actor.Actor import Actor
+from direct.task import Task, TaskManagerGlobal
+from direct.showbase.EventManagerGlobal import eventMgr
+
+from dronesim.sensor.panda3d.camera import Panda3DCameraSensor
+from dronesim.sensor.panda3d.atlas import CameraSensorAtlas
+
+from .environment import Panda3DEnvironment
+from .entities import EntityRegistry
+
+import logging
+from typing import Optional, List
+
+
+LOG = logging.getLogger(__name__)
+
+# Software renderer from `p3tinydisplay`, which needs neither a display nor a GPU
+SOFTWARE_DISPLAY_MODULE = "p3tinydisplay"
+SOFTWARE_OFFSCREEN_PIPE = "TinyOffscreenGraphicsPipe"
+
+
+class HeadlessRenderer:
+    '''
+    Renders the environment only for camera sensors, into offscreen buffers without opening a window.
+
+    Unlike `SimulatorApplication`, there is no HUD, camera controller or input handling, and nothing is
+    rendered till `render_frame()` is called (for example by `DroneSimulator.update_sensors()`).
+
+    :param Panda3DEnvironment env: Environment (scene) to render.
+    :param entities: Entities (vehicles) to add to the scene. They are updated before each render.
+    :param str pipe_type: Name of the graphics pipe type to render with. The default is the software renderer,
+    which works on servers without display and GPU. Use None to use the default (hardware) pipe.
+    :param str display_module: Display module to load the pipe type from, if it is not loaded yet.
+    '''
+
+    def __init__(self,
+                 env: Optional[Panda3DEnvironment] = None,
+                 *entities: Actor,
+                 pipe_type: Optional[str] = SOFTWARE_OFFSCREEN_PIPE,
+                 display_module: Optional[str] = SOFTWARE_DISPLAY_MODULE,
+                 task_mgr: Task.TaskManager = TaskManagerGlobal.taskMgr):
+        self._task_mgr = task_mgr
+        self.entities = EntityRegistry()
+        self._sensors: List[Panda3DCameraSensor] = []
+        self._atlases: List[CameraSensorAtlas] = []
+
+        self.engine = GraphicsEngine.get_global_ptr()
+        self.pipe = self._make_pipe(pipe_type, display_module)
+
+        # Minimal buffer to host the graphics state the sensor buffers share
+        _prop = FrameBufferProperties()
+        _prop.set_rgb_color(True)
+        self.host: GraphicsOutput = self.engine.make_output(
+            self.pipe,
+            "headless_host",
+            -100,
+            _prop,
+            WindowProperties.size(1, 1),
+            GraphicsPipe.BF_refuse_window
+        )
+        if self.host is None:
+            raise RuntimeError(
+                "Could not create an offscreen buffer with pipe '%s'" % self.pipe.get_type())
+
+        self.render = NodePath("render")
+        self.entity_holder: NodePath = self.render.attach_new_node(
+            "entity_holder")
+        self.scene_holder: NodePath = self.render.attach_new_node(
+            "environment_holder")
+
+        self.add_entity(*entities)
+        if env is not None:
+            env.reparent_to(self.scene_holder)
+        self.reset_lights()
+
+        # Scene models are loaded asynchronously, which needs events to be processed
+        eventMgr.restart()
+
+    @staticmethod
+    def _make_pipe(pipe_type: Optional[str], display_module: Optional[str]) -> GraphicsPipe:
+        if pipe_type is not None and display_module is not None:
+            # Read when the pipe selection is created. Loading the module by hand (`make_module_pipe()`) would
+            # also load the default display module and open a pipe on the X display
+            loadPrcFileData('', 'load-display %s\naux-display %s' % (display_module, display_module))
+        selection = GraphicsPipeSelection.get_global_ptr()
+
+        def _find_pipe_type():
+            for idx in range(selection.get_num_pipe_types()):
+                if selection.get_pipe_type(idx).get_name() == pipe_type:
+                    return selection.get_pipe_type(idx)
+
+        if pipe_type is None:
+            pipe = selection.make_default_pipe()
+        else:
+            found_type = _find_pipe_type()
+            pipe = selection.make_pipe(found_type) if found_type else None
+        if pipe is None:
+            raise RuntimeError("Graphics pipe '%s' is not available" % (pipe_type or 'default'))
+        LOG.info("Headless rendering using %s" % pipe.get_type())
+        return pipe
+
+    def add_entity(self, *entity: Actor):
+        for e in entity:
+            self.entities.add(e)
+            e.reparent_to(self.entity_holder)
+
+    def attach_sensor(self, *sensors: Panda3DCameraSensor):
+        '''Create the offscreen buffers of the camera sensors and make them render this scene'''
+        for sensor in sensors:
+            sensor.attach_to_env(self.render, self.engine, self.host)
+            self._sensors.append(sensor)
+
+    def attach_sensor_atlas(self, atlas: CameraSensorAtlas, *sensors: Panda3DCameraSensor):
+        '''
+        Create the shared buffer of the atlas and add the camera sensors to it, rendering this scene.
+        All sensors of the atlas are read back together, with a single copy per frame.
+        '''
+        if atlas.texfbuf is None:
+            atlas.attach_to_env(self.engine, self.host)
+            self._atlases.append(atlas)
+        for sensor in sensors:
+            atlas.add_sensor(sensor, self.render)
+            self._sensors.append(sensor)
+
+    @property
+    def sensors(self) -> List[Panda3DCameraSensor]:
+        return self._sensors
+
+    def reset_lights(self):
+        '''Move `Light`s found in the environment to the render root, so that they light the entire scene'''
+        self.render.clear_light()
+        for light in self.scene_holder.find_all_matches('**/+Light'):
+            light.parent.wrt_reparent_to(self.render)
+            self.render.set_light(light)
+
+    def render_frame(self):
+        '''Sync the entities to their vehicle's state and render a frame into all sensor buffers'''
+        # Process scheduled tasks, such as pending scene loads
+        self._task_mgr.step()
+        for entity in self.entities:
+            entity.update()
+        self.engine.render_frame()
+
+    def destroy(self):
+        for atlas in self._atlases:
+            atlas.destroy(self.engine)
+        self._atlases.clear()
+        for sensor in self._sensors:
+            if sensor.texfbuf is not None:
+                self.engine.remove_window(sensor.texfbuf)
+        self._sensors.clear()
+        self.engine.remove_window(self.host)
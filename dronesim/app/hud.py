@@ -5,11 +5,12 @@ from panda3d.core import (
     NodePath,
     CardMaker,
     Texture,
+    TextNode,
     TransparencyAttrib,
     LTexCoord
 )
 from direct.gui.DirectGui import DirectFrame, OnscreenImage
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Callable, Iterator, Dict, List, Any
 
 from .attrib_presets import COLOR_BLEND_INVERT
 
@@ -25,6 +26,106 @@ class HUDFieldMixin:
     def __shouldshow__(self, field: str): return True
 
 
+def iter_hud_lines(d: dict, serializer: Callable[[Any], str] = str, level: int = 0, path: tuple = ()) -> Iterator[Tuple[tuple, str]]:
+    '''Flatten a nested dictionary into (key path, text) of each HUD line, with nested dictionaries indented'''
+    INDENT = '  '
+    for k, v in d.items():
+        if isinstance(v, dict):
+            yield path + (k,), '%s%s:' % (INDENT*level, k)
+            yield from iter_hud_lines(v, serializer, level+1, path + (k,))
+        else:
+            yield path + (k,), '%s%s: %s' % (INDENT*level, k, serializer(v))
+
+
+class HUDTextPanel(NodePath):
+    '''
+    Block of text lines showing a nested dictionary, with a separate text node for each line (field).
+
+    Lines are only regenerated when their text changes, and `update()` only refreshes the panel at most
+    `refresh_rate` times per second, so that showing frequently changing values does not rebuild all the
+    text geometry every frame.
+    '''
+
+    def __init__(self,
+                 name: str,
+                 parent: Optional[NodePath] = None,
+                 scale: float = 0.06,
+                 pos: Tuple[float, float] = (0, 0),
+                 align: int = TextNode.ALeft,
+                 fg: tuple = (1, 1, 1, 1),
+                 bg: Optional[tuple] = None,
+                 refresh_rate: Optional[float] = 10.0):
+        super().__init__(name)
+        if parent is not None:
+            self.reparent_to(parent)
+        self.set_scale(scale)
+        self.set_pos(pos[0], 0, pos[1])
+        self.align = align
+        self.fg = fg
+        self.bg = bg
+        self.refresh_rate = refresh_rate
+
+        # Line nodes, in order of the fields
+        self._lines: List[NodePath] = []
+        self._line_text: List[Optional[str]] = []
+        # Line number of each field, by its key path
+        self._fields: Dict[tuple, int] = {}
+        self._last_refresh: Optional[float] = None
+        self.regenerated_lines = 0
+
+    def _make_line(self, index: int) -> NodePath:
+        text = TextNode('%s_line%d' % (self.get_name(), index))
+        text.set_align(self.align)
+        text.set_text_color(*self.fg)
+        if self.bg is not None:
+            text.set_card_color(*self.bg)
+            text.set_card_as_margin(0.1, 0.1, 0.1, 0.1)
+        line = self.attach_new_node(text)
+        line.set_z(-index * text.get_line_height())
+        return line
+
+    def due(self, now: float) -> bool:
+        '''Whether the panel should be refreshed at time `now` (seconds)'''
+        if self.refresh_rate is None or self._last_refresh is None:
+            return True
+        return now - self._last_refresh >= 1.0 / self.refresh_rate
+
+    def update(self, d: dict, serializer: Callable[[Any], str] = str, now: Optional[float] = None, force: bool = False) -> bool:
+        '''Show the dictionary, if the panel is due for a refresh. Returns whether it was refreshed'''
+        if not force and now is not None and not self.due(now):
+            return False
+        self._last_refresh = now
+        self.set_lines(iter_hud_lines(d, serializer))
+        return True
+
+    def set_lines(self, lines):
+        '''Show the (key path, text) lines, regenerating only the lines whose text changed'''
+        count = 0
+        for key, text in lines:
+            if count == len(self._lines):
+                self._lines.append(self._make_line(count))
+                self._line_text.append(None)
+            if self._line_text[count] != text:
+                self._lines[count].node().set_text(text)
+                self._line_text[count] = text
+                self.regenerated_lines += 1
+            self._fields[key] = count
+            count += 1
+
+        # Clear lines of fields that are gone
+        for idx in range(count, len(self._lines)):
+            if self._line_text[idx]:
+                self._lines[idx].node().clear_text()
+                self._line_text[idx] = ''
+        if count < len(self._lines):
+            self._fields = {k: v for k, v in self._fields.items() if v < count}
+
+    def get_line(self, key: tuple) -> Optional[NodePath]:
+        '''Node of the line showing the field at the key path'''
+        idx = self._fields.get(key)
+        return self._lines[idx] if idx is not None else None
+
+
 class HUDFrame(DirectFrame):
     def __init__(self, parent: Optional[NodePath] = None, **kwargs):
         super().__init__(parent=parent, **kwargs)
@@ -1,10 +1,6 @@
 
 from panda3d.core import (
-    loadPrcFileData,
-    VirtualFileSystem,
-    VirtualFileMountSystem,
     Filename,
-    getModelPath,
     ButtonHandle,
     KeyboardButton,
     DirectionalLight,
@@ -19,48 +15,37 @@ from panda3d.core import (
 from direct.showbase.ShowBase import ShowBase
 from direct.showbase.DirectObject import DirectObject
 from direct.gui.OnscreenImage import OnscreenImage
-from direct.gui.OnscreenText import OnscreenText
 from direct.actor.Actor import Actor
 from direct.task.Task import Task
 
-from dronesim._base import PACKAGE_BASE
 from dronesim.interface import IDroneControllable, DroneAction
 from dronesim.utils import IterEnumMixin, square_aspect2d_frame
+from dronesim.sensor.panda3d.visibility import MAIN_CAMERA_MASK
 
-from .hud import HUDFieldMixin, HUDFrame, Crosshair
+from .config import DEFAULT_CONFIG_VARS, ASSETS_VFS, mount_assets_folder
+from .hud import HUDFieldMixin, HUDFrame, HUDTextPanel, Crosshair, iter_hud_lines
 from .environment import Panda3DEnvironment
 from .camera_control import FreeCam, FPCamera, TPCamera
 from .asset_manager import GLOBAL_ASSET_HOLDER
+from .entities import EntityRegistry
 
 from dronesim.actor import VehicleModel
 
-import os
 import glm
 import enum
 import logging
 from dataclasses import dataclass
 
-from dronesim.types import InputState, PandaFilePath, StepRC
-from typing import Optional, Union, Callable, List, Any
+from dronesim.types import InputState, StepRC
+from dronesim.panda3d_types import PandaFilePath
+from typing import Optional, Union, Callable, List, Tuple, Any
 
 
-# Default config data for the app. You can set your own by using
-# loadPrcFileData or a config file before creating the Application.
-DEFAULT_CONFIG_VARS = """
-vfs-case-sensitive 0
-
-window-title Drone Simulator
-win-size 1280 720
-
-textures-power-2 up
-texture-minfilter mipmap
-texture-anisotropic-degree 8
-"""
-loadPrcFileData("", DEFAULT_CONFIG_VARS)
-
-ASSETS_VFS = VirtualFileSystem.get_global_ptr()
 LIGHT_SHADOW_CASTER = (DirectionalLight, Spotlight)
 
+# Asset (from the assets config) of the texture atlas with the crosshair
+CROSSHAIR_TEXTURE_ASSET = "tex.ui.atlas1"
+
 # Colors used for some HUD elements as foreground (text color) and background
 HUD_COLORS = dict(
     fg=(1, 1, 1, 1),
@@ -70,25 +55,6 @@ HUD_COLORS = dict(
 LOG = logging.getLogger(__name__)
 
 
-def mount_assets_folder(vfs: VirtualFileSystem = ASSETS_VFS):
-    '''
-    Instruct the Virtual File System to mount the real `assets/` folder to the virtual directory `/assets/`
-    '''
-    vfs.mount(
-        VirtualFileMountSystem(Filename.from_os_specific(
-            os.path.join(PACKAGE_BASE, 'assets/')
-        )),
-        '/assets/',
-        VirtualFileSystem.MFReadOnly
-    )
-
-    # Add virtual assets directory to load models and scenes from to the loader's search path
-    getModelPath().prepend_directory('/assets')
-
-
-mount_assets_folder()
-
-
 def objectHUDFormatter(o):
     '''Simple JSON string formatter for various data types'''
     if isinstance(o, enum.Enum):
@@ -182,12 +148,15 @@ class SimulatorApplication(ShowBase):
         env: Panda3DEnvironment,
         *entities: Union[Actor, VehicleModel],
         assets_file: PandaFilePath = DEFAULT_ASSETS,
+        hud_refresh_rate: Optional[float] = 10.0,
         **kwargs
     ):
         super().__init__(**kwargs)
         self.disable_mouse()  # Disable default mouse control (NOTE: Misleading name!)
         self.external_shader_pipelines = []
         self._assets_load_file = assets_file
+        # Times per second the HUD text is refreshed (None for every frame)
+        self._hud_refresh_rate = hud_refresh_rate
 
         # Object that will handle events by hooking handlers to them.
         # A separate object is created (rather than using `self`) so that default
@@ -195,8 +164,9 @@ class SimulatorApplication(ShowBase):
         # See: https://discourse.panda3d.org/t/issue-when-using-base-accept-window-event-and-also-setting-window-size-outside-of-window-event/28959/2
         self._event_hook = DirectObject()
 
-        # Holds all entities (and vehicles) to be updated
-        self._entities: List[Actor] = []
+        # Holds all entities (and vehicles) to be updated, and the selected vehicle
+        self.entities = EntityRegistry()
+        self.entities.on('active_vehicle', self._on_active_vehicle_changed)
 
         # Entity graph (holds all scene models)
         self.entity_holder: NodePath = self.render.attach_new_node(
@@ -215,6 +185,8 @@ class SimulatorApplication(ShowBase):
 
         self.camera.set_pos(0, -10, 10)
         self.camLens.set_near(0.1)
+        # Main view doesn't see nodes hidden from it, and sees those hidden from sensors
+        self.cam.node().set_camera_mask(MAIN_CAMERA_MASK)
 
         # State
         self.camState = CameraController(app=self)
@@ -239,24 +211,25 @@ class SimulatorApplication(ShowBase):
         self._init_ui()
 
     def add_entity(self, *entity: Actor):
-        self._entities.extend(entity)
-
         # Reparent all entities to the entity holder node
         for e in entity:
+            self.entities.add(e)
             e.reparent_to(self.entity_holder)
 
+    def remove_entity(self, *entity: Actor):
+        for e in entity:
+            if self.entities.remove(e) is not None:
+                e.detach_node()
+
     @property
-    def vehicles(self) -> List[VehicleModel]:
-        '''Filters all attached entities for VehicleModel objects.'''
-        return list(filter(lambda x: isinstance(x, VehicleModel), self._entities))
+    def vehicles(self) -> Tuple[VehicleModel, ...]:
+        '''All attached entities that are VehicleModel objects.'''
+        return self.entities.of_type(VehicleModel)
 
     @property
     def activeVehicleNode(self) -> Optional[VehicleModel]:
         '''Returns the active (selected) vehicle object, if any.'''
-        v_list = self.vehicles
-        if len(v_list) > 0:
-            # TODO: Add a way for user to select one of these using dropdown and keybind
-            return v_list[0]
+        return self.entities.active_vehicle
 
     @property
     def activeVehicleController(self) -> Optional[IDroneControllable]:
@@ -364,6 +337,17 @@ class SimulatorApplication(ShowBase):
                 self.camState.mouseCapture = False
                 self.camState()
 
+    def eCycleActiveVehicle(self, step: int = 1):
+        '''Keybind event handler to select the next (or previous) vehicle'''
+        vehicle = self.entities.cycle_active_vehicle(step)
+        if vehicle is not None:
+            LOG.info("Selected vehicle %d (%s)" % (self.entities.id_of(vehicle), vehicle.get_name()))
+
+    def _on_active_vehicle_changed(self, vehicle: Optional[VehicleModel]):
+        # Cameras following the vehicle need to pick up the new one
+        if hasattr(self, 'camState'):
+            self.camState()
+
     def eHandleVehicleStateDump(self):
         '''Dump the current state object of the active Vehicle to stdout'''
         print(self.activeVehicleController.get_current_state(), flush=True)
@@ -388,7 +372,7 @@ class SimulatorApplication(ShowBase):
             KeyboardButton.shift())
 
     def _updateEntities(self):
-        for entity in self._entities:
+        for entity in self.entities:
             entity.update()
 
     def _updateCamera(self):
@@ -466,6 +450,8 @@ class SimulatorApplication(ShowBase):
         self._event_hook.accept("shift-f3", self.eConnectPStats)
         self._event_hook.accept("f5", self.eToggleCameraMode)
         self._event_hook.accept("f6", self.eToggleControlMode)
+        self._event_hook.accept("tab", self.eCycleActiveVehicle, [1])
+        self._event_hook.accept("shift-tab", self.eCycleActiveVehicle, [-1])
         self._event_hook.accept("f11", self.eToggleFullscreen)
         self._event_hook.accept("\\", self.eHandleVehicleStateDump)
 
@@ -473,6 +459,8 @@ class SimulatorApplication(ShowBase):
 
     def _init_hud(self):
         # TODO: Make a HUD class and put stuff in there and control it using methods
+        # Assets acquired from the global asset holder for the HUD, released when it is destroyed
+        self._acquired_assets: List[str] = []
         HUD_PADDING = 0.08
         self.HUD_holder = HUDFrame(
             parent=self.aspect2d,
@@ -481,49 +469,62 @@ class SimulatorApplication(ShowBase):
             frameColor=(1, 1, 1, 0)
         )
 
-        self.HUD_basic_info = OnscreenText(
+        self.HUD_basic_info = HUDTextPanel(
+            "HUD_basic_info",
             parent=self.HUD_holder,
             scale=0.06,
             align=TextNode.ARight,
             pos=(self.a2dRight - HUD_PADDING /
                  self.a2dRight/2, self.a2dTop - HUD_PADDING),
-            mayChange=True,
+            refresh_rate=self._hud_refresh_rate,
             **HUD_COLORS
         )
 
-        self.HUD_debug_info = OnscreenText(
+        self.HUD_debug_info = HUDTextPanel(
+            "HUD_debug_info",
             parent=self.HUD_holder,
             scale=0.06,
             align=TextNode.ALeft,
             pos=(self.a2dLeft - HUD_PADDING/self.a2dLeft /
                  2, self.a2dTop - HUD_PADDING),
-            mayChange=True,
+            refresh_rate=self._hud_refresh_rate,
             **HUD_COLORS
         )
         # Hide debug view by default
         self.HUD_debug_info.hide()
 
-        # Crosshair
-        crosshair_tex = self.loader.loadTexture(
-            Filename("/assets/textures/ui_1.png"),
-            minfilter=SamplerState.FT_nearest,
-            magfilter=SamplerState.FT_nearest
-        )
+        # Crosshair, from the UI texture atlas (preloaded with the other assets)
+        if CROSSHAIR_TEXTURE_ASSET in GLOBAL_ASSET_HOLDER.asset_data:
+            crosshair_tex = GLOBAL_ASSET_HOLDER.acquire(CROSSHAIR_TEXTURE_ASSET)
+            self._acquired_assets.append(CROSSHAIR_TEXTURE_ASSET)
+            uv_range = GLOBAL_ASSET_HOLDER.asset_data[CROSSHAIR_TEXTURE_ASSET]['hud']['crosshair']['uv_range']
+            tex_uv_range = tuple(LTexCoord(*uv) for uv in uv_range)
+        else:
+            # Asset config without the UI atlas
+            crosshair_tex = self.loader.loadTexture(
+                Filename("/assets/textures/ui_1.png"),
+                minfilter=SamplerState.FT_nearest,
+                magfilter=SamplerState.FT_nearest
+            )
+            tex_uv_range = (LTexCoord(4/128, 1 - (11/128)),
+                            LTexCoord(11/128, 1 - (4/128)))
         self.HUD_crosshair = Crosshair(
             "player_crosshair",
             crosshair_tex,
             frame=square_aspect2d_frame(0.02),
-            tex_uv_range=(LTexCoord(4/128, 1 - (11/128)),
-                          LTexCoord(11/128, 1 - (4/128)))
+            tex_uv_range=tex_uv_range
         )
         self.HUD_crosshair.reparent_to(self.HUD_holder)
 
     def _update_hud(self):
         if not self.HUD_holder.isHidden():
-            self.HUD_basic_info.setText(self.formatDictToHUD(
-                self.camState.hud(), serializer=objectHUDFormatter))
+            now = globalClock.getFrameTime()
+            # Panels only regenerate the lines that changed, and only refresh at the HUD refresh rate
+            if self.HUD_basic_info.due(now):
+                self.HUD_basic_info.update(
+                    self.camState.hud(), serializer=objectHUDFormatter, now=now)
 
-            if not self.HUD_debug_info.isHidden():
+            if not self.HUD_debug_info.isHidden() and self.HUD_debug_info.due(now):
                 vehicle = self.activeVehicleController
                 vehicle_debug_data = vehicle.get_debug_data() if vehicle else {}
 
@@ -533,23 +534,26 @@ class SimulatorApplication(ShowBase):
                     'active_vehicle': vehicle_debug_data,
                     'camera': self.camState.camMode.state
                 })
-                self.HUD_debug_info.setText(
-                    self.formatDictToHUD(
-                        self.debuggerState, serializer=objectHUDFormatter)
-                )
+                self.HUD_debug_info.update(
+                    self.debuggerState, serializer=objectHUDFormatter, now=now)
+
+    def _destroy_hud(self):
+        self.HUD_holder.destroy()
+        for name in self._acquired_assets:
+            GLOBAL_ASSET_HOLDER.release(name)
+        self._acquired_assets.clear()
 
     def _init_ui(self):
         self._init_keybinds()
         self._init_assets()
         self._init_hud()
 
+    def destroy(self):
+        if getattr(self, '_acquired_assets', None) is not None:
+            self._destroy_hud()
+            self._acquired_assets = None
+        super().destroy()
+
     @classmethod
     def formatDictToHUD(cls, d: dict, serializer: Callable[[Any], str] = str, level=0) -> str:
-        INDENT = '  '
-        return '\n'.join(
-            '%s%s:\n%s' % (
-                INDENT*level, k, cls.formatDictToHUD(v, serializer, level+1))
-            if isinstance(v, dict)
-            else ('%s%s: %s' % (INDENT*level, k, serializer(v)))
-            for k, v in d.items()
-        )
+        return '\n'.join(text for _, text in iter_hud_lines(d, serializer, level))
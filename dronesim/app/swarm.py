@@ -0,0 +1,232 @@
+
+from panda3d.core import (
+    NodePath,
+    Filename,
+    Shader,
+    Texture,
+    GeomEnums,
+    GeomVertexFormat,
+    GeomVertexData,
+    GeomVertexWriter,
+    GeomTriangles,
+    Geom,
+    GeomNode,
+    OmniBoundingVolume,
+    LVecBase3f
+)
+
+from direct.actor.Actor import Actor
+from direct.showbase.Loader import Loader
+
+from dronesim.interface.control import IDroneControllable
+from dronesim.utils import hpr_to_matrix
+from dronesim.panda3d_types import PandaFilePath
+
+import numpy as np
+
+from typing import Optional, Union, Dict, Sequence, Tuple
+
+
+SWARM_VERTEX_SHADER = Filename("/assets/shaders/swarm_instanced.vert")
+SWARM_FRAGMENT_SHADER = Filename("/assets/shaders/swarm_instanced.frag")
+
+# Buffer texels (RGBA float) per instance: the 4 rows of its transform matrix
+TEXELS_PER_INSTANCE = 4
+
+
+def make_box_impostor(bounds: Tuple[LVecBase3f, LVecBase3f], name: str = 'impostor') -> NodePath:
+    '''Box with the given bounds (min, max corners), to draw in place of a detailed model far away'''
+    (x0, y0, z0), (x1, y1, z1) = bounds
+    vdata = GeomVertexData(name, GeomVertexFormat.get_v3n3(), Geom.UH_static)
+    vertex = GeomVertexWriter(vdata, 'vertex')
+    normal = GeomVertexWriter(vdata, 'normal')
+    tris = GeomTriangles(Geom.UH_static)
+    # Each face as (normal, 4 corners counter-clockwise seen from outside)
+    faces = (
+        ((0, -1, 0), ((x0, y0, z0), (x1, y0, z0), (x1, y0, z1), (x0, y0, z1))),
+        ((0, 1, 0), ((x1, y1, z0), (x0, y1, z0), (x0, y1, z1), (x1, y1, z1))),
+        ((-1, 0, 0), ((x0, y1, z0), (x0, y0, z0), (x0, y0, z1), (x0, y1, z1))),
+        ((1, 0, 0), ((x1, y0, z0), (x1, y1, z0), (x1, y1, z1), (x1, y0, z1))),
+        ((0, 0, 1), ((x0, y0, z1), (x1, y0, z1), (x1, y1, z1), (x0, y1, z1))),
+        ((0, 0, -1), ((x0, y1, z0), (x1, y1, z0), (x1, y0, z0), (x0, y0, z0)))
+    )
+    for idx, (face_normal, corners) in enumerate(faces):
+        for corner in corners:
+            vertex.add_data3(*corner)
+            normal.add_data3(*face_normal)
+        base = idx * 4
+        tris.add_vertices(base, base + 1, base + 2)
+        tris.add_vertices(base, base + 2, base + 3)
+    geom = Geom(vdata)
+    geom.add_primitive(tris)
+    node = GeomNode(name)
+    node.add_geom(geom)
+    return NodePath(node)
+
+
+def make_uav_swarm_model(shell_model: PandaFilePath = Filename("models/quad-shell.glb"),
+                         propellers: Optional[Dict[str, PandaFilePath]] = None) -> NodePath:
+    '''
+    Static copy of a UAV model (like `UAVDroneModel`'s) for instanced rendering: the shell with propellers
+    placed at their joints, in the rest pose, flattened into as few meshes as possible.
+    '''
+    if propellers is None:
+        prop_model = Filename("models/propeller.glb")
+        propellers = {"PropellerJoint%d" % idx: prop_model for idx in range(1, 5)}
+
+    actor = Actor({'modelRoot': shell_model, **{'p_%s' % k: v for k, v in propellers.items()}},
+                  anims={'modelRoot': {}})
+    model = NodePath('swarm_model')
+    actor.get_part('modelRoot').copy_to(model)
+    for bone in propellers.keys():
+        joint = actor.exposeJoint(None, 'modelRoot', bone)
+        propeller = actor.get_part('p_%s' % bone).copy_to(model)
+        propeller.set_mat(joint.get_mat(actor))
+    actor.cleanup()
+    actor.remove_node()
+    model.flatten_strong()
+    return model
+
+
+class _InstanceGroup:
+    '''Model drawn with hardware instancing, with transforms in a buffer texture'''
+
+    def __init__(self, name: str, model: NodePath, parent: NodePath, capacity: int):
+        self.capacity = capacity
+        self.node = model.copy_to(parent)
+        self.node.set_name(name)
+        self.texture = Texture('%s_instances' % name)
+        self.texture.setup_buffer_texture(
+            capacity * TEXELS_PER_INSTANCE, Texture.T_float, Texture.F_rgba32, GeomEnums.UH_dynamic)
+        self.node.set_shader_input('instance_data', self.texture)
+        # Instances are spread over the whole scene, so the model's own bounds can't be used for culling
+        self.node.node().set_bounds(OmniBoundingVolume())
+        self.node.node().set_final(True)
+        self.node.set_instance_count(0)
+
+    def write(self, matrices: np.ndarray):
+        count = len(matrices)
+        if count > 0:
+            data = np.frombuffer(self.texture.modify_ram_image(), np.float32)
+            data[:count * 16] = matrices.reshape(-1)
+        self.node.set_instance_count(count)
+        if count == 0:
+            self.node.hide()
+        else:
+            self.node.show()
+
+
+class SwarmRenderer(NodePath):
+    '''
+    Draws many drones of the same model with GPU instancing, taking all of their transforms from NumPy arrays.
+
+    Instead of a scene graph node (and an `Actor`) for each drone, each frame uploads one array of transforms,
+    and the model is drawn once for all drones. Drones farther than `lod_distance` from the camera are drawn with
+    a simple impostor (a box of the model's bounds, by default) instead.
+
+    Instance transforms are relative to the renderer node. The renderer needs shaders (GLSL 1.50), and the
+    shader files are loaded from the virtual assets directory.
+
+    :param model: Model to draw for each drone. Use `make_uav_swarm_model()` for the default UAV model.
+    :param int capacity: Maximum number of drones.
+    :param float lod_distance: Distance from `camera` beyond which the impostor is drawn. None to always draw the model.
+    :param NodePath camera: Camera used for the LOD distance.
+    :param NodePath impostor: Model to draw for far away drones.
+    '''
+
+    def __init__(self,
+                 name: str,
+                 model: Union[NodePath, PandaFilePath],
+                 capacity: int = 1024,
+                 lod_distance: Optional[float] = 50.0,
+                 camera: Optional[NodePath] = None,
+                 impostor: Optional[NodePath] = None,
+                 light_dir: Sequence[float] = (0.3, -0.4, 0.85),
+                 ambient: float = 0.35,
+                 loader: Optional[Loader] = None):
+        super().__init__(name)
+        if not isinstance(model, NodePath):
+            if loader is None:
+                from .environment import Panda3DEnvironment
+                loader = Panda3DEnvironment.DEFAULT_LOADER
+            model = loader.load_model(model)
+        self.capacity = capacity
+        self.lod_distance = lod_distance
+        self.camera = camera
+
+        shader = Shader.load(Shader.SL_GLSL, vertex=SWARM_VERTEX_SHADER, fragment=SWARM_FRAGMENT_SHADER)
+        self.set_shader(shader)
+        light = np.asarray(light_dir, dtype=np.float32)
+        self.set_shader_input('light_dir', LVecBase3f(*(light / np.linalg.norm(light))))
+        self.set_shader_input('ambient', ambient)
+
+        if impostor is None:
+            impostor = make_box_impostor(model.get_tight_bounds())
+        self._near = _InstanceGroup('%s_near' % name, model, self, capacity)
+        self._far = _InstanceGroup('%s_far' % name, impostor, self, capacity)
+
+        self._matrices = np.zeros((capacity, 4, 4), dtype=np.float32)
+        self._matrices[:, 3, 3] = 1.0
+        self._count = 0
+        self.near_count = 0
+        self.far_count = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def update(self, positions: np.ndarray, hprs: np.ndarray):
+        '''Set the transforms of all drones from N x 3 positions and N x 3 heading/pitch/roll angles (radians)'''
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        count = len(positions)
+        if count > self.capacity:
+            raise ValueError("%d drones exceed the capacity of %d" % (count, self.capacity))
+        matrices = self._matrices[:count]
+        matrices[:, :3, :3] = hpr_to_matrix(np.asarray(hprs).reshape(-1, 3))
+        matrices[:, 3, :3] = positions
+        self._count = count
+        self._upload()
+
+    def set_transforms(self, matrices: np.ndarray):
+        '''Set the transforms of all drones directly as N x 4 x 4 matrices (Panda3D's row-vector convention)'''
+        count = len(matrices)
+        if count > self.capacity:
+            raise ValueError("%d drones exceed the capacity of %d" % (count, self.capacity))
+        self._matrices[:count] = matrices
+        self._count = count
+        self._upload()
+
+    def update_from_controllers(self, controllers: Sequence[IDroneControllable]):
+        '''Set the transforms from the current state of each drone's controller, like `UAVDroneModel.update()`'''
+        positions = np.zeros((len(controllers), 3), dtype=np.float32)
+        hprs = np.zeros((len(controllers), 3), dtype=np.float32)
+        for idx, controller in enumerate(controllers):
+            state = controller.get_current_state()
+            transform_state = state[3].get('state') if state is not None else None
+            if transform_state is not None:
+                positions[idx] = tuple(transform_state['pos'])
+                rotx, roty, rotz = transform_state['angle']
+                hprs[idx] = (rotz, roty, rotx)
+        self.update(positions, hprs)
+
+    def _upload(self):
+        matrices = self._matrices[:self._count]
+        if self.lod_distance is None or self.camera is None:
+            near = matrices
+            far = matrices[:0]
+        else:
+            camera_pos = np.array(self.camera.get_pos(self), dtype=np.float32)
+            offset = matrices[:, 3, :3] - camera_pos
+            is_near = np.einsum('ij,ij->i', offset, offset) <= self.lod_distance ** 2
+            near = matrices[is_near]
+            far = matrices[~is_near]
+        self._near.write(near)
+        self._far.write(far)
+        self.near_count, self.far_count = len(near), len(far)
+
+
+__all__ = [
+    'make_box_impostor',
+    'make_uav_swarm_model',
+    'SwarmRenderer'
+]
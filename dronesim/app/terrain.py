@@ -0,0 +1,299 @@
+
+'''
+Streaming terrain: a large heightmap split into tiles of `GeoMipTerrain`, which are paged in and out
+asynchronously around a focus (the active vehicle), within a memory budget.
+'''
+
+from panda3d.core import (
+    GeoMipTerrain,
+    NodePath,
+    PNMImage,
+    Texture,
+    Filename,
+    LPoint3f
+)
+
+from direct.task import Task, TaskManagerGlobal
+
+from dronesim.panda3d_types import PandaFilePath
+from dronesim.sensor.raycast import TiledHeightfield
+from .asset_manager import estimate_asset_size
+
+import numpy as np
+
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from typing import Optional, Union, Dict, Set, Tuple
+
+
+LOG = logging.getLogger(__name__)
+
+TileIndex = Tuple[int, int]
+
+
+def load_heightmap(path: PandaFilePath) -> np.ndarray:
+    '''
+    Heights (float32, 0 to 1) of a grayscale heightmap image (physical or virtual file), with row 0 at the
+    bottom of the image (lowest y), as in `TiledHeightfield`. Save it with `numpy.save()` to memory-map
+    large heightmaps with `TiledHeightfield.from_file()`.
+    '''
+    image = PNMImage()
+    if not image.read(Filename(path)):
+        raise OSError("Could not read heightmap %s" % path)
+    image.make_grayscale()
+    image.remove_alpha()
+    image.set_maxval(65535)
+    # The texture's RAM image has the rows bottom to top
+    tex = Texture()
+    tex.load(image)
+    heights = np.frombuffer(tex.get_ram_image(), dtype=np.uint16).reshape(image.get_y_size(), image.get_x_size())
+    return heights.astype(np.float32) / 65535
+
+
+def _heightfield_image(heights: np.ndarray) -> PNMImage:
+    '''16-bit grayscale image of the heights (0 to 1), with row 0 at the bottom'''
+    rows, cols = heights.shape
+    tex = Texture()
+    tex.setup_2d_texture(cols, rows, Texture.T_unsigned_short, Texture.F_luminance)
+    tex.set_ram_image((np.clip(heights, 0, 1) * 65535 + 0.5).astype(np.uint16).tobytes())
+    image = PNMImage()
+    tex.store(image)
+    return image
+
+
+class _TerrainTile:
+    def __init__(self, terrain: GeoMipTerrain, root: NodePath, size: int):
+        self.terrain = terrain
+        self.root = root
+        self.size = size
+
+
+class TerrainStreamer(NodePath):
+    '''
+    Terrain of a large heightfield, rendered as a `GeoMipTerrain` per tile of the heightfield (see
+    `dronesim.sensor.raycast.TiledHeightfield`). Tiles within `load_radius` (world units) of the focus are
+    built on `workers` background threads and attached when ready, and tiles farther than `unload_radius`
+    are detached. When the tiles would exceed `memory_budget` (bytes), tiles farther than the ones to load
+    are unloaded first, and otherwise the farthest tiles are not loaded.
+
+    The level of detail of each tile's blocks is updated every frame with the focus as the focal point,
+    with full detail within `lod_near` and least detail beyond `lod_far` (world units). Tile borders are
+    kept at full detail so that neighbouring tiles match.
+
+    The heights are read from the same tiles as the physics and sensor height queries, which are available
+    with `height_at()` (or `heightfield`), also without rendering.
+
+    :param heightfield: The heightfield, or a heightmap image or `.npy` file to make it from (with `tile_size`,
+    `cell_size`, `height_scale` and `origin`).
+    :param focus: Node to page the terrain around, such as the active vehicle (see `set_focus()`).
+    :param task_mgr: Task manager to update the terrain every frame. If None, call `update()` instead.
+    '''
+
+    def __init__(self,
+                 heightfield: Union[TiledHeightfield, PandaFilePath],
+                 name: str = 'terrain',
+                 tile_size: int = 128,
+                 cell_size: float = 1.0,
+                 height_scale: float = 1.0,
+                 origin: tuple = (0.0, 0.0, 0.0),
+                 load_radius: Optional[float] = None,
+                 unload_radius: Optional[float] = None,
+                 memory_budget: int = 256 * 1024 * 1024,
+                 block_size: int = 32,
+                 lod_near: Optional[float] = None,
+                 lod_far: Optional[float] = None,
+                 workers: int = 2,
+                 focus: Optional[NodePath] = None,
+                 task_mgr: Optional[Task.TaskManager] = TaskManagerGlobal.taskMgr):
+        super().__init__(name)
+        if not isinstance(heightfield, TiledHeightfield):
+            path = os.fspath(heightfield) if not isinstance(heightfield, Filename) else heightfield.get_fullpath()
+            if path.lower().endswith('.npy'):
+                heightfield = TiledHeightfield.from_file(path, tile_size=tile_size, cell_size=cell_size,
+                                                         height_scale=height_scale, origin=origin)
+            else:
+                heightfield = TiledHeightfield(load_heightmap(path), tile_size=tile_size, cell_size=cell_size,
+                                               height_scale=height_scale, origin=origin)
+        if heightfield.tile_size % block_size:
+            raise ValueError("Tile size (%d) must be a multiple of the block size (%d)" % (
+                heightfield.tile_size, block_size))
+        self.heightfield = heightfield
+
+        tile_span = heightfield.tile_size * heightfield.cell_size
+        self.load_radius = load_radius if load_radius is not None else 2 * tile_span
+        # Farther than the load radius, so that tiles at the edge aren't reloaded when moving back and forth
+        self.unload_radius = unload_radius if unload_radius is not None else self.load_radius + tile_span / 2
+        self.memory_budget = memory_budget
+        self.block_size = block_size
+        self.lod_near = lod_near if lod_near is not None else tile_span / 2
+        self.lod_far = lod_far if lod_far is not None else self.load_radius
+        self.workers = workers
+
+        self._tiles: Dict[TileIndex, _TerrainTile] = {}
+        # Largest size of a tile loaded so far, to estimate the size of tiles to load
+        self._max_tile_size: Optional[int] = None
+        self._pending: Dict[TileIndex, Future] = {}
+        self._failed_tiles: Set[TileIndex] = set()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='terrain_tile')
+        self._focus: Optional[NodePath] = focus
+        # Focal point of the level of detail of all tiles, moved to the focus position on update
+        self._focal_point = self.attach_new_node("focal_point")
+        self._update_task = None
+        if task_mgr is not None:
+            self._update_task = task_mgr.add(self._update_task_fn, "terrainStreamerUpdate", sort=45)
+
+    def set_focus(self, focus: Optional[NodePath]):
+        '''Node to page the terrain around, and to use as the focal point for the level of detail'''
+        self._focus = focus
+
+    @property
+    def tiles(self) -> Dict[TileIndex, NodePath]:
+        '''Attached tiles (their terrain root nodes)'''
+        return {index: tile.root for index, tile in self._tiles.items()}
+
+    @property
+    def pending_tiles(self) -> Set[TileIndex]:
+        '''Tiles that are being built'''
+        return set(self._pending)
+
+    @property
+    def memory_usage(self) -> int:
+        '''Estimated bytes used by the attached tiles'''
+        return sum(tile.size for tile in self._tiles.values())
+
+    def height_at(self, x, y):
+        '''Terrain height at the points (in this node's coordinates). See `TiledHeightfield.height_at()`'''
+        return self.heightfield.height_at(x, y)
+
+    def update(self, focus_pos: Optional[LPoint3f] = None):
+        '''
+        Attach the tiles that have been built, page tiles in and out around the focus position (in this node's
+        coordinates, by default the position of the focus node), and update the level of detail of each tile
+        '''
+        self._attach_built_tiles()
+        if focus_pos is None:
+            if self._focus is None or self._focus.is_empty():
+                return
+            focus_pos = self._focus.get_pos(self)
+        x, y = focus_pos[0], focus_pos[1]
+
+        for index in [i for i in self._tiles if self.heightfield.tile_distance(i, x, y) > self.unload_radius]:
+            self._unload_tile(index)
+        for index in [i for i in self._pending if self.heightfield.tile_distance(i, x, y) > self.unload_radius]:
+            if self._pending[index].cancel():
+                del self._pending[index]
+
+        self._focal_point.set_pos(focus_pos)
+        self._schedule_tiles(x, y)
+
+        for tile in self._tiles.values():
+            tile.terrain.update()
+
+    def _update_task_fn(self, task: Task):
+        self.update()
+        return task.cont
+
+    def _schedule_tiles(self, x: float, y: float):
+        hf = self.heightfield
+        rows, cols = hf.num_tiles
+        wanted = []
+        for row in range(rows):
+            for col in range(cols):
+                distance = hf.tile_distance((row, col), x, y)
+                if distance <= self.load_radius:
+                    wanted.append((distance, (row, col)))
+        wanted.sort()
+
+        # Before any tile is loaded, guess from the number of vertices of a tile
+        tile_size = self._max_tile_size or (hf.tile_size + 1) ** 2 * 64
+
+        def over_budget() -> bool:
+            return self.memory_usage + tile_size * (len(self._pending) + 1) > self.memory_budget
+
+        for distance, index in wanted:
+            if index in self._tiles or index in self._pending or index in self._failed_tiles:
+                continue
+            # Don't queue more than the workers can build soon, to load the nearest tiles first when moving
+            if len(self._pending) >= 2 * self.workers:
+                break
+            while self._tiles and over_budget():
+                farthest = max(self._tiles, key=lambda i: hf.tile_distance(i, x, y))
+                if hf.tile_distance(farthest, x, y) <= distance:
+                    break
+                self._unload_tile(farthest)
+            # The nearest tile is loaded even if it alone exceeds the budget
+            if over_budget() and (self._tiles or self._pending):
+                break
+            self._pending[index] = self._executor.submit(self._build_tile, index)
+
+    def _build_tile(self, index: TileIndex) -> Tuple[GeoMipTerrain, NodePath]:
+        '''Generate the terrain of the tile (on a worker thread), and the node that places it'''
+        hf = self.heightfield
+        heights = hf.tile_heights(index)
+        # Tiles at the far edges of the grid are padded with the edge heights, as the terrain needs the full size
+        samples = hf.tile_size + 1
+        heights = np.pad(heights, ((0, samples - heights.shape[0]), (0, samples - heights.shape[1])), mode='edge')
+        # Each tile is stored in the full 16-bit range, and scaled to its own height range
+        low, high = float(heights.min()), float(heights.max())
+        span = high - low
+
+        name = "%s_%d_%d" % (self.get_name(), *index)
+        terrain = GeoMipTerrain(name)
+        terrain.set_heightfield(_heightfield_image((heights - low) / span if span > 0 else heights * 0))
+        terrain.set_block_size(self.block_size)
+        terrain.set_near(self.lod_near / hf.cell_size)
+        terrain.set_far(self.lod_far / hf.cell_size)
+        terrain.set_border_stitching(True)
+
+        # The tile is placed by a parent of the terrain root, as the level of detail is only right with an
+        # unscaled root
+        x0, y0, _, _ = hf.tile_bounds(index)
+        root = NodePath(name)
+        root.set_pos(x0, y0, hf.origin[2] + low * hf.height_scale)
+        root.set_scale(hf.cell_size, hf.cell_size, span * hf.height_scale if span > 0 else 1)
+        terrain.get_root().reparent_to(root)
+        terrain.set_focal_point(self._focal_point)
+        terrain.generate()
+        return terrain, root
+
+    def _attach_built_tiles(self):
+        for index, future in list(self._pending.items()):
+            if not future.done():
+                continue
+            del self._pending[index]
+            try:
+                terrain, root = future.result()
+            except Exception:
+                LOG.exception("Could not build terrain tile %s" % (index,))
+                # Not retried, it would fail again
+                self._failed_tiles.add(index)
+                continue
+            size = estimate_asset_size(root) + self.heightfield.tile_heights(index).nbytes
+            tile = _TerrainTile(terrain, root, size)
+            self._max_tile_size = max(self._max_tile_size or 0, size)
+            tile.root.reparent_to(self)
+            self._tiles[index] = tile
+
+    def _unload_tile(self, index: TileIndex):
+        tile = self._tiles.pop(index)
+        tile.root.remove_node()
+
+    def destroy(self):
+        '''Stop streaming and remove all tiles'''
+        if self._update_task is not None:
+            self._update_task.remove()
+            self._update_task = None
+        for future in self._pending.values():
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        self._pending.clear()
+        for index in list(self._tiles):
+            self._unload_tile(index)
+
+
+__all__ = [
+    'load_heightmap',
+    'TerrainStreamer'
+]
@@ -0,0 +1,19 @@
+#version 150
+
+uniform sampler2D p3d_Texture0;
+uniform vec4 p3d_ColorScale;
+// Direction towards the light, in the swarm's coordinate space
+uniform vec3 light_dir;
+uniform float ambient;
+
+in vec3 v_normal;
+in vec4 v_color;
+in vec2 v_texcoord;
+
+out vec4 p3d_FragColor;
+
+void main() {
+    float diffuse = max(dot(normalize(v_normal), light_dir), 0.0);
+    vec4 color = texture(p3d_Texture0, v_texcoord) * v_color * p3d_ColorScale;
+    p3d_FragColor = vec4(color.rgb * (ambient + (1.0 - ambient) * diffuse), color.a);
+}
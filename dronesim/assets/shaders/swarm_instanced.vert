@@ -0,0 +1,32 @@
+#version 150
+
+// Draws one instance of the model per drone, with each instance's transform
+// read from a buffer texture (four RGBA texels per instance, the rows of its matrix)
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform samplerBuffer instance_data;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec4 p3d_Color;
+in vec2 p3d_MultiTexCoord0;
+
+out vec3 v_normal;
+out vec4 v_color;
+out vec2 v_texcoord;
+
+void main() {
+    int base = gl_InstanceID * 4;
+    // Panda3D matrices transform row vectors, so using their rows as the columns
+    // gives the transposed matrix, which transforms column vectors
+    mat4 instance_mat = mat4(
+        texelFetch(instance_data, base),
+        texelFetch(instance_data, base + 1),
+        texelFetch(instance_data, base + 2),
+        texelFetch(instance_data, base + 3));
+
+    gl_Position = p3d_ModelViewProjectionMatrix * (instance_mat * p3d_Vertex);
+    v_normal = normalize(mat3(instance_mat) * p3d_Normal);
+    v_color = p3d_Color;
+    v_texcoord = p3d_MultiTexCoord0;
+}
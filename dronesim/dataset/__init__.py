@@ -0,0 +1,3 @@
+
+from .sink import OverflowPolicy, FrameSink
+from .export import DatasetExporter, DatasetReader
@@ -0,0 +1,246 @@
+
+import json
+import os
+
+import numpy as np
+
+from dronesim.interface.action import DroneAction
+from dronesim.interface.types import StepRC
+
+from dronesim.types import PhysicsStateType, StepActionType
+from typing import Optional, Dict, List, Tuple
+
+
+MANIFEST_FILE = 'manifest.json'
+DATASET_VERSION = 1
+
+# Columns of the pose/action table: (data type, shape of a row)
+TABLE_COLUMNS: Dict[str, Tuple[str, tuple]] = {
+    'tick': ('int64', ()),
+    'pos': ('float32', (3,)),
+    'angle': ('float32', (3,)),
+    'velocity': ('float32', (3,)),
+    # RC input of the action (NaN if the action had none)
+    'rc': ('float32', (4,)),
+    # Value of the `DroneAction` of the action (0 if the action had none)
+    'action': ('int16', ())
+}
+
+
+def _chunk_dir(directory: str, index: int) -> str:
+    return os.path.join(directory, 'chunk_%06d' % index)
+
+
+def _camera_file(name: str) -> str:
+    return 'cam_%s.npy' % name
+
+
+def _camera_valid_file(name: str) -> str:
+    return 'cam_%s_valid.npy' % name
+
+
+def split_action(action: StepActionType) -> Tuple[Optional[StepRC], Optional[DroneAction]]:
+    '''RC input and `DroneAction` of a step action, if it has them'''
+    if isinstance(action, DroneAction):
+        return None, action
+    if isinstance(action, dict):
+        return action.get('rc'), action.get('action')
+    if isinstance(action, tuple):
+        return action, None
+    return None, None
+
+
+class DatasetExporter:
+    '''
+    Records camera frames together with the simulator state and action of the same tick, for training on
+    (image, pose, action) samples.
+
+    Samples are stored in chunks of `chunk_size` rows, each chunk being a directory of memory-mappable .npy files:
+    a fixed-size image tensor per camera (with a validity mask, for ticks the camera had no frame), and one file
+    per column of the pose/action table (see `TABLE_COLUMNS`), with the tick index. Files are written through memory
+    maps, so recording does not keep frames in memory. A manifest lists the chunks and the number of rows in each.
+
+    `DatasetReader` can then load any sample without reading whole chunks or episodes.
+    '''
+
+    def __init__(self, directory: str, chunk_size: int = 256):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+
+        # Image shape and data type of each camera, fixed by its first frame
+        self._cameras: Dict[str, Tuple[tuple, str]] = {}
+        self._chunks: List[dict] = []
+        self._chunk_index = -1
+        self._row = 0
+        self._columns: Dict[str, np.memmap] = {}
+        self._images: Dict[str, np.memmap] = {}
+        self._valid: Dict[str, np.memmap] = {}
+        self.total_rows = 0
+        self._closed = False
+
+    def record(self,
+               tick: int,
+               state: PhysicsStateType,
+               action: StepActionType = None,
+               frames: Optional[Dict[str, np.ndarray]] = None):
+        '''Add a row with the drone state, the action taken and the camera frames (by camera name) at `tick`'''
+        if self._closed:
+            raise RuntimeError("Dataset exporter is closed")
+        if self._chunk_index < 0 or self._row == self.chunk_size:
+            self._next_chunk()
+        row = self._row
+
+        columns = self._columns
+        columns['tick'][row] = tick
+        columns['pos'][row] = np.asarray(state['pos'], dtype=np.float32)[:3]
+        columns['angle'][row] = np.asarray(state['angle'], dtype=np.float32)[:3]
+        if 'pvel' in state:
+            columns['velocity'][row] = np.asarray(state['pvel'], dtype=np.float32)[:3]
+        rc, op = split_action(action)
+        columns['rc'][row] = rc if rc is not None else np.nan
+        columns['action'][row] = op.value if op is not None else 0
+
+        for name, frame in (frames or {}).items():
+            if frame is None:
+                continue
+            images = self._camera_images(name, frame)
+            images[row] = frame
+            self._valid[name][row] = True
+
+        self._row += 1
+        self.total_rows += 1
+        self._chunks[-1]['rows'] = self._row
+
+    def record_sim(self, sim, action: StepActionType = None, tick: Optional[int] = None):
+        '''Record the state of a `DroneSimulator` and the latest frames of its camera sensors'''
+        # Imported here so that using datasets without rendering doesn't import Panda3D
+        from dronesim.sensor.panda3d.camera import Panda3DCameraSensor
+        frames = {}
+        for name, sensor in sim.sensors.items():
+            if isinstance(sensor, Panda3DCameraSensor):
+                _, frame, _ = sensor.read_frame()
+                frames[name] = frame
+        if tick is None:
+            tick = sim.metrics.get('ticks', self.total_rows)
+        self.record(tick, sim.state, action, frames)
+
+    def _camera_images(self, name: str, frame: np.ndarray) -> np.memmap:
+        if name not in self._cameras:
+            self._cameras[name] = (frame.shape, frame.dtype.str)
+        shape, dtype = self._cameras[name]
+        if frame.shape != shape or frame.dtype.str != dtype:
+            raise ValueError("Frame of camera '%s' has shape %s and dtype %s, but the dataset has %s and %s" % (
+                name, frame.shape, frame.dtype, shape, np.dtype(dtype)))
+        if name not in self._images:
+            chunk_dir = _chunk_dir(self.directory, self._chunk_index)
+            self._images[name] = np.lib.format.open_memmap(
+                os.path.join(chunk_dir, _camera_file(name)), 'w+', dtype, (self.chunk_size,) + shape)
+            self._valid[name] = np.lib.format.open_memmap(
+                os.path.join(chunk_dir, _camera_valid_file(name)), 'w+', np.bool_, (self.chunk_size,))
+        return self._images[name]
+
+    def _next_chunk(self):
+        self._close_chunk()
+        self._chunk_index += 1
+        self._row = 0
+        chunk_dir = _chunk_dir(self.directory, self._chunk_index)
+        os.makedirs(chunk_dir, exist_ok=True)
+        for column, (dtype, shape) in TABLE_COLUMNS.items():
+            self._columns[column] = np.lib.format.open_memmap(
+                os.path.join(chunk_dir, column + '.npy'), 'w+', dtype, (self.chunk_size,) + shape)
+        self._columns['rc'][:] = np.nan
+        self._chunks.append({'index': self._chunk_index, 'rows': 0})
+
+    def _close_chunk(self):
+        for array in (*self._columns.values(), *self._images.values(), *self._valid.values()):
+            array.flush()
+        self._columns.clear()
+        self._images.clear()
+        self._valid.clear()
+        if self._chunks:
+            self._write_manifest()
+
+    def _write_manifest(self):
+        manifest = {
+            'version': DATASET_VERSION,
+            'chunk_size': self.chunk_size,
+            'total_rows': self.total_rows,
+            'columns': {name: {'dtype': dtype, 'shape': list(shape)} for name, (dtype, shape) in TABLE_COLUMNS.items()},
+            'cameras': {name: {'dtype': dtype, 'shape': list(shape)} for name, (shape, dtype) in self._cameras.items()},
+            'chunks': self._chunks
+        }
+        tmp_path = os.path.join(self.directory, MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, MANIFEST_FILE))
+
+    def close(self):
+        if self._closed:
+            return
+        self._close_chunk()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DatasetReader:
+    '''
+    Random access to the samples of a dataset written by `DatasetExporter`. Chunks are memory-mapped when
+    first accessed, so only the samples that are read get loaded from disk.
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.chunk_size: int = self.manifest['chunk_size']
+        self.cameras: List[str] = list(self.manifest['cameras'].keys())
+        self.columns: List[str] = list(self.manifest['columns'].keys())
+        self._rows = [chunk['rows'] for chunk in self.manifest['chunks']]
+        self._chunks: Dict[int, Dict[str, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return sum(self._rows)
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self._rows)
+
+    def chunk(self, index: int) -> Dict[str, np.ndarray]:
+        '''Memory-mapped arrays of all columns and cameras in the chunk, trimmed to the rows it has'''
+        if index not in self._chunks:
+            chunk_dir = _chunk_dir(self.directory, index)
+            rows = self._rows[index]
+            arrays = {}
+            for column in self.columns:
+                arrays[column] = np.load(os.path.join(chunk_dir, column + '.npy'), mmap_mode='r')[:rows]
+            for camera in self.cameras:
+                path = os.path.join(chunk_dir, _camera_file(camera))
+                if os.path.exists(path):
+                    arrays[camera] = np.load(path, mmap_mode='r')[:rows]
+                    arrays[camera + '_valid'] = np.load(
+                        os.path.join(chunk_dir, _camera_valid_file(camera)), mmap_mode='r')[:rows]
+            self._chunks[index] = arrays
+        return self._chunks[index]
+
+    def __getitem__(self, index: int) -> Dict[str, np.ndarray]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Sample index %d out of range" % index)
+        # Chunks are full except the last one
+        chunk_index, row = divmod(index, self.chunk_size)
+        return {name: array[row] for name, array in self.chunk(chunk_index).items()}
+
+
+__all__ = [
+    'TABLE_COLUMNS',
+    'split_action',
+    'DatasetExporter',
+    'DatasetReader'
+]
@@ -0,0 +1,252 @@
+
+import enum
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from dronesim.interface.telemetry import RollingHistogram
+
+from typing import Optional, List, Tuple, Dict, Set
+
+
+IMAGE_FORMATS = ('png', 'jpg')
+CHUNK_FORMAT = 'npy'
+
+# Histogram bin edges (in seconds) for encoding times, which are much longer than tick times
+ENCODE_BIN_EDGES = (1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 1e-1, 2.5e-1, 5e-1, 1.0)
+
+
+class OverflowPolicy(enum.Enum):
+    '''What the sink does with a new frame when all of its queue slots are in use'''
+    # Discard the new frame, so the caller never waits
+    DROP = enum.auto()
+    # Wait for a slot to be freed (up to the sink's timeout, after which the frame is dropped)
+    BLOCK = enum.auto()
+
+
+def _write_image(path: str, frame: np.ndarray, params: list) -> float:
+    '''Encode and write an image with OpenCV (expects BGR channel order). Returns the time taken'''
+    import cv2
+    start = time.perf_counter()
+    if not cv2.imwrite(path, frame, params):
+        raise IOError("Could not write image '%s'" % path)
+    return time.perf_counter() - start
+
+
+def _write_chunk(path: str, frames: np.ndarray) -> float:
+    '''Write a chunk of frames as a single .npy file. Returns the time taken'''
+    start = time.perf_counter()
+    np.save(path, frames)
+    return time.perf_counter() - start
+
+
+class FrameSink:
+    '''
+    Writes camera frames to disk in the background, so that saving frames does not hold up the simulation.
+
+    Submitted frames are copied into one of the preallocated slots and encoded by a pool of `workers` threads
+    (or processes). Image formats ('png', 'jpg') need OpenCV (the `cv` extra). With the 'npy' format, the frames
+    of each camera (by name) are collected into chunks of `chunk_size` frames that are written as raw .npy files.
+
+    There are slots for `queue_size` frames waiting to be written, rounded up to whole chunks (at least one).
+    With chunks, every camera also gets a slot for the chunk it is filling. When all slots are in use, new
+    frames are dropped or the caller waits, according to `policy`.
+
+    :param str directory: Directory to write files to. Created if it does not exist.
+    :param str file_format: One of 'png', 'jpg' or 'npy'.
+    :param bool use_processes: Encode in a process pool instead of a thread pool. Frames are then copied to the workers.
+    :param float block_timeout: Longest time to wait for a slot with the `BLOCK` policy. None waits forever.
+    '''
+
+    def __init__(self,
+                 directory: str,
+                 file_format: str = 'png',
+                 queue_size: int = 32,
+                 policy: OverflowPolicy = OverflowPolicy.DROP,
+                 workers: int = 2,
+                 use_processes: bool = False,
+                 chunk_size: int = 64,
+                 jpeg_quality: int = 95,
+                 block_timeout: Optional[float] = None):
+        file_format = file_format.lower()
+        if file_format not in IMAGE_FORMATS + (CHUNK_FORMAT,):
+            raise ValueError("Unknown file format '%s', expected one of %s" % (
+                file_format, ', '.join(IMAGE_FORMATS + (CHUNK_FORMAT,))))
+        if file_format in IMAGE_FORMATS:
+            try:
+                import cv2
+            except ImportError as e:
+                raise ImportError(
+                    "Writing '%s' images needs OpenCV, install the 'cv' extra (pip install dronesim[cv])" % file_format) from e
+            self._write_params = [
+                cv2.IMWRITE_JPEG_QUALITY, jpeg_quality] if file_format == 'jpg' else []
+
+        self.directory = directory
+        self.file_format = file_format
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.chunk_size = chunk_size if file_format == CHUNK_FORMAT else 1
+        os.makedirs(directory, exist_ok=True)
+
+        # Each slot holds one frame, or one chunk of frames. Slots for the chunks being filled are added per camera
+        self._slots: List[Optional[np.ndarray]] = []
+        self._free_slots: queue.Queue = queue.Queue()
+        for _ in range(max(1, math.ceil(queue_size / self.chunk_size))):
+            self._add_slot()
+
+        # Chunk being filled of each camera: (slot, number of frames, sequence number of the first frame)
+        self._chunks: Dict[str, Tuple[int, int, int]] = {}
+        self._seen_cameras: Set[str] = set()
+
+        executor_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor: Executor = executor_type(max_workers=workers)
+
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.encode_time = RollingHistogram(ENCODE_BIN_EDGES, 200)
+        # Time from submitting a frame till it is written, including the wait in the queue
+        self.latency = RollingHistogram(ENCODE_BIN_EDGES, 200)
+        self._closed = False
+
+    def submit(self, frame: np.ndarray, name: str = 'frame', seq: Optional[int] = None) -> bool:
+        '''
+        Queue a frame to be written. The frame is copied, so the array can be reused right away.
+        Returns False if the frame was dropped.
+        '''
+        if self._closed:
+            raise RuntimeError("Frame sink is closed")
+        if seq is None:
+            seq = self.submitted
+        with self._lock:
+            self.submitted += 1
+
+        if self.file_format == CHUNK_FORMAT:
+            return self._submit_to_chunk(frame, name, seq)
+
+        slot = self._acquire_slot()
+        if slot is None:
+            return False
+        buffer = self._slot_buffer(slot, frame.shape, frame.dtype)
+        np.copyto(buffer, frame)
+        path = os.path.join(self.directory, "%s_%08d.%s" % (name, seq, self.file_format))
+        self._dispatch(slot, 1, _write_image, path, buffer, self._write_params)
+        return True
+
+    def submit_sensor(self, sensor, name: Optional[str] = None) -> bool:
+        '''
+        Read the latest frame of a camera sensor (such as `Panda3DCameraSensor`) and queue it, if it is a new
+        frame. Returns whether a frame was queued
+        '''
+        is_new, frame, seq = sensor.read_frame()
+        if not is_new or frame is None:
+            return False
+        return self.submit(frame, name or sensor.name, seq)
+
+    def _submit_to_chunk(self, frame: np.ndarray, name: str, seq: int) -> bool:
+        # Chunks only contain frames of one camera, so each camera fills its own
+        chunk = self._chunks.get(name)
+        if chunk is None:
+            if name not in self._seen_cameras:
+                self._seen_cameras.add(name)
+                self._add_slot()
+            slot = self._acquire_slot()
+            if slot is None:
+                return False
+            chunk = (slot, 0, seq)
+
+        slot, count, first_seq = chunk
+        buffer = self._slot_buffer(slot, frame.shape, frame.dtype)
+        np.copyto(buffer[count], frame)
+        self._chunks[name] = (slot, count + 1, first_seq)
+        if count + 1 == self.chunk_size:
+            self._flush_chunk(name)
+        return True
+
+    def _flush_chunk(self, name: str):
+        slot, count, first_seq = self._chunks.pop(name)
+        path = os.path.join(self.directory, "%s_%08d.npy" % (name, first_seq))
+        self._dispatch(slot, count, _write_chunk, path, self._slots[slot][:count])
+
+    def _add_slot(self):
+        self._slots.append(None)
+        self._free_slots.put(len(self._slots) - 1)
+
+    def _acquire_slot(self) -> Optional[int]:
+        try:
+            if self.policy == OverflowPolicy.BLOCK:
+                return self._free_slots.get(timeout=self.block_timeout)
+            return self._free_slots.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.dropped += 1
+            return None
+
+    def _slot_buffer(self, slot: int, shape: tuple, dtype) -> np.ndarray:
+        shape = (self.chunk_size,) + shape if self.file_format == CHUNK_FORMAT else shape
+        buffer = self._slots[slot]
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            # Only allocated on first use, or if the frame format changes
+            buffer = self._slots[slot] = np.empty(shape, dtype)
+        return buffer
+
+    def _dispatch(self, slot: int, count: int, writer, *args):
+        submit_time = time.perf_counter()
+        future = self._executor.submit(writer, *args)
+
+        def _done(future: Future):
+            with self._lock:
+                if future.exception() is not None:
+                    self.errors += count
+                else:
+                    self.written += count
+                    self.encode_time.add(future.result())
+                    self.latency.add(time.perf_counter() - submit_time)
+            self._free_slots.put(slot)
+
+        future.add_done_callback(_done)
+
+    @property
+    def pending(self) -> int:
+        '''Number of slots waiting to be written'''
+        return len(self._slots) - self._free_slots.qsize() - len(self._chunks)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'written': self.written,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'pending': self.pending,
+                'encode_ms': self.encode_time.summary(),
+                'latency_ms': self.latency.summary()
+            }
+
+    def close(self, wait: bool = True):
+        '''Write the partially filled chunks (if any) and stop the workers, waiting for queued frames if `wait` is set'''
+        if self._closed:
+            return
+        for name in list(self._chunks):
+            self._flush_chunk(name)
+        self._closed = True
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+__all__ = [
+    'OverflowPolicy',
+    'FrameSink'
+]
@@ -3,3 +3,5 @@ from .control import IDroneControllable
 from .action import DroneAction
 from .state import DroneState
 from .types import StepRC, StepAction, StepActionType
+from .clock import CatchUpPolicy, TickClock, RealTimeClock, UncappedClock, LockstepClock
+from .telemetry import RollingHistogram, TickTelemetry
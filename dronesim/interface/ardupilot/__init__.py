@@ -0,0 +1,3 @@
+
+from .sitl import SITLBridge, SITLVehicleLink, FDMState, quad_x_servo_to_rc
+from .sitl_proxy import SITLAutopilotProxy
@@ -0,0 +1,404 @@
+
+'''
+Bridge between simulated vehicles and ArduPilot SITL instances over UDP, using ArduPilot's
+binary FDM protocol (the one used by its `gazebo-*` frames).
+
+Every autopilot sends a fixed-size packet of 16 normalized servo/motor outputs to the bridge, and the
+bridge replies with a fixed-size packet holding the vehicle's flight dynamics state (FDM). Multiple
+vehicles share a single socket, and are told apart by the address of the autopilot sending to it.
+
+To point an ArduPilot SITL instance at the bridge, launch it with a gazebo frame, for example:
+
+    sim_vehicle.py -v ArduCopter -f gazebo-iris -I 0 --sim-address=127.0.0.1
+
+For additional instances (`-I 1`, `-I 2` ...), use `--sim-port-out` to send to the bridge's port.
+
+Arming the autopilot arms the vehicle, and raising the throttle while it is landed makes it take off (see
+`SITLVehicleLink`), after which the autopilot flies it. Disarming only disarms the vehicle; it doesn't land.
+'''
+
+import math
+import time
+import socket
+import struct
+import logging
+import selectors
+import threading
+
+from dronesim.interface.control import IDroneControllable
+from dronesim.interface.types import StepRC
+from dronesim.interface.state import DroneState
+
+from typing import Optional, Callable, Sequence, Tuple, Dict, List, NamedTuple
+
+
+LOG = logging.getLogger(__name__)
+
+# Autopilot -> Simulator: Normalized (0 to 1) servo/motor outputs
+SERVO_CHANNELS = 16
+SERVO_PACKET = struct.Struct('<%df' % SERVO_CHANNELS)
+
+# Simulator -> Autopilot: timestamp (s), gyro rpy (rad/s, body), specific force xyz (m/s^2, body),
+# orientation quaternion (wxyz, NED), velocity (m/s, NED), position (m, NED)
+FDM_PACKET = struct.Struct('<d3d3d4d3d3d')
+# Timestamp at the start of the FDM packet, to update the packet between ticks
+FDM_TIMESTAMP = struct.Struct('<d')
+
+# Port where ArduPilot sends servo outputs to with its default settings
+DEFAULT_BRIDGE_ADDRESS = ('127.0.0.1', 9002)
+GRAVITY_MSS = 9.80665
+
+AddressType = Tuple[str, int]
+
+
+class FDMState(NamedTuple):
+    '''Decoded contents of an FDM packet'''
+    timestamp: float
+    gyro: Tuple[float, float, float]
+    accel: Tuple[float, float, float]
+    quaternion: Tuple[float, float, float, float]
+    velocity: Tuple[float, float, float]
+    position: Tuple[float, float, float]
+
+    @classmethod
+    def unpack_from(cls, buffer, offset: int = 0) -> 'FDMState':
+        v = FDM_PACKET.unpack_from(buffer, offset)
+        return cls(v[0], v[1:4], v[4:7], v[7:11], v[11:14], v[14:17])
+
+
+def quad_x_servo_to_rc(servo: Sequence[float], hover_throttle: float = 0.5) -> StepRC:
+    '''
+    Convert ArduPilot's Quad-X motor outputs into the simulator's RC input, by reversing the motor mixer.
+
+    The simulated physics engine is controlled by velocity commands rather than individual motor
+    thrust, so this is an approximation that lets the autopilot's attitude and throttle demands move the vehicle.
+    ArduPilot's Quad-X order is front-right, back-left, front-left, back-right.
+    '''
+    m1, m2, m3, m4 = servo[0], servo[1], servo[2], servo[3]
+    # Left motors faster rolls right, back motors faster pitches forward
+    roll = (m2 + m3) - (m1 + m4)
+    pitch = (m2 + m4) - (m1 + m3)
+    # Counter-clockwise spinning props (1, 2) faster yaws the vehicle clockwise
+    yaw = (m1 + m2) - (m3 + m4)
+    throttle = (m1 + m2 + m3 + m4) / 4 - hover_throttle
+    return StepRC(roll, pitch, throttle * 2, yaw)
+
+
+class SITLVehicleLink:
+    '''
+    Connection of a single vehicle (its `IDroneControllable`) to an autopilot instance.
+
+    The servo and FDM packets are kept in buffers allocated once, which are reused for every packet.
+
+    :param IDroneControllable controller: Interface of the vehicle to send RC to and read state from.
+    :param tuple address: Address of the autopilot. If None, it is assigned to the first unknown autopilot that sends servo data.
+    :param Callable servo_mapper: Converts the servo outputs to RC input for the controller.
+    :param float unit_scale: Size of one simulator unit in meters.
+    :param float arm_threshold: Motor output (0 to 1) above which the autopilot is taken to be armed. ArduPilot
+    outputs 0 on all motors while disarmed, and at least its spin-when-armed output while armed.
+    :param float takeoff_throttle: Average motor output at which a landed vehicle is made to take off. The
+    simulated vehicle only follows RC input while in the air, so the autopilot can't lift it off by itself.
+    None to not take off automatically.
+    '''
+
+    def __init__(self,
+                 controller: IDroneControllable,
+                 address: Optional[AddressType] = None,
+                 servo_mapper: Callable[[Sequence[float]], StepRC] = quad_x_servo_to_rc,
+                 unit_scale: float = 1e-2,
+                 arm_threshold: float = 0.05,
+                 takeoff_throttle: Optional[float] = 0.3):
+        self.controller = controller
+        self.address = address
+        self.servo_mapper = servo_mapper
+        self.unit_scale = unit_scale
+        self.arm_threshold = arm_threshold
+        self.takeoff_throttle = takeoff_throttle
+        # Arming state of the autopilot (from its motor outputs), and whether takeoff was requested since arming
+        self.autopilot_armed = False
+        self._takeoff_requested = False
+
+        self._servo_raw = bytearray(SERVO_PACKET.size)
+        self._fdm_raw = bytearray(FDM_PACKET.size)
+        # Float view into the servo packet, updated in-place on every received packet
+        self.servo = memoryview(self._servo_raw).cast('f')
+        self._servo_dirty = False
+        # Vehicle state the latest RC input was forwarded at, to forward at most one per tick
+        self._rc_state = None
+
+        self.packets_in = 0
+        self.packets_out = 0
+
+        # Vehicle state the FDM packet was packed from, and the previous tick to derive rates from.
+        # The rates only change between ticks, so they are held between the (more frequent) sends
+        self._fdm_state = None
+        self._last_time = None
+        self._last_pos = [0.0, 0.0, 0.0]
+        self._last_vel = [0.0, 0.0, 0.0]
+        self._last_yaw = 0.0
+
+    @property
+    def fdm_buffer(self) -> bytearray:
+        '''Most recently packed FDM packet'''
+        return self._fdm_raw
+
+    def receive_servo(self, packet: bytearray):
+        '''Copy a received servo packet into this link's buffer'''
+        self._servo_raw[:] = packet
+        self._servo_dirty = True
+        self.packets_in += 1
+
+    def apply_servo(self):
+        '''
+        Forward the latest servo outputs (if any arrived since the last call) to the controller.
+        The controller steps one RC input per tick, so they are forwarded at most once per tick of the vehicle
+        '''
+        if not self._servo_dirty:
+            return
+        state = self.controller.get_current_state()
+        if state is not None and state is self._rc_state:
+            return
+        self._rc_state = state
+        self._servo_dirty = False
+        self._follow_arming()
+        self.controller.rc_control(self.servo_mapper(self.servo))
+
+    def _follow_arming(self):
+        '''Arm / disarm the vehicle with the autopilot, and take off when it raises the throttle while landed'''
+        servo = self.servo
+        armed = max(servo[0], servo[1], servo[2], servo[3]) > self.arm_threshold
+        if armed != self.autopilot_armed:
+            self.autopilot_armed = armed
+            self._takeoff_requested = False
+            LOG.info("Autopilot %s %s" % (self.address, 'armed' if armed else 'disarmed'))
+            if armed:
+                self.controller.arm(blocking=False)
+            else:
+                self.controller.unarm(blocking=False)
+        if armed and not self._takeoff_requested and self.takeoff_throttle is not None and \
+                (servo[0] + servo[1] + servo[2] + servo[3]) / 4 >= self.takeoff_throttle and \
+                self._operation() == DroneState.LANDED:
+            self._takeoff_requested = True
+            self.controller.takeoff(blocking=False)
+
+    def _operation(self) -> Optional[DroneState]:
+        state = self.controller.get_current_state()
+        if state is None:
+            return None
+        return (state[3].get('state') or {}).get('operation')
+
+    def pack_state(self, timestamp: float) -> bool:
+        '''
+        Pack the current state of the vehicle into the FDM buffer. Returns False if there is no state yet.
+        Only the timestamp is updated if the vehicle hasn't ticked since the last call
+        '''
+        state = self.controller.get_current_state()
+        if state is None:
+            return False
+        if state is not self._fdm_state:
+            if not self._pack_tick(state, timestamp):
+                return False
+            self._fdm_state = state
+        FDM_TIMESTAMP.pack_into(self._fdm_raw, 0, timestamp)
+        return True
+
+    def _pack_tick(self, state, timestamp: float) -> bool:
+        '''Pack the kinematics of a new tick of the vehicle, with the rates derived from the previous tick'''
+        info = state[3]
+        transformState = info.get('state')
+        if transformState is None:
+            return False
+        # Time of the tick (see `DefaultDroneControl`), as the sends are not in step with the ticks
+        tick_time = info.get('timestamp', timestamp)
+
+        pos = transformState['pos']
+        scale = self.unit_scale
+        # Simulator is (East, North, Up)
+        north, east, down = pos[1] * scale, pos[0] * scale, -pos[2] * scale
+        # Simulator heading is counter-clockwise, NED yaw is clockwise from north
+        yaw = -transformState['angle'][2]
+
+        last_pos, last_vel = self._last_pos, self._last_vel
+        dt = 0.0 if self._last_time is None else tick_time - self._last_time
+        if dt > 0:
+            vn, ve, vd = (north - last_pos[0]) / dt, (east - last_pos[1]) / dt, (down - last_pos[2]) / dt
+            an, ae, ad = (vn - last_vel[0]) / dt, (ve - last_vel[1]) / dt, (vd - last_vel[2]) / dt
+            yaw_rate = math.remainder(yaw - self._last_yaw, math.tau) / dt
+        else:
+            vn, ve, vd = last_vel
+            an = ae = ad = yaw_rate = 0.0
+
+        # Specific force (what an accelerometer measures) rotated into the body frame
+        cy, sy = math.cos(yaw), math.sin(yaw)
+        FDM_PACKET.pack_into(
+            self._fdm_raw, 0,
+            timestamp,
+            0.0, 0.0, yaw_rate,
+            cy * an + sy * ae, -sy * an + cy * ae, ad - GRAVITY_MSS,
+            math.cos(yaw / 2), 0.0, 0.0, math.sin(yaw / 2),
+            vn, ve, vd,
+            north, east, down
+        )
+
+        self._last_time = tick_time
+        last_pos[0], last_pos[1], last_pos[2] = north, east, down
+        last_vel[0], last_vel[1], last_vel[2] = vn, ve, vd
+        self._last_yaw = yaw
+        return True
+
+
+class SITLBridge(threading.Thread):
+    '''
+    Serves any number of vehicles to ArduPilot SITL instances on a single UDP socket.
+
+    Incoming servo packets are read without blocking as they arrive, and the state of every linked
+    vehicle is streamed back at `rate` packets per second.
+
+    :param tuple bind_address: Address to receive servo packets on.
+    :param float rate: Rate (Hz) at which the state is sent to the autopilots.
+    '''
+
+    def __init__(self,
+                 bind_address: AddressType = DEFAULT_BRIDGE_ADDRESS,
+                 rate: float = 1000.0,
+                 auto_start: bool = True):
+        super().__init__(daemon=True)
+        if rate <= 0:
+            raise ValueError("rate must be positive, got %r" % rate)
+        self._rate = rate
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        self._sock.bind(bind_address)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
+
+        # Packets are received into this buffer before being copied to the link of the sender
+        self._recv_buf = bytearray(SERVO_PACKET.size)
+
+        self._links: List[SITLVehicleLink] = []
+        self._links_by_address: Dict[AddressType, SITLVehicleLink] = {}
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._start_time = time.perf_counter()
+
+        self.dropped_packets = 0
+
+        if auto_start:
+            self.start()
+
+    @property
+    def address(self) -> AddressType:
+        return self._sock.getsockname()
+
+    @property
+    def links(self) -> List[SITLVehicleLink]:
+        return list(self._links)
+
+    def add_vehicle(self, controller: IDroneControllable, address: Optional[AddressType] = None, **link_params) -> SITLVehicleLink:
+        '''Link a vehicle to the autopilot at `address`, or to the next new autopilot that connects if not given'''
+        link = SITLVehicleLink(controller, address, **link_params)
+        with self._lock:
+            self._links.append(link)
+            if address is not None:
+                self._links_by_address[address] = link
+        return link
+
+    def remove_vehicle(self, link: SITLVehicleLink):
+        with self._lock:
+            self._links.remove(link)
+            if link.address is not None:
+                self._links_by_address.pop(link.address, None)
+
+    def start(self):
+        self._running.set()
+        super().start()
+
+    def stop(self):
+        '''Stop the bridge thread (if running) and close the socket'''
+        self._running.clear()
+        if self.is_alive():
+            self.join()
+        self._selector.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def run(self):
+        period = 1.0 / self._rate
+        next_time = time.perf_counter()
+        while self._running.is_set():
+            self.poll(max(0.0, next_time - time.perf_counter()))
+            now = time.perf_counter()
+            if now >= next_time:
+                self.send_state(now - self._start_time)
+                next_time += period
+                # Don't burst to catch up if we fell behind
+                if next_time < now:
+                    next_time = now + period
+
+    def poll(self, timeout: Optional[float] = 0.0):
+        '''Wait up to `timeout` seconds for servo packets and read all that are available'''
+        if not self._selector.select(timeout):
+            return
+        while True:
+            try:
+                nbytes, address = self._sock.recvfrom_into(self._recv_buf)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionResetError:
+                # Windows reports ICMP port unreachable of a previous send here
+                continue
+            if nbytes != SERVO_PACKET.size:
+                self.dropped_packets += 1
+                continue
+            link = self._get_link(address)
+            if link is None:
+                self.dropped_packets += 1
+                continue
+            link.receive_servo(self._recv_buf)
+
+    def send_state(self, timestamp: float):
+        '''Apply received servo outputs and send the state of all linked vehicles to their autopilots'''
+        with self._lock:
+            links = self._links
+            for link in links:
+                if link.address is None:
+                    continue
+                link.apply_servo()
+                if link.pack_state(timestamp):
+                    try:
+                        self._sock.sendto(link.fdm_buffer, link.address)
+                        link.packets_out += 1
+                    except (BlockingIOError, ConnectionResetError):
+                        pass
+
+    def _get_link(self, address: AddressType) -> Optional[SITLVehicleLink]:
+        link = self._links_by_address.get(address)
+        if link is None:
+            with self._lock:
+                # Assign to the first vehicle which is waiting for an autopilot
+                for link in self._links:
+                    if link.address is None:
+                        LOG.info("Autopilot at %s:%d linked to vehicle" % address)
+                        link.address = address
+                        self._links_by_address[address] = link
+                        return link
+            return None
+        return link
+
+
+__all__ = [
+    'SERVO_CHANNELS',
+    'SERVO_PACKET',
+    'FDM_PACKET',
+    'DEFAULT_BRIDGE_ADDRESS',
+    'FDMState',
+    'quad_x_servo_to_rc',
+    'SITLVehicleLink',
+    'SITLBridge'
+]
@@ -0,0 +1,95 @@
+
+'''
+Stand-in for an ArduPilot SITL instance that speaks the same binary FDM protocol as `SITLBridge`.
+
+It can be used to test the bridge (or a vehicle setup) without building ArduPilot. It can also be run as a
+script, in which case it sends a fixed set of motor outputs and prints the state it receives:
+
+    python -m dronesim.interface.ardupilot.sitl_proxy --throttle 0.6
+'''
+
+import time
+import socket
+import argparse
+
+from .sitl import SERVO_PACKET, FDM_PACKET, DEFAULT_BRIDGE_ADDRESS, FDMState, AddressType
+
+from typing import Optional
+
+
+class SITLAutopilotProxy:
+    '''
+    Fake autopilot which sends servo packets to a bridge and receives FDM packets from it.
+
+    :param tuple bridge_address: Address of the `SITLBridge` to send servo packets to.
+    :param tuple bind_address: Address to receive FDM packets on. A free port is picked by default.
+    '''
+
+    def __init__(self,
+                 bridge_address: AddressType = DEFAULT_BRIDGE_ADDRESS,
+                 bind_address: AddressType = ('127.0.0.1', 0)):
+        self.bridge_address = bridge_address
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(bind_address)
+
+        self._servo_raw = bytearray(SERVO_PACKET.size)
+        self._fdm_raw = bytearray(FDM_PACKET.size)
+        self.servo = memoryview(self._servo_raw).cast('f')
+
+    @property
+    def address(self) -> AddressType:
+        return self._sock.getsockname()
+
+    def send_servo(self, *outputs: float):
+        '''Send servo outputs (0 to 1) starting from the first channel. Channels not given keep their previous value'''
+        for i, value in enumerate(outputs):
+            self.servo[i] = value
+        self._sock.sendto(self._servo_raw, self.bridge_address)
+
+    def receive_fdm(self, timeout: Optional[float] = 1.0) -> Optional[FDMState]:
+        '''Wait for the next FDM packet from the bridge. Returns None if none arrived within `timeout` seconds'''
+        self._sock.settimeout(timeout)
+        try:
+            nbytes = self._sock.recv_into(self._fdm_raw)
+        except socket.timeout:
+            return None
+        if nbytes != FDM_PACKET.size:
+            return None
+        return FDMState.unpack_from(self._fdm_raw)
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stand-in ArduPilot SITL instance for testing the simulator's SITL bridge")
+    parser.add_argument('--host', default=DEFAULT_BRIDGE_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=DEFAULT_BRIDGE_ADDRESS[1])
+    parser.add_argument('--throttle', type=float, default=0.5,
+                        help="Output of all four motors (0 to 1)")
+    parser.add_argument('--rate', type=float, default=50.0,
+                        help="Servo packets sent per second")
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    with SITLAutopilotProxy((args.host, args.port)) as proxy:
+        end_time = time.time() + args.duration
+        while time.time() < end_time:
+            proxy.send_servo(*(args.throttle,)*4)
+            fdm = proxy.receive_fdm()
+            if fdm is not None:
+                print('t=%.3f pos=%s vel=%s' % (fdm.timestamp,
+                      ' '.join('%.3f' % v for v in fdm.position),
+                      ' '.join('%.3f' % v for v in fdm.velocity)), flush=True)
+            time.sleep(1.0 / args.rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+
+import enum
+import threading
+import time
+
+from .telemetry import TickTelemetry
+
+from typing import Optional
+
+
+class CatchUpPolicy(enum.Enum):
+    '''What a real-time clock does when ticks fall behind schedule'''
+    # Run the missed ticks back-to-back till the schedule is met again
+    BURST = enum.auto()
+    # Skip the missed ticks, keeping the schedule aligned to wall time
+    DROP = enum.auto()
+    # Restart the schedule from the late tick, so simulated time slows down instead
+    SLOW_DOWN = enum.auto()
+
+
+class TickClock:
+    '''
+    Paces the ticks of a simulation loop (such as `DefaultDroneControl`'s tick thread).
+
+    The loop calls `start()` once, and then `wait_next()` before every tick. The clock decides
+    how long (if at all) to block, which allows the same loop to run in real time, faster or slower
+    than real time, or be driven tick-by-tick from outside.
+    '''
+
+    # Whether blocking calls (takeoff, land, etc.) of the controller should advance the clock by
+    # themselves, as nothing else will make the simulation progress while waiting
+    drives_blocking_calls = False
+
+    def __init__(self):
+        self._sim_time = 0.0
+        self._ticks = 0
+        # Timing statistics of the loop using this clock
+        self.telemetry = TickTelemetry()
+
+    def start(self):
+        '''Called by the tick loop before the first tick'''
+        self._sim_time = 0.0
+        self._ticks = 0
+        self.telemetry.reset()
+
+    def wait_next(self, tick_period: float):
+        '''Block (if needed) till the next tick of duration `tick_period` (in simulated seconds) is due'''
+        self._sim_time += tick_period
+        self._ticks += 1
+
+    def advance(self, ticks: int = 1, wait: bool = True, timeout: Optional[float] = None) -> bool:
+        '''Let an external driver run `ticks` number of ticks. Only supported by externally driven clocks'''
+        raise NotImplementedError(
+            "%s cannot be advanced externally" % self.__class__.__name__)
+
+    def wall_period(self, tick_period: float) -> Optional[float]:
+        '''Wall time a tick of `tick_period` is supposed to take, or None if ticks are not paced to wall time'''
+        return None
+
+    @property
+    def sim_time(self) -> float:
+        '''Total simulated time elapsed since the clock started'''
+        return self._sim_time
+
+    @property
+    def ticks(self) -> int:
+        '''Number of ticks released by the clock since it started'''
+        return self._ticks
+
+
+class RealTimeClock(TickClock):
+    '''
+    Keeps a constant tick rate against the wall clock.
+
+    :param float time_scale: Speed of simulated time relative to wall time. A value of 1 is real time,
+    2 runs twice as fast as real time, 0.5 is half the speed (slow motion), and so on.
+
+    :param CatchUpPolicy catch_up: What to do when ticks fall behind schedule (the host is overloaded).
+    '''
+
+    def __init__(self, time_scale: float = 1.0, catch_up: CatchUpPolicy = CatchUpPolicy.BURST):
+        super().__init__()
+        if time_scale <= 0:
+            raise ValueError("time_scale must be positive, got %r" % time_scale)
+        self._time_scale = time_scale
+        self.catch_up = catch_up
+        self._next_time = time.perf_counter()
+
+    @property
+    def time_scale(self) -> float:
+        return self._time_scale
+
+    @time_scale.setter
+    def time_scale(self, time_scale: float):
+        if time_scale <= 0:
+            raise ValueError("time_scale must be positive, got %r" % time_scale)
+        # Re-base the schedule so that the change does not cause a burst (or stall) of ticks
+        self._next_time = time.perf_counter()
+        self._time_scale = time_scale
+
+    def start(self):
+        super().start()
+        self._next_time = time.perf_counter()
+
+    def wall_period(self, tick_period: float) -> Optional[float]:
+        return tick_period / self._time_scale
+
+    def wait_next(self, tick_period: float):
+        period = tick_period / self._time_scale
+        now = time.perf_counter()
+        delay_sleep = self._next_time - now
+        overshoot = None
+        if delay_sleep > 0:
+            time.sleep(delay_sleep)
+            now = time.perf_counter()
+            overshoot = now - self._next_time
+        lateness = now - self._next_time
+        self.telemetry.record_wait(lateness, overshoot, period)
+
+        # Missed one or more tick slots entirely
+        if lateness > period:
+            if self.catch_up == CatchUpPolicy.DROP:
+                missed = int(lateness // period)
+                self._next_time += missed * period
+                self.telemetry.dropped_ticks += missed
+            elif self.catch_up == CatchUpPolicy.SLOW_DOWN:
+                self._next_time = now
+
+        # Schedule the following tick relative to this one (keeping constant rate)
+        self._next_time += period
+        super().wait_next(tick_period)
+
+
+class UncappedClock(TickClock):
+    '''Runs ticks as fast as possible, without waiting'''
+
+    def wait_next(self, tick_period: float):
+        super().wait_next(tick_period)
+
+
+class LockstepClock(TickClock):
+    '''
+    Clock which only releases ticks when asked to using `advance()`, for deterministic
+    stepping of the simulation by an external driver (test harness, training loop, etc.).
+
+    :param bool drive_blocking_calls: If True, blocking calls of the controller (such as `takeoff()`)
+    advance the clock themselves till they complete, so that they resolve even when no other
+    thread is driving the simulation.
+    '''
+
+    def __init__(self, drive_blocking_calls: bool = True):
+        super().__init__()
+        self.drives_blocking_calls = drive_blocking_calls
+        self._cond = threading.Condition()
+        # Ticks allowed to run, ticks started and ticks finished by the loop
+        self._granted = 0
+        self._started = 0
+        self._completed = 0
+
+    def wait_next(self, tick_period: float):
+        with self._cond:
+            # The loop only comes back here once the previous tick is done
+            if self._completed != self._started:
+                self._completed = self._started
+                self._cond.notify_all()
+            self._cond.wait_for(lambda: self._started < self._granted)
+            self._started += 1
+        super().wait_next(tick_period)
+
+    def advance(self, ticks: int = 1, wait: bool = True, timeout: Optional[float] = None) -> bool:
+        '''
+        Allow the loop to run `ticks` more ticks. If `wait` is set, block till all of them have been
+        performed (or `timeout` seconds of wall time pass). Returns False if the wait timed out.
+        '''
+        with self._cond:
+            self._granted += max(0, ticks)
+            target = self._granted
+            self._cond.notify_all()
+            if wait:
+                return self._cond.wait_for(lambda: self._completed >= target, timeout)
+        return True
+
+    @property
+    def pending_ticks(self) -> int:
+        '''Ticks that have been granted but not yet started'''
+        with self._cond:
+            return self._granted - self._started
+
+
+__all__ = [
+    'CatchUpPolicy',
+    'TickClock',
+    'RealTimeClock',
+    'UncappedClock',
+    'LockstepClock'
+]
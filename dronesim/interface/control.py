@@ -40,7 +40,8 @@ class IDroneControllable(ABC):
         pass
 
     ## High-level interface functions ##
-    # These functions can optionally block till the action completes, or timeout occurs
+    # These functions can optionally block till the action completes, or timeout occurs.
+    # Blocking calls return whether the action completed (False if it timed out)
 
     @abstractmethod
     def arm(self, blocking=True, timeout=None):
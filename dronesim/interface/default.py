@@ -3,14 +3,16 @@ from .control import IDroneControllable
 from .action import DroneAction
 from .state import DroneState
 from .types import StepRC, StepActionType
+from .clock import TickClock, RealTimeClock
 
 from dronesim.simulator import DroneSimulator
 
 from queue import Queue, Empty
 from contextlib import suppress
 
-from typing import Optional
+from typing import Optional, Callable
 import threading
+import math
 import time
 
 
@@ -20,6 +22,11 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
     Allows the simulator to be controlled by the user using high-level functions in real time.
 
     This interface is thread-safe.
+
+    The rate of the tick loop is controlled by the `clock` object (see `dronesim.interface.clock`).
+    By default, ticks run in real time. Use `RealTimeClock(time_scale=...)` to run faster or slower
+    than real time, `UncappedClock()` to run as fast as possible, or `LockstepClock()` to step the
+    simulation externally using `advance()`.
     '''
 
     def __init__(self,
@@ -29,7 +36,8 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
                  update_enable: bool = True,
                  use_physics_dt: bool = True,
                  tps_update_period: float = 1,
-                 wait_till_started: bool = True):
+                 wait_till_started: bool = True,
+                 clock: Optional[TickClock] = None):
         '''Initialize the instance with a `DroneSimulator` object to control.'''
         super().__init__(daemon=True, target=self._droneTickLoop)
         self.drone = drone
@@ -43,11 +51,20 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
 
         self._use_dt = use_physics_dt
 
+        # Paces the tick loop. Real time by default
+        if clock is None:
+            clock = RealTimeClock()
+        self._clock = clock
+
         self.__debug_data = dict(tps=0)
         # Store last state
         self.__state = None
         # FIFO to process commands called using the interface methods
         self.__cmd_queue: Queue[StepActionType] = Queue()
+        # Number of commands queued, and stepped by the tick loop, to wait for a command to be performed
+        self._queue_lock = threading.Lock()
+        self._queued_commands = 0
+        self._stepped_commands = 0
 
         self._ev_started = threading.Event()
         self._predicate = threading.Condition()
@@ -64,6 +81,14 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
         '''Block till all actions from the command queue are performed'''
         self.__cmd_queue.join()
 
+    def advance(self, ticks: int = 1, wait: bool = True, timeout: Optional[float] = None) -> bool:
+        '''Run `ticks` number of ticks when using an externally driven clock (such as `LockstepClock`)'''
+        return self._clock.advance(ticks, wait, timeout)
+
+    @property
+    def clock(self) -> TickClock:
+        return self._clock
+
     def enable_update(self):
         self._update_enable = True
 
@@ -76,17 +101,41 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
                 self._predicate.notify_all()
         self.drone.physics.on('operation', _notifyOperationChange)
 
+    def _wait_for(self, predicate: Callable[[], bool], timeout: Optional[float] = None) -> bool:
+        '''
+        Block till `predicate` is satisfied by a state change of the simulator.
+
+        If the clock is to be driven by blocking calls, ticks are advanced from the calling thread instead,
+        and `timeout` is measured in simulated time rather than wall time.
+        '''
+        if self._clock.drives_blocking_calls:
+            max_ticks = None if timeout is None else math.ceil(
+                timeout * self._tick_rate)
+            ticks = 0
+            while not predicate():
+                if max_ticks is not None and ticks >= max_ticks:
+                    return False
+                self._clock.advance(1)
+                ticks += 1
+            return True
+
+        with self._predicate:
+            return self._predicate.wait_for(predicate, timeout)
+
     def _droneTickLoop(self):
-        next_time = time.time()
         last_ticks, last_tick_check = 0, time.time()
 
         self._initEventHandlers()
 
+        self._clock.start()
         self._ev_started.set()
 
         while True:
             tick_period = (1.0 / self._tick_rate)
 
+            # Wait for next step (the clock decides the pacing)
+            self._clock.wait_next(tick_period)
+
             # Get action given
             cmd = None
             with suppress(Empty):
@@ -95,8 +144,18 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
 
             # Perform step, even if no commands are available
             if self._update_enable:
+                step_start = time.perf_counter()
                 self.__state = self.drone.step(
                     cmd, tick_period if self._use_dt else None)
+                # Time of the state, so that renderers can interpolate between ticks
+                self.__state[3]['timestamp'] = time.monotonic()
+                self._clock.telemetry.record_tick(
+                    time.perf_counter() - step_start, self._clock.wall_period(tick_period))
+
+            if cmd is not None:
+                with self._predicate:
+                    self._stepped_commands += 1
+                    self._predicate.notify_all()
 
             # Update TPS
             if time.time() - last_tick_check >= self._tps_update_period:
@@ -104,6 +163,7 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
                     self.drone.metrics['ticks'] - last_ticks) / self._tps_update_period
                 last_ticks = self.drone.metrics['ticks']
                 self.__debug_data['tps'] = int(tickDiff)
+                self.__debug_data['timing'] = self._clock.telemetry.summary()
                 last_tick_check = time.time()
 
             # Update debug state info from the simulation step
@@ -116,11 +176,6 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
                     'sensors': len(self.drone.sensors)
                 })
 
-            # Wait for next step (keeping constant rate)
-            next_time += tick_period
-            delaySleep = max(0, next_time - time.time())
-            time.sleep(delaySleep)
-
     # Implement interface functions
 
     def get_current_state(self):
@@ -129,46 +184,61 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
     def get_debug_data(self) -> dict:
         return self.__debug_data
 
+    def _queue_command(self, cmd: StepActionType) -> int:
+        '''Queue a command for the tick loop. Returns the number of commands queued so far, including this one'''
+        with self._queue_lock:
+            self.__cmd_queue.put_nowait(cmd)
+            self._queued_commands += 1
+            return self._queued_commands
+
+    def _wait_for_command(self, count: int, timeout: Optional[float] = None) -> bool:
+        '''Block till the tick loop has stepped the command numbered `count` (from `_queue_command()`)'''
+        return self._wait_for(lambda: self._stepped_commands >= count, timeout)
+
     def rc_control(self, vector: StepRC):
-        self.__cmd_queue.put_nowait(vector)
+        self._queue_command(vector)
 
     def direct_action(self, action: DroneAction, **params):
-        self.__cmd_queue.put_nowait({
+        self._queue_command({
             'action': action,
             'params': params
         })
 
+    # Arming and freezing have no state of their own to wait for, so they complete when they are stepped
+
     def arm(self, blocking=True, timeout=None):
-        self.__cmd_queue.put_nowait({
+        count = self._queue_command({
             'action': DroneAction.ARM
         })
+        if blocking:
+            return self._wait_for_command(count, timeout)
 
     def unarm(self, blocking=True, timeout=None):
-        self.__cmd_queue.put_nowait({
+        count = self._queue_command({
             'action': DroneAction.UNARM
         })
+        if blocking:
+            return self._wait_for_command(count, timeout)
 
     def takeoff(self, blocking=True, timeout=None):
-        self.__cmd_queue.put_nowait({
+        self._queue_command({
             'action': DroneAction.TAKEOFF
         })
         if blocking:
-            with self._predicate:
-                # TODO: simulator will alert if takeoff failed, raise exception here
-                def _wait_takeoff():
-                    return self.drone.state.get('operation') == DroneState.IN_AIR
-                self._predicate.wait_for(_wait_takeoff, timeout)
+            # TODO: simulator will alert if takeoff failed, raise exception here
+            def _wait_takeoff():
+                return self.drone.state.get('operation') == DroneState.IN_AIR
+            return self._wait_for(_wait_takeoff, timeout)
 
     def land(self, blocking=True, timeout=None):
-        self.__cmd_queue.put_nowait({
+        self._queue_command({
             'action': DroneAction.LAND
         })
         if blocking:
-            with self._predicate:
-                # TODO: simulator will alert if landing failed, raise exception here
-                def _wait_land():
-                    return self.drone.state.get('operation') == DroneState.LANDED
-                self._predicate.wait_for(_wait_land, timeout)
+            # TODO: simulator will alert if landing failed, raise exception here
+            def _wait_land():
+                return self.drone.state.get('operation') == DroneState.LANDED
+            return self._wait_for(_wait_land, timeout)
 
     def move_left(self, x: float, s: Optional[float] = None, blocking=True, timeout=None):
         raise NotImplementedError()
@@ -195,9 +265,11 @@ class DefaultDroneControl(threading.Thread, IDroneControllable):
         raise NotImplementedError()
 
     def freeze(self, blocking=True, timeout=None):
-        self.__cmd_queue.put_nowait({
+        count = self._queue_command({
             'action': DroneAction.STOP_IN_PLACE
         })
+        if blocking:
+            return self._wait_for_command(count, timeout)
 
 
 __all__ = [
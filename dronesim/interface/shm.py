@@ -0,0 +1,425 @@
+
+'''
+Shared-memory control bridge, to control simulated vehicles from other processes (vision pipelines,
+learners, etc.) without sockets or serialization.
+
+The simulator side (`SharedMemoryControlServer`) creates a block of shared memory with a fixed layout:
+
+    header | state slot per drone | command ring control per drone | command ring slots per drone
+
+Each state slot is written with a sequence counter (seqlock): the counter is odd while the slot is being
+written, so readers retry till they get a consistent copy. Each command ring has a single producer
+(the remote process) and a single consumer (the server), using monotonically increasing head/tail counters.
+
+Remote processes attach to the block by name with `SharedMemoryControlClient`. Optionally, an eventfd
+(or a pipe where eventfd is not available) can be used by clients to wake the server up as soon as a
+command is written, instead of it being picked up on the next update of the server. The file descriptor
+has to be inherited by the client process (eg. with `multiprocessing` or `subprocess`'s `pass_fds`).
+
+Requires Python 3.8 or above (`multiprocessing.shared_memory`).
+'''
+
+import os
+import time
+import selectors
+import threading
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .control import IDroneControllable
+from .action import DroneAction
+from .state import DroneState
+from .types import StepRC
+
+from typing import Optional, Sequence, List
+
+
+SHM_MAGIC = 0x4D535344      # 'DSSM'
+SHM_VERSION = 1
+CACHE_LINE = 64
+
+CMD_NONE = 0
+CMD_RC = 1
+CMD_ACTION = 2
+
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u4'),
+    ('version', '<u4'),
+    ('num_drones', '<u4'),
+    ('ring_size', '<u4')
+])
+
+STATE_DTYPE = np.dtype([
+    # Sequence counter, odd while being written
+    ('seq', '<u8'),
+    ('tick', '<u8'),
+    # Wall time of the update (time.time())
+    ('timestamp', '<f8'),
+    ('pos', '<f8', (3,)),
+    ('angle', '<f8', (3,)),
+    ('vel', '<f8', (3,)),
+    ('thrust', '<f8', (3,)),
+    # `DroneState` value, or 0 if unknown
+    ('operation', '<i4'),
+    ('motor_armed', '<i4')
+], align=True)
+
+RING_CONTROL_DTYPE = np.dtype({
+    'names': ['head', 'tail'],
+    'formats': ['<u8', '<u8'],
+    # Head (written by client) and tail (written by server) on separate cache lines
+    'offsets': [0, CACHE_LINE],
+    'itemsize': CACHE_LINE * 2
+})
+
+COMMAND_DTYPE = np.dtype([
+    ('kind', '<u4'),
+    # `DroneAction` value for CMD_ACTION
+    ('action', '<u4'),
+    ('rc', '<f8', (4,))
+], align=True)
+
+
+def _align(offset: int, alignment: int = CACHE_LINE) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class SharedMemoryLayout:
+    '''Offsets of the sections in the shared memory block, and NumPy views to access them'''
+
+    def __init__(self, num_drones: int, ring_size: int):
+        self.num_drones = num_drones
+        self.ring_size = ring_size
+
+        self.header_offset = 0
+        self.states_offset = _align(HEADER_DTYPE.itemsize)
+        self.ring_control_offset = _align(
+            self.states_offset + STATE_DTYPE.itemsize * num_drones)
+        self.commands_offset = _align(
+            self.ring_control_offset + RING_CONTROL_DTYPE.itemsize * num_drones)
+        self.size = _align(
+            self.commands_offset + COMMAND_DTYPE.itemsize * num_drones * ring_size)
+
+    def map(self, buffer):
+        '''Create views of all sections on the given buffer'''
+        header = np.ndarray((), HEADER_DTYPE, buffer, self.header_offset)
+        states = np.ndarray((self.num_drones,), STATE_DTYPE,
+                            buffer, self.states_offset)
+        ring_control = np.ndarray(
+            (self.num_drones,), RING_CONTROL_DTYPE, buffer, self.ring_control_offset)
+        commands = np.ndarray((self.num_drones, self.ring_size),
+                              COMMAND_DTYPE, buffer, self.commands_offset)
+        return header, states, ring_control, commands
+
+
+def _make_wakeup_fds():
+    '''Returns (read_fd, write_fd) used to wake the server up. Both are the same for an eventfd'''
+    if hasattr(os, 'eventfd'):
+        fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        return fd, fd
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.set_blocking(write_fd, False)
+    return read_fd, write_fd
+
+
+# 8 bytes, as required by eventfd (pipes accept it too)
+_WAKEUP_DATA = (1).to_bytes(8, 'little')
+
+
+class SharedMemoryControlServer(threading.Thread):
+    '''
+    Publishes the state of the given vehicles into shared memory and applies commands written by clients.
+
+    :param list controllers: Interfaces of the vehicles to serve. The client refers to them by their index.
+    :param str name: Name of the shared memory block. A random name is generated if not given.
+    :param int ring_size: Number of command slots per vehicle.
+    :param float rate: Rate (Hz) at which the state is published and commands are applied.
+    :param bool wakeup: Create an eventfd/pipe (`wakeup_fd`) which clients can use to have commands applied immediately.
+    '''
+
+    def __init__(self,
+                 controllers: Sequence[IDroneControllable],
+                 name: Optional[str] = None,
+                 ring_size: int = 64,
+                 rate: float = 100.0,
+                 wakeup: bool = False,
+                 auto_start: bool = True):
+        super().__init__(daemon=True)
+        if rate <= 0:
+            raise ValueError("rate must be positive, got %r" % rate)
+        self._controllers: List[IDroneControllable] = list(controllers)
+        self._rate = rate
+
+        self.layout = SharedMemoryLayout(len(self._controllers), ring_size)
+        self._shm = shared_memory.SharedMemory(
+            name, create=True, size=self.layout.size)
+        self._header, self._states, self._ring_control, self._commands = self.layout.map(
+            self._shm.buf)
+        self._states[...] = 0
+        self._ring_control[...] = 0
+        self._header['magic'] = SHM_MAGIC
+        self._header['version'] = SHM_VERSION
+        self._header['num_drones'] = len(self._controllers)
+        self._header['ring_size'] = ring_size
+
+        # Field views, to write without looking up fields every update
+        self._state_seq = self._states['seq']
+        self._ring_head = self._ring_control['head']
+        self._ring_tail = self._ring_control['tail']
+
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_read_fd = self._wakeup_write_fd = None
+        if wakeup:
+            self._wakeup_read_fd, self._wakeup_write_fd = _make_wakeup_fds()
+            self._selector.register(self._wakeup_read_fd, selectors.EVENT_READ)
+
+        self._running = threading.Event()
+        if auto_start:
+            self.start()
+
+    @property
+    def name(self) -> str:
+        '''Name to attach clients to'''
+        return self._shm.name
+
+    @property
+    def wakeup_fd(self) -> Optional[int]:
+        '''File descriptor clients write to in order to wake the server up, if enabled'''
+        return self._wakeup_write_fd
+
+    def start(self):
+        self._running.set()
+        super().start()
+
+    def stop(self):
+        '''Stop the server thread (if running) and remove the shared memory block'''
+        self._running.clear()
+        if self.is_alive():
+            self.join()
+        self._selector.close()
+        for fd in {self._wakeup_read_fd, self._wakeup_write_fd} - {None}:
+            os.close(fd)
+        # Views have to be released before the memory can be closed
+        del self._header, self._states, self._ring_control, self._commands
+        del self._state_seq, self._ring_head, self._ring_tail
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def run(self):
+        period = 1.0 / self._rate
+        next_time = time.perf_counter()
+        while self._running.is_set():
+            timeout = max(0.0, next_time - time.perf_counter())
+            if self._wakeup_read_fd is not None:
+                if self._selector.select(timeout):
+                    self._drain_wakeup()
+                    self.apply_commands()
+            else:
+                time.sleep(timeout)
+
+            now = time.perf_counter()
+            if now >= next_time:
+                self.update()
+                next_time += period
+                if next_time < now:
+                    next_time = now + period
+
+    def update(self):
+        '''Apply pending commands and publish the state of all vehicles'''
+        self.apply_commands()
+        for index in range(len(self._controllers)):
+            self.publish_state(index)
+
+    def apply_commands(self):
+        '''Apply commands written into the rings since the last call'''
+        for index, controller in enumerate(self._controllers):
+            tail = int(self._ring_tail[index])
+            head = int(self._ring_head[index])
+            if tail == head:
+                continue
+            # Only the latest RC is sent between actions, as the controller would apply each one for a tick
+            pending_rc = None
+            ring = self._commands[index]
+            ring_size = self.layout.ring_size
+            while tail < head:
+                slot = ring[tail % ring_size]
+                kind = int(slot['kind'])
+                if kind == CMD_RC:
+                    pending_rc = slot['rc']
+                elif kind == CMD_ACTION:
+                    if pending_rc is not None:
+                        controller.rc_control(StepRC(*pending_rc.tolist()))
+                        pending_rc = None
+                    controller.direct_action(DroneAction(int(slot['action'])))
+                tail += 1
+            if pending_rc is not None:
+                controller.rc_control(StepRC(*pending_rc.tolist()))
+            self._ring_tail[index] = tail
+
+    def publish_state(self, index: int):
+        '''Write the current state of the vehicle at `index` into its state slot'''
+        state = self._controllers[index].get_current_state()
+        if state is None:
+            return
+        info = state[3]
+        physics_state = info.get('state') or {}
+
+        slot = self._states[index]
+        seq = int(self._state_seq[index])
+        # Odd while writing
+        self._state_seq[index] = seq + 1
+        slot['tick'] = info.get('metrics', {}).get('ticks', 0)
+        slot['timestamp'] = time.time()
+        if 'pos' in physics_state:
+            slot['pos'] = tuple(physics_state['pos'])
+        if 'angle' in physics_state:
+            slot['angle'] = tuple(physics_state['angle'])
+        if 'pvel' in physics_state:
+            slot['vel'] = tuple(physics_state['pvel'].xyz)
+        if 'thrust_vec' in physics_state:
+            slot['thrust'] = tuple(physics_state['thrust_vec'])
+        operation = physics_state.get('operation')
+        slot['operation'] = operation.value if isinstance(
+            operation, DroneState) else 0
+        slot['motor_armed'] = bool(physics_state.get('motor_armed', False))
+        self._state_seq[index] = seq + 2
+
+    def _drain_wakeup(self):
+        try:
+            os.read(self._wakeup_read_fd, 4096)
+        except BlockingIOError:
+            pass
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    '''Attach to an existing block without the resource tracker removing it when this process exits'''
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # Python < 3.13 always registers the block with the tracker (on POSIX), even when only attaching to it
+    shm = shared_memory.SharedMemory(name)
+    if os.name == 'posix':
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class SharedMemoryControlClient:
+    '''
+    Controls a vehicle served by a `SharedMemoryControlServer` from another process.
+
+    :param str name: Name of the shared memory block (`SharedMemoryControlServer.name`).
+    :param int index: Index of the vehicle in the server's list of controllers.
+    :param int wakeup_fd: Inherited `SharedMemoryControlServer.wakeup_fd`, to wake the server after writing commands.
+    '''
+
+    def __init__(self, name: str, index: int = 0, wakeup_fd: Optional[int] = None):
+        self._shm = _attach_shared_memory(name)
+        header = np.ndarray((), HEADER_DTYPE, self._shm.buf, 0)
+        if int(header['magic']) != SHM_MAGIC or int(header['version']) != SHM_VERSION:
+            del header
+            self._shm.close()
+            raise ValueError(
+                "Shared memory '%s' is not a compatible control block" % name)
+        num_drones, ring_size = int(header['num_drones']), int(header['ring_size'])
+        del header
+        if not 0 <= index < num_drones:
+            self._shm.close()
+            raise IndexError("Vehicle index %d out of range (%d vehicles)" % (index, num_drones))
+
+        self.index = index
+        self.layout = SharedMemoryLayout(num_drones, ring_size)
+        _, states, ring_control, commands = self.layout.map(self._shm.buf)
+        self._state_seq = states['seq']
+        self._state = states[index:index+1]
+        self._ring_head = ring_control['head']
+        self._ring_tail = ring_control['tail']
+        self._ring = commands[index]
+        self._wakeup_fd = wakeup_fd
+
+        # Reusable output record of `read_state()`
+        self._state_out = np.zeros(1, STATE_DTYPE)
+
+    def read_state(self, out: Optional[np.ndarray] = None, max_retries: int = 1000) -> Optional[np.ndarray]:
+        '''
+        Copy a consistent snapshot of the vehicle state into `out` (a 1-element array of `STATE_DTYPE`), or
+        into an internal buffer that is reused on every call. Returns None if the state had not been published yet
+        or a consistent copy couldn't be made in `max_retries` attempts.
+        '''
+        if out is None:
+            out = self._state_out
+        for _ in range(max_retries):
+            seq = int(self._state_seq[self.index])
+            if seq == 0:
+                return None
+            if seq & 1:
+                continue
+            out[...] = self._state
+            if int(self._state_seq[self.index]) == seq:
+                return out
+        return None
+
+    def send_rc(self, vector: StepRC) -> bool:
+        '''Write an RC command. Returns False if the command ring is full'''
+        slot = self._claim_slot()
+        if slot is None:
+            return False
+        slot['kind'] = CMD_RC
+        slot['rc'] = vector
+        self._commit_slot()
+        return True
+
+    def send_action(self, action: DroneAction) -> bool:
+        '''Write a `DroneAction` command. Returns False if the command ring is full'''
+        slot = self._claim_slot()
+        if slot is None:
+            return False
+        slot['kind'] = CMD_ACTION
+        slot['action'] = action.value
+        self._commit_slot()
+        return True
+
+    def close(self):
+        del self._state_seq, self._state, self._ring_head, self._ring_tail, self._ring
+        self._shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _claim_slot(self):
+        head = int(self._ring_head[self.index])
+        if head - int(self._ring_tail[self.index]) >= self.layout.ring_size:
+            return None
+        return self._ring[head % self.layout.ring_size]
+
+    def _commit_slot(self):
+        # Publish the slot to the server only after it has been completely written
+        self._ring_head[self.index] += 1
+        if self._wakeup_fd is not None:
+            try:
+                os.write(self._wakeup_fd, _WAKEUP_DATA)
+            except BlockingIOError:
+                # Server already has plenty of wakeups pending
+                pass
+
+
+__all__ = [
+    'STATE_DTYPE',
+    'COMMAND_DTYPE',
+    'SharedMemoryLayout',
+    'SharedMemoryControlServer',
+    'SharedMemoryControlClient'
+]
@@ -0,0 +1,146 @@
+
+from bisect import bisect_left
+from itertools import islice
+
+from typing import Sequence, Optional, List
+
+
+# Default histogram bin edges (in seconds) for tick timing measurements
+TIMING_BIN_EDGES = (1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 1e-1)
+
+
+class RollingHistogram:
+    '''
+    Histogram of the most recent `window` samples, with fixed bin edges.
+
+    Adding a sample is O(log(bins)) and does not allocate, so it can be called every tick.
+    Bin `i` counts values up to `edges[i]`, and the last bin counts everything above the last edge.
+    '''
+
+    def __init__(self, edges: Sequence[float] = TIMING_BIN_EDGES, window: int = 1000):
+        if window <= 0:
+            raise ValueError("window must be positive, got %r" % window)
+        self.edges = tuple(edges)
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.counts: List[int] = [0] * (len(self.edges) + 1)
+        self._bins: List[int] = [0] * self.window
+        self._values: List[float] = [0.0] * self.window
+        self._pos = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def add(self, value: float):
+        idx = bisect_left(self.edges, value)
+        if self._count == self.window:
+            # Evict the oldest sample
+            self.counts[self._bins[self._pos]] -= 1
+            self._sum -= self._values[self._pos]
+        else:
+            self._count += 1
+        self._bins[self._pos] = idx
+        self._values[self._pos] = value
+        self.counts[idx] += 1
+        self._sum += value
+        self._pos = (self._pos + 1) % self.window
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self._count if self._count else 0.0
+
+    @property
+    def max(self) -> float:
+        '''Largest sample in the window (computed when read, as it is read far less often than samples are added)'''
+        if self._count == 0:
+            return 0.0
+        return max(self._values) if self._count == self.window else max(islice(self._values, self._count))
+
+    def percentile(self, q: float) -> Optional[float]:
+        '''
+        Upper edge of the bin containing the `q` (0 to 100) percentile. None if it is above the last edge,
+        and 0.0 if there are no samples
+        '''
+        if self._count == 0:
+            return 0.0
+        target = q / 100 * self._count
+        total = 0
+        for idx, count in enumerate(self.counts):
+            total += count
+            if total >= target and count > 0:
+                return self.edges[idx] if idx < len(self.edges) else None
+        return None
+
+    def summary(self, scale: float = 1e3) -> dict:
+        '''Summary statistics, multiplied by `scale` (milliseconds, for seconds as input)'''
+        p99 = self.percentile(99)
+        return {
+            'avg': self.mean * scale,
+            # Above the last bin edge
+            'p99': p99 * scale if p99 is not None else float('inf'),
+            'max': self.max * scale,
+            'hist': ' '.join(str(c) for c in self.counts)
+        }
+
+
+class TickTelemetry:
+    '''
+    Timing statistics of a tick loop: how long each tick takes, how late ticks start compared to their
+    schedule and how much longer sleeps take than requested, along with counters for ticks that
+    couldn't keep up.
+
+    `overruns` counts ticks that took longer than the tick period, `late_ticks` counts ticks that
+    started more than a whole period late and `dropped_ticks` counts ticks skipped to catch up.
+    '''
+
+    def __init__(self, window: int = 1000, edges: Sequence[float] = TIMING_BIN_EDGES):
+        self.tick_duration = RollingHistogram(edges, window)
+        self.lateness = RollingHistogram(edges, window)
+        self.sleep_overshoot = RollingHistogram(edges, window)
+        self.overruns = 0
+        self.late_ticks = 0
+        self.dropped_ticks = 0
+
+    def reset(self):
+        self.tick_duration.reset()
+        self.lateness.reset()
+        self.sleep_overshoot.reset()
+        self.overruns = 0
+        self.late_ticks = 0
+        self.dropped_ticks = 0
+
+    def record_tick(self, duration: float, period: Optional[float] = None):
+        '''Record time taken by a tick. If `period` is given, ticks longer than it count as overruns'''
+        self.tick_duration.add(duration)
+        if period is not None and duration > period:
+            self.overruns += 1
+
+    def record_wait(self, lateness: float, overshoot: Optional[float], period: float):
+        '''Record how late a tick started compared to the schedule and the sleep overshoot (if it slept)'''
+        self.lateness.add(lateness)
+        if overshoot is not None:
+            self.sleep_overshoot.add(overshoot)
+        if lateness > period:
+            self.late_ticks += 1
+
+    def summary(self) -> dict:
+        '''Statistics in milliseconds and counters, to be shown in debug data'''
+        return {
+            'tick_ms': self.tick_duration.summary(),
+            'late_ms': self.lateness.summary(),
+            'oversleep_ms': self.sleep_overshoot.summary(),
+            'overruns': self.overruns,
+            'late_ticks': self.late_ticks,
+            'dropped_ticks': self.dropped_ticks
+        }
+
+
+__all__ = [
+    'TIMING_BIN_EDGES',
+    'RollingHistogram',
+    'TickTelemetry'
+]
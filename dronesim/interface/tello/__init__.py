@@ -0,0 +1,2 @@
+
+from .tello import TelloServer, TelloDroneEmulator, TelloCommandError
@@ -0,0 +1,383 @@
+
+'''
+Emulates DJI Tello drones (Tello SDK 2.0 text protocol over UDP) on top of `IDroneControllable` interfaces,
+so that existing Tello client code can fly simulated vehicles.
+
+Each emulated drone listens for text commands on its own address (port 8889 on a real Tello) and replies
+to the sender, and broadcasts its state string to the sender's state port (8890 on a real Tello) once
+the client has entered SDK mode with the `command` command.
+
+All drones are served by one asyncio event loop running on a background thread. As the standard client
+libraries expect ports 8889/8890, multiple drones can be bound to different loopback addresses
+(127.0.0.2, 127.0.0.3, ...) or to different ports if the client allows it.
+'''
+
+import time
+import asyncio
+import logging
+import threading
+
+from dronesim.interface.control import IDroneControllable, UnsupportedAction
+from dronesim.interface.types import StepRC
+from dronesim.utils import rad2deg
+
+from typing import Optional, Callable, Tuple, Dict, List, Set
+
+
+LOG = logging.getLogger(__name__)
+
+TELLO_COMMAND_PORT = 8889
+TELLO_STATE_PORT = 8890
+
+TELLO_SPEED_DEFAULT = 10.0
+TELLO_SPEED_RANGE = (10.0, 100.0)
+TELLO_MOVE_RANGE = (20.0, 500.0)
+TELLO_ROTATE_RANGE = (1.0, 360.0)
+TELLO_RC_MAX = 100.0
+
+AddressType = Tuple[str, int]
+
+
+class TelloCommandError(Exception):
+    '''Command can't be performed. The message is sent to the client after "error"'''
+    pass
+
+
+class TelloDroneEmulator(asyncio.DatagramProtocol):
+    '''
+    Handles the Tello SDK commands of one emulated drone and maps them to the drone's controller.
+
+    Control commands (takeoff, land, movement) are run on the event loop's executor since the controller
+    blocks till they complete, and the response is sent when done. Only one control command can run at a time.
+
+    :param IDroneControllable controller: Interface of the vehicle to control.
+    :param tuple address: Address to listen on for commands.
+    :param int state_port: Port on the client to send the state string to.
+    :param float state_rate: Number of state strings sent per second.
+    :param float command_timeout: Time limit (in seconds) for control commands to complete.
+    '''
+
+    def __init__(self,
+                 controller: IDroneControllable,
+                 address: AddressType = ('0.0.0.0', TELLO_COMMAND_PORT),
+                 state_port: int = TELLO_STATE_PORT,
+                 state_rate: float = 10.0,
+                 command_timeout: Optional[float] = 20.0,
+                 serial_number: str = '0TQDG000000000'):
+        self.controller = controller
+        self.address = address
+        self.state_port = state_port
+        self.state_rate = state_rate
+        self.command_timeout = command_timeout
+        self.serial_number = serial_number
+
+        self.sdk_mode = False
+        self.speed = TELLO_SPEED_DEFAULT
+        self.client_address: Optional[AddressType] = None
+
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._state_task: Optional[asyncio.Task] = None
+        # Running command handlers (the event loop only keeps weak references to tasks)
+        self._command_tasks: Set[asyncio.Task] = set()
+        self._busy = False
+        self._takeoff_time: Optional[float] = None
+
+        # Command name -> handler. Handlers get the arguments as strings and return the response,
+        # or an awaitable which resolves to the response
+        self._commands: Dict[str, Callable[..., object]] = {
+            'command': self._cmd_command,
+            'takeoff': self._cmd_takeoff,
+            'land': self._cmd_land,
+            'emergency': self._cmd_emergency,
+            'stop': self._cmd_stop,
+            'streamon': self._cmd_ok,
+            'streamoff': self._cmd_ok,
+            'up': self._make_move_cmd('move_up'),
+            'down': self._make_move_cmd('move_down'),
+            'left': self._make_move_cmd('move_left'),
+            'right': self._make_move_cmd('move_right'),
+            'forward': self._make_move_cmd('move_forward'),
+            'back': self._make_move_cmd('move_backward'),
+            'cw': self._make_rotate_cmd('rotate_clockwise'),
+            'ccw': self._make_rotate_cmd('rotate_counterclockwise'),
+            'rc': self._cmd_rc,
+            'speed': self._cmd_speed,
+            'speed?': lambda: '%d' % self.speed,
+            'battery?': lambda: '100',
+            'time?': lambda: '%ds' % self.flight_time,
+            'height?': lambda: '%ddm' % (self.height / 10),
+            'tof?': lambda: '%dmm' % (self.height * 10),
+            'baro?': lambda: '%.2f' % (self.height / 100),
+            'attitude?': lambda: 'pitch:0;roll:0;yaw:%d;' % self.yaw,
+            'temp?': lambda: '60~63C',
+            'wifi?': lambda: '90',
+            'sdk?': lambda: '20',
+            'sn?': lambda: self.serial_number
+        }
+
+    # Vehicle state
+
+    def _physics_state(self) -> dict:
+        state = self.controller.get_current_state()
+        if state is None:
+            return {}
+        return state[3].get('state') or {}
+
+    @property
+    def bound_address(self) -> Optional[AddressType]:
+        '''Address the drone is actually listening on (useful if port 0 was given)'''
+        if self._transport is None:
+            return None
+        return self._transport.get_extra_info('sockname')
+
+    @property
+    def height(self) -> float:
+        '''Height in cm'''
+        pos = self._physics_state().get('pos')
+        return 0.0 if pos is None else float(pos[2])
+
+    @property
+    def yaw(self) -> float:
+        '''Yaw in degrees, clockwise'''
+        angle = self._physics_state().get('angle')
+        return 0.0 if angle is None else -float(rad2deg(angle[2]))
+
+    @property
+    def flight_time(self) -> float:
+        if self._takeoff_time is None:
+            return 0.0
+        return time.monotonic() - self._takeoff_time
+
+    def state_string(self) -> str:
+        '''Build the Tello state string from the vehicle's state'''
+        state = self._physics_state()
+        vel = state.get('pvel', (0.0, 0.0, 0.0))
+        h = self.height
+        return (
+            'mid:-1;x:0;y:0;z:0;mpry:0,0,0;'
+            'pitch:0;roll:0;yaw:%d;vgx:%d;vgy:%d;vgz:%d;templ:60;temph:63;'
+            'tof:%d;h:%d;bat:100;baro:%.2f;time:%d;agx:0.00;agy:0.00;agz:-1000.00;\r\n'
+        ) % (self.yaw, vel[1], vel[0], vel[2], h + 10, h, h / 100, self.flight_time)
+
+    # asyncio.DatagramProtocol
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self._transport = transport
+        self._state_task = asyncio.ensure_future(self._state_broadcast())
+
+    def connection_lost(self, exc: Optional[Exception]):
+        if self._state_task is not None:
+            self._state_task.cancel()
+        self._transport = None
+
+    def datagram_received(self, data: bytes, addr: AddressType):
+        self.client_address = addr
+        try:
+            command = data.decode('ascii').strip()
+        except UnicodeDecodeError:
+            self._reply('error', addr)
+            return
+        task = asyncio.ensure_future(self._handle_command(command, addr))
+        self._command_tasks.add(task)
+        task.add_done_callback(self._command_tasks.discard)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    async def aclose(self):
+        '''Close the socket, and cancel and wait for the state broadcast and running commands'''
+        self.close()
+        tasks = list(self._command_tasks)
+        if self._state_task is not None:
+            tasks.append(self._state_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle_command(self, command: str, addr: AddressType):
+        if not command:
+            return
+        name, *args = command.split()
+        handler = self._commands.get(name)
+        if handler is None:
+            LOG.debug("Unknown Tello command '%s'" % command)
+            self._reply('unknown command: %s' % name, addr)
+            return
+
+        try:
+            response = handler(*args)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except TelloCommandError as e:
+            response = 'error %s' % e if str(e) else 'error'
+        except (TypeError, ValueError):
+            response = 'error'
+
+        if response is not None:
+            self._reply(response, addr)
+
+    def _reply(self, response: str, addr: AddressType):
+        if self._transport is not None:
+            self._transport.sendto(response.encode('ascii'), addr)
+
+    async def _state_broadcast(self):
+        while True:
+            await asyncio.sleep(1.0 / self.state_rate)
+            if self.sdk_mode and self.client_address is not None and self._transport is not None:
+                self._transport.sendto(
+                    self.state_string().encode('ascii'),
+                    (self.client_address[0], self.state_port)
+                )
+
+    async def _run_control(self, method: str, *args):
+        '''Run a (blocking) control method of the controller on the executor and reply when done'''
+        if self._busy:
+            raise TelloCommandError('Not joystick')
+        self._busy = True
+        try:
+            fn = getattr(self.controller, method)
+            completed = await asyncio.get_event_loop().run_in_executor(
+                None, lambda: fn(*args, blocking=True, timeout=self.command_timeout))
+        except (NotImplementedError, UnsupportedAction):
+            raise TelloCommandError('Not supported')
+        finally:
+            self._busy = False
+        if completed is False:
+            raise TelloCommandError('Timeout')
+        return 'ok'
+
+    # Command handlers
+
+    def _cmd_ok(self):
+        return 'ok'
+
+    def _cmd_command(self):
+        self.sdk_mode = True
+        return 'ok'
+
+    async def _cmd_takeoff(self):
+        response = await self._run_control('takeoff')
+        self._takeoff_time = time.monotonic()
+        return response
+
+    async def _cmd_land(self):
+        response = await self._run_control('land')
+        self._takeoff_time = None
+        return response
+
+    def _cmd_emergency(self):
+        self.controller.unarm(blocking=False)
+        self._takeoff_time = None
+        return 'ok'
+
+    def _cmd_stop(self):
+        self.controller.freeze(blocking=False)
+        return 'ok'
+
+    def _cmd_rc(self, a, b, c, d):
+        # No response is sent for RC commands
+        rc = (float(a), float(b), float(c), float(d))
+        self.controller.rc_control(StepRC(*(
+            max(-TELLO_RC_MAX, min(TELLO_RC_MAX, v)) / TELLO_RC_MAX for v in rc)))
+
+    def _cmd_speed(self, x):
+        speed = float(x)
+        if not TELLO_SPEED_RANGE[0] <= speed <= TELLO_SPEED_RANGE[1]:
+            raise TelloCommandError('Out of range')
+        self.speed = speed
+        return 'ok'
+
+    def _make_move_cmd(self, method: str):
+        def _cmd_move(x):
+            dist = float(x)
+            if not TELLO_MOVE_RANGE[0] <= dist <= TELLO_MOVE_RANGE[1]:
+                raise TelloCommandError('Out of range')
+            return self._run_control(method, dist, self.speed)
+        return _cmd_move
+
+    def _make_rotate_cmd(self, method: str):
+        def _cmd_rotate(x):
+            angle = float(x)
+            if not TELLO_ROTATE_RANGE[0] <= angle <= TELLO_ROTATE_RANGE[1]:
+                raise TelloCommandError('Out of range')
+            return self._run_control(method, angle, None)
+        return _cmd_rotate
+
+
+class TelloServer(threading.Thread):
+    '''
+    Runs any number of `TelloDroneEmulator`s from a single asyncio event loop on a background thread.
+
+    Drones can be added before or after the server is started using `add_drone()`.
+    '''
+
+    def __init__(self, auto_start: bool = True):
+        super().__init__(daemon=True)
+        self._loop = asyncio.new_event_loop()
+        self._drones: List[TelloDroneEmulator] = []
+        self._ev_started = threading.Event()
+        if auto_start:
+            self.start()
+            self._ev_started.wait()
+
+    @property
+    def drones(self) -> List[TelloDroneEmulator]:
+        return list(self._drones)
+
+    def run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(self._ev_started.set)
+        self._loop.run_forever()
+
+    def add_drone(self,
+                  controller: IDroneControllable,
+                  address: AddressType = ('0.0.0.0', TELLO_COMMAND_PORT),
+                  **emulator_params) -> TelloDroneEmulator:
+        '''Start serving an emulated Tello drone for `controller` on `address`'''
+        drone = TelloDroneEmulator(controller, address, **emulator_params)
+        self._run(self._open(drone))
+        self._drones.append(drone)
+        return drone
+
+    def remove_drone(self, drone: TelloDroneEmulator):
+        self._drones.remove(drone)
+        self._run(drone.aclose())
+
+    def stop(self):
+        '''Close all drones, wait for their tasks to finish, and stop the event loop'''
+        drones = list(self._drones)
+        self._drones.clear()
+        self._run(self._close_drones(drones))
+        if self.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self.join()
+        self._loop.close()
+
+    def _run(self, coro):
+        '''Run the coroutine on the event loop and wait for it'''
+        if self.is_alive():
+            return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+        return self._loop.run_until_complete(coro)
+
+    @staticmethod
+    async def _close_drones(drones: List[TelloDroneEmulator]):
+        await asyncio.gather(*(drone.aclose() for drone in drones))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    async def _open(self, drone: TelloDroneEmulator):
+        await self._loop.create_datagram_endpoint(lambda: drone, local_addr=drone.address)
+
+
+__all__ = [
+    'TELLO_COMMAND_PORT',
+    'TELLO_STATE_PORT',
+    'TelloCommandError',
+    'TelloDroneEmulator',
+    'TelloServer'
+]
@@ -0,0 +1,209 @@
+
+'''
+On-disk cache of converted models, so that glTF files are only converted (parsed) by panda3d-gltf once.
+
+Converted models are written as `.bam` files named by a hash of the source file's content and of the
+converter versions, so a cached model is used until the source file changes or Panda3D / panda3d-gltf is
+updated. Later loads read the `.bam` file, which is much faster than converting the glTF file again.
+'''
+
+from panda3d.core import (
+    NodePath,
+    Filename,
+    VirtualFileSystem,
+    PandaSystem,
+    BamFile,
+    getModelPath
+)
+from direct.showbase.Loader import Loader
+
+from dronesim.panda3d_types import PandaFilePath
+
+import os
+import hashlib
+import logging
+import tempfile
+
+from typing import Optional, Union, Dict, List, Tuple
+
+
+LOG = logging.getLogger(__name__)
+
+# Bump when the way models are converted or stored in the cache changes
+MODEL_CACHE_FORMAT = 1
+
+# Cache directory, unless given. Can be set with the DRONESIM_MODEL_CACHE environment variable
+DEFAULT_MODEL_CACHE_DIR = os.environ.get(
+    'DRONESIM_MODEL_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'dronesim', 'models'))
+
+
+def converter_version() -> str:
+    '''Versions of everything that affects the converted model, part of every cache key'''
+    try:
+        import gltf
+        gltf_version = getattr(gltf, '__version__', 'unknown')
+    except ImportError:
+        gltf_version = 'none'
+    bam = BamFile()
+    return 'panda3d-%s;gltf-%s;bam-%d.%d;format-%d' % (
+        PandaSystem.get_version_string(), gltf_version,
+        bam.get_current_major_ver(), bam.get_current_minor_ver(), MODEL_CACHE_FORMAT)
+
+
+def model_cache_key(content: bytes, version: str) -> str:
+    '''Cache key of a model from its source file's content and the converter version'''
+    digest = hashlib.sha256(version.encode())
+    digest.update(content)
+    return digest.hexdigest()
+
+
+class ModelCache:
+    '''
+    Loads models through an on-disk cache of converted `.bam` files.
+
+    Only files with the extensions in `extensions` (glTF by default) are cached; other models (such as `.bam`
+    and `.egg` files, which are fast to load) are loaded directly. Source files are read through the VFS, so
+    models from the virtual assets directory are cached the same way as physical files.
+
+    :param str cache_dir: Directory to store converted models in (created when needed).
+    :param Loader loader: Loader to load models with, unless given in the load calls.
+    :param bool enabled: If False, models are always loaded from the source file.
+
+    Converted models are also looked up (by the same key) in the read-only VFS directories of `search_paths`,
+    such as the pre-converted models of a mounted asset bundle (see `dronesim.app.bundle`).
+    '''
+
+    def __init__(self,
+                 cache_dir: str = DEFAULT_MODEL_CACHE_DIR,
+                 loader: Optional[Loader] = None,
+                 vfs: Optional[VirtualFileSystem] = None,
+                 extensions: Tuple[str, ...] = ('gltf', 'glb'),
+                 enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.extensions = extensions
+        self._loader = loader if loader is not None else Loader(None)
+        self._vfs = vfs if vfs is not None else VirtualFileSystem.get_global_ptr()
+        self._converter_version = converter_version()
+        # Cache keys by (source path, modification time, size), to only hash each source file once
+        self._keys: Dict[Tuple[str, int, int], str] = {}
+        self.search_paths: List[str] = []
+
+    def add_search_path(self, vfs_dir: str):
+        '''Also look for converted models in the (virtual) directory'''
+        if vfs_dir not in self.search_paths:
+            self.search_paths.append(vfs_dir)
+
+    def resolve(self, model_path: PandaFilePath) -> Optional[Filename]:
+        '''Full (virtual) path of the model on the model path, or None if it is not found'''
+        if isinstance(model_path, (str, Filename)):
+            filename = Filename(model_path)
+        else:
+            filename = Filename.from_os_specific(os.fspath(model_path))
+        if self._vfs.resolve_filename(filename, getModelPath().get_value()):
+            return filename
+        return None
+
+    def cache_key(self, source: Filename) -> str:
+        '''Hash of the source file's content and the converter versions'''
+        vfile = self._vfs.get_file(source)
+        stat_key = (source.get_fullpath(), vfile.get_timestamp(), vfile.get_file_size())
+        key = self._keys.get(stat_key)
+        if key is None:
+            key = self._keys[stat_key] = model_cache_key(vfile.read_file(True), self._converter_version)
+        return key
+
+    def cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, '%s.bam' % key)
+
+    def _cached_source(self, model_path: PandaFilePath) -> Optional[Tuple[Filename, Union[str, Filename]]]:
+        '''
+        Resolved source file and its cache file, if the model should go through the cache.
+        The cache file is a VFS `Filename` if found in the search paths, otherwise a path in the cache directory.
+        '''
+        if not self.enabled or isinstance(model_path, NodePath):
+            return None
+        source = self.resolve(model_path)
+        if source is None or source.get_extension().lower() not in self.extensions:
+            return None
+        key = self.cache_key(source)
+        for vfs_dir in self.search_paths:
+            bundled = Filename('%s/%s.bam' % (vfs_dir.rstrip('/'), key))
+            if self._vfs.exists(bundled):
+                return source, bundled
+        return source, self.cache_path(key)
+
+    def _is_cached(self, cache_file: Union[str, Filename]) -> bool:
+        return self._vfs.exists(cache_file) if isinstance(cache_file, Filename) else os.path.isfile(cache_file)
+
+    @staticmethod
+    def _cache_filename(cache_file: Union[str, Filename]) -> Filename:
+        return cache_file if isinstance(cache_file, Filename) else Filename.from_os_specific(cache_file)
+
+    def load_model(self, model_path: PandaFilePath, loader: Optional[Loader] = None) -> NodePath:
+        '''Load the model, from the cache if it was converted before'''
+        loader = loader or self._loader
+        cached = self._cached_source(model_path)
+        if cached is None:
+            return loader.load_model(model_path)
+        source, cache_file = cached
+        if self._is_cached(cache_file):
+            # Through the model pool, so that later loads copy the model in memory rather than reading it again
+            return loader.load_model(self._cache_filename(cache_file))
+        model = loader.load_model(source, noCache=True)
+        self._store(model, cache_file, source)
+        return model
+
+    async def load_model_async(self, model_path: PandaFilePath, loader: Optional[Loader] = None) -> NodePath:
+        '''Load the model without blocking (see `load_model()`), to await in a task'''
+        loader = loader or self._loader
+        cached = self._cached_source(model_path)
+        if cached is None:
+            return await loader.load_model(model_path, blocking=False)
+        source, cache_file = cached
+        if self._is_cached(cache_file):
+            return await loader.load_model(self._cache_filename(cache_file), blocking=False)
+        model = await loader.load_model(source, blocking=False, noCache=True)
+        self._store(model, cache_file, source)
+        return model
+
+    def _store(self, model: NodePath, cache_file: str, source: Filename):
+        '''Write the converted model, atomically, so that concurrent loads never see a partial file'''
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.bam', dir=self.cache_dir)
+            os.close(fd)
+            try:
+                if not model.write_bam_file(Filename.from_os_specific(tmp_path)):
+                    raise OSError("Could not write %s" % tmp_path)
+                os.replace(tmp_path, cache_file)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except OSError as e:
+            LOG.warning("Could not cache converted model %s: %s" % (source, e))
+        else:
+            LOG.info("Cached converted model %s as %s" % (source, cache_file))
+
+    def clear(self):
+        '''Delete all cached models'''
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.bam'):
+                os.remove(os.path.join(self.cache_dir, name))
+        self._keys.clear()
+
+
+DEFAULT_MODEL_CACHE = ModelCache()
+
+
+__all__ = [
+    'MODEL_CACHE_FORMAT',
+    'DEFAULT_MODEL_CACHE_DIR',
+    'converter_version',
+    'model_cache_key',
+    'ModelCache',
+    'DEFAULT_MODEL_CACHE'
+]
@@ -0,0 +1,17 @@
+'''
+Type aliases that depend on Panda3D. They are kept out of `dronesim.types`, so that using the simulator
+without rendering does not import Panda3D.
+'''
+
+import os
+from panda3d.core import Filename
+
+from typing import Union
+
+
+PandaFilePath = Union[str, os.PathLike, Filename]
+
+
+__all__ = [
+    'PandaFilePath'
+]
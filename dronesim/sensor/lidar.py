@@ -0,0 +1,114 @@
+
+from .sensor import SensorBase
+from .raycast import RaycastGeometry
+from dronesim.utils import hpr_to_matrix
+
+import time
+import numpy as np
+
+from typing import Optional, Sequence, Callable
+
+
+def make_beam_table(horizontal_fov: float = 360.0,
+                    horizontal_beams: int = 360,
+                    vertical_angles: Sequence[float] = (0.0,)) -> np.ndarray:
+    '''
+    Unit direction of each beam (N x 3, float32) in the sensor's frame (Y forward, X right, Z up), for a scanner with
+    `horizontal_beams` beams spread over `horizontal_fov` degrees at each of the `vertical_angles` (degrees, up is positive).
+    Beams are ordered by vertical angle, then by horizontal angle from left to right.
+    '''
+    if horizontal_fov >= 360.0:
+        yaw = np.linspace(-180.0, 180.0, horizontal_beams, endpoint=False)
+    else:
+        yaw = np.linspace(-horizontal_fov / 2, horizontal_fov / 2, horizontal_beams)
+    yaw = np.radians(yaw)[np.newaxis, :]
+    pitch = np.radians(np.asarray(vertical_angles, dtype=np.float64))[:, np.newaxis]
+    beams = np.empty((pitch.shape[0], yaw.shape[1], 3), dtype=np.float32)
+    beams[..., 0] = np.cos(pitch) * np.sin(yaw)
+    beams[..., 1] = np.cos(pitch) * np.cos(yaw)
+    beams[..., 2] = np.broadcast_to(np.sin(pitch), beams.shape[:2])
+    return beams.reshape(-1, 3)
+
+
+class LidarSensor(SensorBase):
+    '''
+    Rangefinder / LiDAR which casts all of its beams at once against static scene geometry (see `dronesim.sensor.raycast`).
+
+    The beam directions are computed once (see `make_beam_table()`), and each scan rotates them with the drone's
+    orientation and casts them together. Scans are done at `scan_rate`; updates in between return the last scan.
+
+    Readings are float32 arrays of the range of each beam, with `inf` for beams that returned nothing.
+
+    :param RaycastGeometry geometry: Scene to cast against, such as a heightfield or a triangle BVH.
+    :param beams: N x 3 array of unit beam directions in the drone's frame. A single downward beam (a
+    rangefinder) is used if not given.
+    :param offset: Mounting position of the sensor in the drone's frame.
+    :param float scan_rate: Scans per second. If None, a new scan is made on every update.
+    :param clock: Function that returns the current time in seconds, used to keep the scan rate.
+    '''
+
+    def __init__(self,
+                 geometry: RaycastGeometry,
+                 beams: Optional[np.ndarray] = None,
+                 max_range: float = 100.0,
+                 min_range: float = 0.05,
+                 offset: Sequence[float] = (0.0, 0.0, 0.0),
+                 scan_rate: Optional[float] = 10.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.geometry = geometry
+        if beams is None:
+            beams = np.array([[0, 0, -1]], dtype=np.float32)
+        self.beams = np.asarray(beams, dtype=np.float32)
+        self.max_range = max_range
+        self.min_range = min_range
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.scan_rate = scan_rate
+        self._clock = clock
+
+        self._sim = None
+        self._last_scan_time: Optional[float] = None
+        self._ranges = np.full(len(self.beams), np.inf, dtype=np.float32)
+
+    @property
+    def num_beams(self) -> int:
+        return len(self.beams)
+
+    def attach_to(self, sim):
+        self._sim = sim
+
+    def update(self):
+        if self._sim is None:
+            return self._ranges
+        now = self._clock()
+        if self.scan_rate is not None and self._last_scan_time is not None and \
+                now - self._last_scan_time < 1.0 / self.scan_rate:
+            return self._ranges
+
+        state = self._sim.state
+        pos = np.asarray(state['pos'], dtype=np.float32)
+        rotx, roty, rotz = state['angle']
+        # Same mapping of physics angles to heading/pitch/roll as `UAVDroneModel`
+        self._ranges = self.scan(pos[np.newaxis], np.array([[rotz, roty, rotx]]))[0]
+        self._last_scan_time = now
+        return self._ranges
+
+    def scan(self, positions: np.ndarray, hprs: np.ndarray) -> np.ndarray:
+        '''
+        Scan from a batch of D drone poses at once (D x 3 positions and D x 3 heading/pitch/roll, in radians),
+        returning a D x N array of ranges.
+        '''
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        rotations = hpr_to_matrix(np.asarray(hprs).reshape(-1, 3))
+        origins = positions + self.offset @ rotations
+        # Rotate every beam by every drone's orientation: (N x 3) @ (D x 3 x 3) -> D x N x 3
+        directions = self.beams @ rotations
+        origins = np.broadcast_to(origins[:, np.newaxis], directions.shape)
+        ranges = self.geometry.cast(
+            origins.reshape(-1, 3), directions.reshape(-1, 3), self.max_range, self.min_range)
+        return ranges.reshape(len(positions), self.num_beams)
+
+
+__all__ = [
+    'make_beam_table',
+    'LidarSensor'
+]
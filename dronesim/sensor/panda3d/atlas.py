@@ -0,0 +1,217 @@
+
+from panda3d.core import (
+    NodePath,
+    Texture,
+    GraphicsEngine,
+    GraphicsOutput,
+    GraphicsPipe,
+    WindowProperties,
+    FrameBufferProperties,
+    UpdateSeq
+)
+
+from .camera import Panda3DCameraSensor, COMPONENTTYPE_DTYPE_MAP, CHANNEL_ORDERS
+
+import math
+import numpy as np
+
+from typing import Optional, Tuple, List, Dict
+
+
+class CameraSensorAtlas:
+    '''
+    Renders many camera sensors into tiles of one shared offscreen buffer, which is copied to RAM once per frame.
+
+    Each sensor added to the atlas gets a display region (tile) in the buffer, and its frames are views into
+    the shared array that holds the whole atlas image. This avoids having a separate buffer, texture and
+    GPU-to-RAM transfer for every camera, which adds up with multiple cameras on multiple vehicles.
+
+    All sensors have to use the same image size (the tile size).
+
+    :param tuple tile_size: Size (width, height) of each sensor image.
+    :param int capacity: Maximum number of sensors in the atlas, which decides the buffer size.
+    :param int columns: Number of tiles in each row. A (nearly) square layout is used if not given.
+    :param str channel_order: Channel order of the shared array (see `Panda3DCameraSensor`).
+    '''
+
+    def __init__(self,
+                 name: str,
+                 tile_size: Tuple[int, int] = (128, 128),
+                 capacity: int = 16,
+                 columns: Optional[int] = None,
+                 channel_order: str = 'BGR'):
+        if channel_order not in CHANNEL_ORDERS:
+            raise ValueError("Unknown channel order '%s', expected one of %s" % (
+                channel_order, ', '.join(CHANNEL_ORDERS)))
+        self.name = name
+        self.tile_size = tuple(tile_size)
+        self.capacity = capacity
+        self.columns = columns or math.ceil(math.sqrt(capacity))
+        self.rows = math.ceil(capacity / self.columns)
+        self.channel_order = channel_order
+
+        self.tex = Texture()
+        self.texfbuf: Optional[GraphicsOutput] = None
+        self._sensors: List[Panda3DCameraSensor] = []
+        self._regions: Dict[Panda3DCameraSensor, object] = {}
+
+        self._gengine: Optional[GraphicsEngine] = None
+        self._atlas_array: Optional[np.ndarray] = None
+        self._last_image_seq = UpdateSeq()
+        self.frame_seq = 0
+
+    @property
+    def buffer_size(self) -> Tuple[int, int]:
+        return (self.tile_size[0] * self.columns, self.tile_size[1] * self.rows)
+
+    @property
+    def sensors(self) -> List[Panda3DCameraSensor]:
+        return [sensor for sensor in self._sensors if sensor is not None]
+
+    def attach_to_env(self, gengine: GraphicsEngine, host_go: GraphicsOutput):
+        '''Create the shared buffer. Sensors can be added before or after this'''
+        _prop = FrameBufferProperties()
+        _prop.setRgbColor(1)
+        _prop.setDepthBits(1)
+
+        self.texfbuf = gengine.makeOutput(
+            host_go.getPipe(),
+            "fbatlas_%s" % self.name,
+            0,
+            _prop,
+            WindowProperties(size=self.buffer_size),
+            GraphicsPipe.BFRefuseWindow,
+            host_go.getGsg(),
+            host_go
+        )
+        self.texfbuf.addRenderTexture(
+            self.tex, GraphicsOutput.RTMCopyRam, GraphicsOutput.RTPColor)
+        self._gengine = gengine
+
+        for idx, sensor in enumerate(self._sensors):
+            if sensor is not None:
+                sensor.set_atlas(self, gengine)
+            self._make_region(sensor, idx)
+
+    def add_sensor(self, sensor: Panda3DCameraSensor, scene: NodePath):
+        '''Give the sensor a tile in the atlas, rendering `scene`'''
+        if tuple(sensor.get_viewport_size()) != self.tile_size:
+            raise ValueError("Sensor '%s' size %s does not match the atlas tile size %s" % (
+                sensor.name, tuple(sensor.get_viewport_size()), self.tile_size))
+        if None in self._sensors:
+            # Reuse the tile of a removed sensor
+            index = self._sensors.index(None)
+            self._sensors[index] = sensor
+        elif len(self._sensors) < self.capacity:
+            index = len(self._sensors)
+            self._sensors.append(sensor)
+        else:
+            raise ValueError("Atlas '%s' is full (%d sensors)" % (self.name, self.capacity))
+
+        sensor.node().set_scene(scene)
+        sensor.node().get_lens().set_aspect_ratio(
+            self.tile_size[0] / self.tile_size[1])
+        sensor.set_atlas(self, self._gengine)
+        if self.texfbuf is not None:
+            self._make_region(sensor, index)
+
+    def remove_sensor(self, sensor: Panda3DCameraSensor):
+        '''Remove the sensor from the atlas. Its tile is left empty'''
+        region = self._regions.pop(sensor, None)
+        if region is not None and self.texfbuf is not None:
+            self.texfbuf.remove_display_region(region)
+        sensor.set_atlas(None)
+        # Keep the tile index of the other sensors
+        self._sensors[self._sensors.index(sensor)] = None
+
+    def tile_index(self, sensor: Panda3DCameraSensor) -> int:
+        return self._sensors.index(sensor)
+
+    def tile_rect(self, index: int) -> Tuple[int, int, int, int]:
+        '''Pixel bounds (x0, y0, x1, y1) of the tile in the atlas image, with the first row at the top'''
+        col, row = index % self.columns, index // self.columns
+        w, h = self.tile_size
+        return col * w, row * h, (col + 1) * w, (row + 1) * h
+
+    def _make_region(self, sensor: Panda3DCameraSensor, index: int):
+        if sensor is None:
+            return
+        col, row = index % self.columns, index // self.columns
+        # Display region bounds are (left, right, bottom, top) fractions, from the bottom-left
+        dr = self.texfbuf.make_display_region(
+            col / self.columns, (col + 1) / self.columns,
+            1 - (row + 1) / self.rows, 1 - row / self.rows)
+        # Each tile is a separate view, so it needs its own clear, to the same color as the sensor's own buffer
+        clear_color = sensor.clear_color
+        dr.set_clear_color(clear_color if clear_color is not None else self.texfbuf.get_clear_color())
+        dr.set_clear_color_active(True)
+        dr.set_clear_depth_active(True)
+        dr.set_camera(sensor)
+        self._regions[sensor] = dr
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray], int]:
+        '''
+        Copy the atlas texture to the shared array, if a new frame was rendered since the last read.
+
+        Returns whether a new frame was read, the whole atlas image and the frame sequence number.
+        '''
+        if not self.tex.might_have_ram_image():
+            return False, None, self.frame_seq
+        image_seq = self.tex.get_image_modified()
+        if image_seq == self._last_image_seq and self._atlas_array is not None:
+            return False, self._atlas_array, self.frame_seq
+
+        dtype = np.dtype(COMPONENTTYPE_DTYPE_MAP.get(
+            self.tex.component_type, np.uint8))
+        channels = self.tex.get_num_components()
+        tex_w, tex_h = self.tex.get_x_size(), self.tex.get_y_size()
+        w, h = self.buffer_size
+        order = CHANNEL_ORDERS[self.channel_order]
+
+        if self._atlas_array is None or self._atlas_array.dtype != dtype:
+            self._atlas_array = np.empty((h, w, len(order)), dtype)
+
+        src = np.frombuffer(self.tex.get_ram_image(), dtype).reshape(
+            tex_h, tex_w, channels)
+        # Textures may be padded (to a power of 2) on the right and top. Rows are flipped to pixel order
+        src = src[h - 1::-1, :w] if tex_h >= h else src[::-1, :w]
+
+        out = self._atlas_array
+        if order == tuple(range(len(order))):
+            np.copyto(out, src[..., :len(order)])
+        elif self.channel_order == 'RGB':
+            np.copyto(out, src[..., 2::-1])
+        else:
+            for dst_channel, src_channel in enumerate(order):
+                np.copyto(out[..., dst_channel], src[..., src_channel])
+
+        self._last_image_seq = image_seq
+        self.frame_seq += 1
+        return True, out, self.frame_seq
+
+    def read_sensor(self, sensor: Panda3DCameraSensor, out: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray], int]:
+        '''Read the atlas (if needed) and return the sensor's tile as a view into the shared array, or copied into `out`'''
+        is_new, atlas, seq = self.read()
+        if atlas is None:
+            return False, None, seq
+        x0, y0, x1, y1 = self.tile_rect(self.tile_index(sensor))
+        view = atlas[y0:y1, x0:x1]
+        if out is not None:
+            np.copyto(out, view)
+            return is_new, out, seq
+        return is_new, view, seq
+
+    def destroy(self, gengine: GraphicsEngine):
+        for sensor in self._sensors:
+            if sensor is not None:
+                sensor.set_atlas(None)
+        self._sensors.clear()
+        self._regions.clear()
+        if self.texfbuf is not None:
+            gengine.remove_window(self.texfbuf)
+            self.texfbuf = None
+
+
+__all__ = [
+    'CameraSensorAtlas'
+]
@@ -9,91 +9,311 @@ from panda3d.core import (
     GraphicsOutput,
     GraphicsPipe,
     WindowProperties,
-    FrameBufferProperties
+    FrameBufferProperties,
+    CullFaceAttrib,
+    RenderModeAttrib,
+    RenderState,
+    LMatrix4f,
+    LColor,
+    UpdateSeq
 )
 
+from .visibility import sensor_camera_mask
+
 import numpy as np
 
+from typing import Optional, Tuple, List
+
 
 # Maps Panda3D's data type enum to numpy's data types for use in conversion
 COMPONENTTYPE_DTYPE_MAP = {
     Texture.T_unsigned_byte: np.uint8,
-    Texture.T_unsigned_short: np.short,
+    Texture.T_byte: np.int8,
+    Texture.T_unsigned_short: np.uint16,
+    Texture.T_short: np.int16,
+    Texture.T_unsigned_int: np.uint32,
+    Texture.T_int: np.int32,
+    Texture.T_half_float: np.float16,
     Texture.T_float: np.float32,
-    Texture.T_unsigned_int_24_8: np.int32
+    Texture.T_unsigned_int_24_8: np.uint32
+}
+
+# Panda3D keeps color RAM images in BGR(A) order. These are the source channel
+# indices to pick (in order) for each supported output channel order
+CHANNEL_ORDERS = {
+    'BGR': (0, 1, 2),
+    'BGRA': (0, 1, 2, 3),
+    'RGB': (2, 1, 0),
+    'RGBA': (2, 1, 0, 3)
 }
 
+# Priority of render attributes forced by sensor cameras, so that they override those of the scene
+SENSOR_STATE_PRIORITY = 100
+
 
 class Panda3DCameraSensor(NodePath, SensorBase):
+    '''
+    Camera that renders the scene into an offscreen buffer, whose image can be read as a numpy array.
+
+    Frames are read into a pool of `pool_size` preallocated arrays that are reused in turn (or into an array
+    given by the caller), so reading frames continuously does not allocate new image buffers. A frame returned
+    from the pool stays valid till `pool_size` more frames are read.
+
+    :param str channel_order: Order of channels of color images, one of 'BGR' (OpenCV's order), 'BGRA', 'RGB' or 'RGBA'.
+    :param int pool_size: Number of preallocated frame arrays to cycle through.
+    :param bool flip_in_projection: Render the image upside-down, so that the texture rows are already in
+    pixel order and no flip is needed when reading it. Otherwise the flip is done while copying the frame.
+    :param bool on_demand: Keep the buffer inactive, and render a frame only when the sensor is updated (or
+    `request_frame()` is called), instead of on every frame of the graphics engine.
+    :param bool async_read: For on-demand sensors, `update()` returns the previously rendered frame right away
+    and requests the next one, to be rendered by the next frame of the graphics engine (such as the app's
+    frame). Otherwise `update()` renders the frame itself and waits for it, which must be done from the
+    thread that runs the graphics engine. As that renders a whole engine frame per sensor, read several
+    sensors together with `capture_all()` instead.
+    :param int simplification: Skip scene details marked with `visibility.set_detail_level()` up to this
+    level (0 renders everything). Useful for low resolution cameras, where small details are not visible anyway.
+    :param float lod_scale: Multiplier of the switch distances of LOD nodes seen by this camera. Values below 1
+    switch to lower levels of detail closer to the camera.
+    '''
     CAMERA_TYPE_RGB = GraphicsOutput.RTPColor
     CAMERA_TYPE_DEPTH = GraphicsOutput.RTPDepth
 
-    def __init__(self, node_name: str, size: tuple = (512, 512), camera_type=CAMERA_TYPE_RGB):
+    def __init__(self,
+                 node_name: str,
+                 size: tuple = (512, 512),
+                 camera_type=CAMERA_TYPE_RGB,
+                 channel_order: str = 'BGR',
+                 pool_size: int = 2,
+                 flip_in_projection: bool = False,
+                 on_demand: bool = False,
+                 async_read: bool = False,
+                 simplification: int = 0,
+                 lod_scale: float = 1.0):
         super().__init__(Camera(node_name, PerspectiveLens()))
+        if channel_order not in CHANNEL_ORDERS:
+            raise ValueError("Unknown channel order '%s', expected one of %s" % (
+                channel_order, ', '.join(CHANNEL_ORDERS)))
         self.tex = Texture()
         self.__last_frame = np.zeros((1, 1, 3))
         self.texfbuf = None
         self.fbufsize = size
         self.camera_type = camera_type
+        self.channel_order = channel_order
+        self.flip_in_projection = flip_in_projection
+        self.on_demand = on_demand
+        self.async_read = async_read
+        self._gengine: Optional[GraphicsEngine] = None
+
+        self._pool: List[np.ndarray] = []
+        # Asynchronous reads hand out the previous frame while the next one is copied, so need two buffers
+        self._pool_size = max(2 if async_read else 1, pool_size)
+        self._pool_index = 0
+        self._last_image_seq = UpdateSeq()
+        self.frame_seq = 0
+        # Shared atlas buffer this camera renders into instead of its own buffer, if any
+        self._atlas = None
+
+        # Sensors don't see the parts of the scene hidden from them (debug geometry, etc.)
+        self.set_simplification(simplification)
+        self.node().set_lod_scale(lod_scale)
+
+        if flip_in_projection:
+            # Mirror vertically in camera space (Z is up)
+            self.node().get_lens().set_view_mat(LMatrix4f.scale_mat(1, 1, -1))
+        self.node().set_initial_state(self._make_initial_state())
+
+    def _make_initial_state(self) -> RenderState:
+        '''Render state the scene is rendered with by this camera'''
+        # Always render filled polygons, even if the main view is in wireframe mode
+        state = RenderState.make(RenderModeAttrib.make(
+            RenderModeAttrib.M_filled), SENSOR_STATE_PRIORITY)
+        if self.flip_in_projection:
+            # Reverse culling to compensate for the winding order mirrored by the projection. Unlike the forced
+            # attributes, it has the lowest priority, so that two-sided and cull-face settings of the scene apply
+            state = state.add_attrib(CullFaceAttrib.make_reverse(), 0)
+        return state
+
+    @property
+    def simplification(self) -> int:
+        return self._simplification
+
+    def set_simplification(self, level: int):
+        '''Set the level of scene details to skip (see `visibility.set_detail_level()`)'''
+        self.node().set_camera_mask(sensor_camera_mask(level))
+        self._simplification = level
+
+    @property
+    def lod_scale(self) -> float:
+        return self.node().get_lod_scale()
+
+    @lod_scale.setter
+    def lod_scale(self, scale: float):
+        self.node().set_lod_scale(scale)
 
     def update(self):
-        '''Render into the framebuffer and return the captured image as a numpy array'''
-        # self.render_and_get_framebuffer()
-        return self.__last_frame
+        '''Return the latest rendered image as a numpy array (rendering is done by the graphics engine the camera is attached to)'''
+        if self.on_demand:
+            if self.async_read:
+                _, frame, _ = self.read_frame()
+                self.request_frame()
+            else:
+                _, frame = self.capture()
+            return frame if frame is not None else self.__last_frame
+        _, frame, _ = self.read_frame()
+        if frame is None:
+            return self.__last_frame
+        return frame
 
     def get_viewport_size(self) -> tuple:
         return self.fbufsize
 
-    def render_and_get_framebuffer(self) -> np.ndarray:
+    def get_frame_shape(self) -> Optional[Tuple[tuple, np.dtype]]:
+        '''Shape and data type of the frames read from this camera, or None if nothing was rendered yet'''
+        if not self.tex.might_have_ram_image():
+            return None
+        dtype = np.dtype(COMPONENTTYPE_DTYPE_MAP.get(
+            self.tex.component_type, np.uint8))
+        channels = self.tex.get_num_components()
+        if channels == 1:
+            # Single channel image does not need extra dimension
+            return (self.tex.get_y_size(), self.tex.get_x_size()), dtype
+        return (self.tex.get_y_size(), self.tex.get_x_size(), len(CHANNEL_ORDERS[self.channel_order])), dtype
+
+    def read_frame(self, out: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray], int]:
+        '''
+        Copy the latest frame in the texture's RAM image into `out` or into the next array from the pool.
+
+        Returns whether a new frame was read, the frame, and the frame sequence number. If no new frame
+        was rendered since the last read, nothing is copied and the previously read frame is returned.
+
+        If the camera renders into an atlas, the frame is a view into the atlas image (unless `out` is given).
+        '''
+        if self._atlas is not None:
+            is_new, frame, seq = self._atlas.read_sensor(self, out)
+            if frame is not None:
+                self.__last_frame = frame
+            return is_new, frame, seq
+
+        if not self.tex.might_have_ram_image():
+            return False, None, self.frame_seq
+
+        image_seq = self.tex.get_image_modified()
+        if image_seq == self._last_image_seq and self.frame_seq > 0:
+            return False, self.__last_frame, self.frame_seq
+
+        shape, dtype = self.get_frame_shape()
+        if out is None:
+            out = self._next_pool_buffer(shape, dtype)
+        elif out.shape != shape or out.dtype != dtype:
+            raise ValueError("Output array must have shape %s and dtype %s, got %s and %s" % (
+                shape, dtype, out.shape, out.dtype))
+
+        # View of texture data that was loaded into memory (no copy)
+        src = np.frombuffer(self.tex.get_ram_image(), dtype)
+        channels = self.tex.get_num_components()
+        if channels == 1:
+            src = src.reshape(shape)
+        else:
+            src = src.reshape(shape[0], shape[1], channels)
+
+        # Textures are laid out as if on quadrant I of a cartesian plane, so rows are flipped
+        # to get them into pixel coordinates, unless it was already done by the projection
+        if not self.flip_in_projection:
+            src = src[::-1]
+
+        if channels == 1:
+            np.copyto(out, src)
+        else:
+            order = CHANNEL_ORDERS[self.channel_order]
+            if len(order) > channels:
+                raise ValueError("Channel order '%s' needs %d channels, but the texture has %d" % (
+                    self.channel_order, len(order), channels))
+            if order == tuple(range(len(order))):
+                np.copyto(out, src[..., :len(order)])
+            elif self.channel_order == 'RGB':
+                np.copyto(out, src[..., 2::-1])
+            else:
+                for dst_channel, src_channel in enumerate(order):
+                    np.copyto(out[..., dst_channel], src[..., src_channel])
+
+        self._last_image_seq = image_seq
+        self.frame_seq += 1
+        self.__last_frame = out
+        return True, out, self.frame_seq
+
+    def render_and_get_framebuffer(self, out: Optional[np.ndarray] = None) -> Tuple[bool, np.ndarray]:
         '''
         Read the current texture data as a numpy array similar to OpenCV's Mat image format.
 
         In order to get the latest frame, you can call `base.graphicsEngine.renderFrame()` before calling this
         so that the scene gets rendered. This must also be done if you have a headless instance with just the
         graphicsEngine else no image will form.
+
+        See `read_frame()` for how `out` is used.
         '''
         # TODO: Add a parameter for blocking till buffer copy done
+        _, frame, _ = self.read_frame(out)
+        if frame is None:
+            return False, self.__last_frame
+        return True, frame
 
-        # Make sure the rendered frame has reached into the buffer in system memory
-        is_rendered = self.tex.mightHaveRamImage()
-        if is_rendered:
-            # Get texture data that was loaded into memory
-            fbdata = self.tex.getRamImage()
-
-            # What type of data will be stored in the buffer
-            # This is needed in order to convert it back to a numpy buffer correctly
-            dtype = COMPONENTTYPE_DTYPE_MAP.get(
-                self.tex.component_type, np.uint8)
-
-            fb_array = np.frombuffer(fbdata, dtype)
-            channels = self.tex.getNumComponents()
-            if channels == 1:
-                # Single channel image does not need extra dimension
-                fb_array = np.reshape(fb_array, (
-                    self.tex.getYSize(),
-                    self.tex.getXSize()
-                ))
-            else:
-                fb_array = np.reshape(fb_array, (
-                    self.tex.getYSize(),
-                    self.tex.getXSize(),
-                    self.tex.getNumComponents()
-                ))
+    def request_frame(self):
+        '''Make the buffer render (and copy to RAM) a single frame, on the next frame of the graphics engine'''
+        output = self._atlas.texfbuf if self._atlas is not None else self.texfbuf
+        if output is None:
+            return
+        # Buffer deactivates itself again after rendering the frame
+        output.set_one_shot(True)
+        output.set_active(True)
+
+    def capture(self, out: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        '''
+        Render a single frame right away and read it (see `read_frame()` for how `out` is used).
+        This renders a whole frame of the graphics engine (all of its active outputs), so it must be called
+        from the thread running it. To read several sensors, use `capture_all()`, which renders one frame for all.
+        '''
+        return capture_all([self], [out])[0]
+
+    def _next_pool_buffer(self, shape: tuple, dtype: np.dtype) -> np.ndarray:
+        if not self._pool or self._pool[0].shape != shape or self._pool[0].dtype != dtype:
+            # (Re-)allocate the pool only when the frame format changes
+            self._pool = [np.empty(shape, dtype)
+                          for _ in range(self._pool_size)]
+            self._pool_index = 0
+        buffer = self._pool[self._pool_index]
+        self._pool_index = (self._pool_index + 1) % self._pool_size
+        return buffer
 
-            # Update to latest frame. Textures are laid out as if on quadrant I of a cartesian plane
-            # so we need to flip it to get it into pixel coordinates
-            self.__last_frame = np.flipud(fb_array)
-        return is_rendered, self.__last_frame
+    def _make_framebuffer_properties(self) -> FrameBufferProperties:
+        '''Properties of the offscreen buffer the camera renders into'''
+        _prop = FrameBufferProperties()
+        # We need RGB and Depth
+        _prop.setRgbColor(1)
+        if self.camera_type == self.CAMERA_TYPE_DEPTH:
+            _prop.setDepthBits(1)
+        return _prop
+
+    def set_atlas(self, atlas, gengine: Optional[GraphicsEngine] = None):
+        '''Set by `CameraSensorAtlas` when the camera is added to (or removed from) it'''
+        self._atlas = atlas
+        if gengine is not None:
+            self._gengine = gengine
+
+    @property
+    def atlas(self):
+        return self._atlas
+
+    @property
+    def clear_color(self) -> Optional[LColor]:
+        '''Background color of the image, or None for the default clear color of buffers'''
+        return None
 
     def attach_to_env(self, scene: NodePath, gengine: GraphicsEngine, host_go: GraphicsOutput):
         # TODO: Check if this is even required
         self.node().set_scene(scene)
 
         # To render to the framebuffer, create a texture buffer
-        _prop = FrameBufferProperties()
-        # We need RGB and Depth
-        _prop.setRgbColor(1)
-        # _prop.setDepthBits(1)
+        _prop = self._make_framebuffer_properties()
 
         self.texfbuf = gengine.makeOutput(
             host_go.getPipe(),
@@ -108,8 +328,41 @@ class Panda3DCameraSensor(NodePath, SensorBase):
 
         self.texfbuf.addRenderTexture(
             self.tex, GraphicsOutput.RTMCopyRam, self.camera_type)
+        self._gengine = gengine
+        if self.clear_color is not None:
+            self.texfbuf.set_clear_color(self.clear_color)
+        if self.on_demand:
+            # Only render when requested
+            self.texfbuf.set_active(False)
 
         # Create a DisplayRegion to be within the whole texture (left, right, bottom, top)
         dr = self.texfbuf.makeDisplayRegion(0, 1, 0, 1)
         # Make camera render to this texture
         dr.setCamera(self)
+
+
+def capture_all(sensors: List[Panda3DCameraSensor],
+                outs: Optional[List[Optional[np.ndarray]]] = None) -> List[Tuple[bool, Optional[np.ndarray]]]:
+    '''
+    Render a frame of the sensors right away and read them, rendering a single frame of each graphics engine
+    for all of them (instead of one per sensor with `Panda3DCameraSensor.capture()`). Returns the
+    (is new, frame) of each sensor. `outs` are the arrays to read each frame into (see `read_frame()`).
+    '''
+    engines = []
+    for sensor in sensors:
+        if sensor._gengine is None:
+            continue
+        sensor.request_frame()
+        if not any(engine is sensor._gengine for engine in engines):
+            engines.append(sensor._gengine)
+    for engine in engines:
+        engine.render_frame()
+
+    results = []
+    for sensor, out in zip(sensors, outs if outs is not None else [None] * len(sensors)):
+        if sensor._gengine is None:
+            results.append((False, None))
+            continue
+        is_new, frame, _ = sensor.read_frame(out)
+        results.append((is_new, frame))
+    return results
@@ -0,0 +1,160 @@
+
+from panda3d.core import (
+    NodePath,
+    Texture,
+    FrameBufferProperties,
+    GraphicsEngine,
+    GraphicsOutput
+)
+
+from .camera import Panda3DCameraSensor
+
+import math
+import numpy as np
+
+from typing import Optional
+
+
+class Panda3DDepthCameraSensor(Panda3DCameraSensor):
+    '''
+    Camera that renders the scene's depth into a float32 depth texture and converts it to metric depth.
+
+    `update()` returns the depth (distance along the camera's view axis) of each pixel, in the same
+    units as the scene. Pixels that hit nothing (at the far plane) are set to `inf`.
+
+    `get_point_cloud()` reprojects the depth into an N x 3 array of points, using per-pixel ray
+    tables that are computed once for the lens, so the whole conversion is done with vectorized operations.
+
+    :param NodePath reference: Node whose coordinate frame the points are given in (usually the drone).
+    The camera's parent is used if not given.
+    :param float near: Distance to the lens' near plane.
+    :param float far: Distance to the lens' far plane. Depth beyond this is not measured.
+
+    Needs a graphics pipe with depth textures (OpenGL). The software renderer (`p3tinydisplay`, the default
+    pipe of `dronesim.app.headless.HeadlessRenderer`) has none, so attaching the camera to it raises an error;
+    use the headless renderer with `pipe_type=None` (an offscreen OpenGL buffer) instead.
+    '''
+
+    def __init__(self,
+                 node_name: str,
+                 size: tuple = (512, 512),
+                 reference: Optional[NodePath] = None,
+                 near: float = 0.1,
+                 far: float = 1000.0,
+                 pool_size: int = 2):
+        super().__init__(node_name, size,
+                         camera_type=Panda3DCameraSensor.CAMERA_TYPE_DEPTH,
+                         pool_size=pool_size)
+        self.reference = reference
+        self.node().get_lens().set_near_far(near, far)
+        # Read the depth buffer as floats (0 to 1), rather than integers
+        self.tex.set_format(Texture.F_depth_component32)
+        self.tex.set_component_type(Texture.T_float)
+
+        self._depth: Optional[np.ndarray] = None
+        self._depth_seq = -1
+        # Per-pixel ray directions in the camera frame, and the lens parameters they were computed with
+        self._rays: Optional[np.ndarray] = None
+        self._rays_key = None
+
+    def _make_framebuffer_properties(self) -> FrameBufferProperties:
+        _prop = super()._make_framebuffer_properties()
+        _prop.set_depth_bits(32)
+        _prop.set_float_depth(True)
+        return _prop
+
+    def attach_to_env(self, scene: NodePath, gengine: GraphicsEngine, host_go: GraphicsOutput):
+        gsg = host_go.get_gsg()
+        if gsg is not None and gsg.is_valid() and not gsg.get_supports_depth_texture():
+            raise RuntimeError("Depth camera '%s' needs depth textures, which the '%s' graphics pipe doesn't "
+                               "support. Use an OpenGL pipe" % (self.name, host_go.get_pipe().get_interface_name()))
+        super().attach_to_env(scene, gengine, host_go)
+
+    def update(self):
+        '''Return the latest metric depth image'''
+        return self.get_depth()
+
+    def get_depth(self) -> Optional[np.ndarray]:
+        '''
+        Read the latest depth buffer and linearize it into metric depth (float32 array of rows x columns).
+        The returned array is reused for the following frames.
+        '''
+        _, frame, seq = self.read_frame()
+        if frame is None:
+            return None
+        if frame.ndim != 2 or frame.dtype != np.float32:
+            raise RuntimeError("Camera '%s' did not receive a float depth texture (got %s %s). "
+                               "The graphics pipe may not support depth textures" % (self.name, frame.dtype, frame.shape))
+        if seq == self._depth_seq and self._depth is not None:
+            return self._depth
+
+        if self._depth is None or self._depth.shape != frame.shape:
+            self._depth = np.empty(frame.shape, np.float32)
+
+        lens = self.node().get_lens()
+        near, far = lens.get_near(), lens.get_far()
+        depth = self._depth
+        # Depth buffer value d (0 at near, 1 at far) is non-linear: z = near * far / (far - d * (far - near))
+        np.multiply(frame, near - far, out=depth, casting='unsafe')
+        depth += far
+        np.divide(near * far, depth, out=depth)
+        depth[frame >= 1.0] = np.inf
+
+        self._depth_seq = seq
+        return depth
+
+    def get_ray_table(self) -> np.ndarray:
+        '''
+        Direction of each pixel's ray in the camera frame (rows x columns x 3), scaled so that the forward (Y)
+        component is 1. Multiplying by the depth gives the point in the camera frame.
+        '''
+        lens = self.node().get_lens()
+        width, height = self.get_viewport_size()
+        fov = lens.get_fov()
+        key = (width, height, fov[0], fov[1])
+        if self._rays is None or self._rays_key != key:
+            tan_x = math.tan(math.radians(fov[0]) / 2)
+            tan_z = math.tan(math.radians(fov[1]) / 2)
+            # Film coordinates of pixel centers, from -1 to 1 (left to right and bottom to top)
+            film_x = (np.arange(width, dtype=np.float32) + 0.5) / width * 2 - 1
+            film_z = 1 - (np.arange(height, dtype=np.float32) + 0.5) / height * 2
+            rays = np.empty((height, width, 3), np.float32)
+            rays[..., 0] = film_x[np.newaxis, :] * tan_x
+            rays[..., 1] = 1.0
+            rays[..., 2] = film_z[:, np.newaxis] * tan_z
+            self._rays = rays
+            self._rays_key = key
+        return self._rays
+
+    def get_point_cloud(self,
+                        depth: Optional[np.ndarray] = None,
+                        max_range: Optional[float] = None,
+                        reference: Optional[NodePath] = None) -> np.ndarray:
+        '''
+        Reproject the depth image into a float32 array of N x 3 points, in the frame of `reference`
+        (or the sensor's reference, or its parent). Pixels with no hit or beyond `max_range` are left out.
+        '''
+        if depth is None:
+            depth = self.get_depth()
+        if depth is None:
+            return np.empty((0, 3), np.float32)
+
+        rays = self.get_ray_table()
+        valid = np.isfinite(depth)
+        if max_range is not None:
+            valid &= depth <= max_range
+        points = rays[valid] * depth[valid][:, np.newaxis]
+
+        if reference is None:
+            reference = self.reference if self.reference is not None else self.get_parent()
+        if reference is not None and not reference.is_empty():
+            # Panda3D matrices transform row vectors: p' = p * M
+            mat = np.array(self.get_mat(reference), dtype=np.float32)
+            points = points @ mat[:3, :3]
+            points += mat[3, :3]
+        return points
+
+
+__all__ = [
+    'Panda3DDepthCameraSensor'
+]
@@ -0,0 +1,145 @@
+
+from panda3d.core import (
+    RenderState,
+    ColorAttrib,
+    ColorScaleAttrib,
+    LightAttrib,
+    MaterialAttrib,
+    TextureAttrib,
+    ShaderAttrib,
+    FogAttrib,
+    LColor
+)
+
+from .camera import Panda3DCameraSensor
+
+import numpy as np
+
+from typing import Optional, Dict, List
+
+
+# Priority of the flat shading attributes, so that they override those set on the scene's nodes
+SEGMENTATION_STATE_PRIORITY = 1000
+
+
+class Panda3DSegmentationCameraSensor(Panda3DCameraSensor):
+    '''
+    Camera that renders a per-pixel class label image of the scene.
+
+    The scene is rendered as-is, but the camera's initial state replaces materials, textures, lights and shaders
+    with a flat color, and nodes tagged with `tag_key` (for example `node.set_tag('class', 'tree')`) get the
+    flat color that encodes the label of their class. Untagged geometry and the background have label 0.
+
+    The label is encoded in the red channel (and the green channel for labels above 255), and is decoded
+    from the same readback as RGB cameras into a uint8 or uint16 array.
+
+    :param dict classes: Label (1 or more) of each class, by the tag value. More can be added with `set_class()`.
+    :param str tag_key: Name of the node tag that holds the class name.
+    :param label_dtype: Data type of the label image, `np.uint8` or `np.uint16`.
+    '''
+
+    def __init__(self,
+                 node_name: str,
+                 size: tuple = (512, 512),
+                 classes: Optional[Dict[str, int]] = None,
+                 tag_key: str = 'class',
+                 label_dtype=np.uint8,
+                 **kwargs):
+        super().__init__(node_name, size, channel_order='BGR', **kwargs)
+        self.label_dtype = np.dtype(label_dtype)
+        if self.label_dtype not in (np.uint8, np.uint16):
+            raise ValueError("Label data type must be uint8 or uint16, got %s" % self.label_dtype)
+        self.tag_key = tag_key
+        self._classes: Dict[str, int] = {}
+
+        self.node().set_tag_state_key(tag_key)
+        # Everything that isn't tagged is unlabeled
+        self.node().set_initial_state(
+            self._make_initial_state().compose(self.make_label_state(0)))
+        for class_name, label in (classes or {}).items():
+            self.set_class(class_name, label)
+
+        self._labels: List[np.ndarray] = []
+        self._labels_index = 0
+        self._labels_seq = -1
+
+    @property
+    def classes(self) -> Dict[str, int]:
+        return dict(self._classes)
+
+    def set_class(self, class_name: str, label: int):
+        '''Render nodes whose tag has the value `class_name` with the given label'''
+        if not 0 < label <= np.iinfo(self.label_dtype).max:
+            raise ValueError("Label of class '%s' must be from 1 to %d, got %d" % (
+                class_name, np.iinfo(self.label_dtype).max, label))
+        self._classes[class_name] = label
+        self.node().set_tag_state(class_name, self.make_label_state(label))
+
+    def remove_class(self, class_name: str):
+        self._classes.pop(class_name, None)
+        self.node().clear_tag_state(class_name)
+
+    @staticmethod
+    def label_color(label: int) -> LColor:
+        '''Color that encodes the label: low byte in red and high byte in green'''
+        # Offset by a quarter step, so the byte comes out right whether the pipe rounds or truncates colors
+        return LColor(((label & 0xff) + 0.25) / 255, (((label >> 8) & 0xff) + 0.25) / 255, 0, 1)
+
+    @classmethod
+    def make_label_state(cls, label: int) -> RenderState:
+        '''Unlit, untextured render state of a flat color encoding the label'''
+        state = RenderState.make_empty()
+        for attrib in (
+            ColorAttrib.make_flat(cls.label_color(label)),
+            ColorScaleAttrib.make_identity(),
+            LightAttrib.make_all_off(),
+            MaterialAttrib.make_off(),
+            TextureAttrib.make_all_off(),
+            ShaderAttrib.make_off(),
+            FogAttrib.make_off()
+        ):
+            state = state.add_attrib(attrib, SEGMENTATION_STATE_PRIORITY)
+        return state
+
+    @property
+    def clear_color(self) -> LColor:
+        # Background is unlabeled
+        return self.label_color(0)
+
+    def update(self):
+        '''Return the latest label image'''
+        super().update()
+        return self.get_labels()
+
+    def get_labels(self) -> Optional[np.ndarray]:
+        '''
+        Decode the latest read frame into a label image (rows x columns). Two label arrays are used in turn,
+        so a returned image stays valid till the next new frame is decoded.
+        '''
+        _, frame, seq = self.read_frame()
+        if frame is None or frame.ndim != 3:
+            return None
+        if seq == self._labels_seq:
+            return self._labels[self._labels_index]
+
+        if not self._labels or self._labels[0].shape != frame.shape[:2]:
+            self._labels = [np.empty(frame.shape[:2], self.label_dtype) for _ in range(2)]
+        self._labels_index = (self._labels_index + 1) % len(self._labels)
+        labels = self._labels[self._labels_index]
+
+        red = frame[..., self.channel_order.index('R')]
+        if self.label_dtype == np.uint16:
+            np.copyto(labels, frame[..., self.channel_order.index('G')])
+            labels <<= 8
+            labels |= red
+        else:
+            np.copyto(labels, red)
+
+        self._labels_seq = seq
+        return labels
+
+
+__all__ = [
+    'SEGMENTATION_STATE_PRIORITY',
+    'Panda3DSegmentationCameraSensor'
+]
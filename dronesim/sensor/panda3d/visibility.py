@@ -0,0 +1,60 @@
+
+'''
+Camera mask bits that control which parts of the scene the main view and the sensor cameras render.
+
+A node hidden with `NodePath.hide(mask)` is still drawn by cameras that have any bit outside of `mask`, so each
+camera uses a single bit: one for the main view, and one for sensor cameras of each simplification level. Detail
+nodes are hidden from the bits of the levels that skip them.
+'''
+
+from panda3d.core import NodePath, BitMask32
+
+
+MAIN_CAMERA_MASK = BitMask32.bit(0)
+
+# Highest simplification level. Sensor cameras of each level (0 to this) have their own bit
+MAX_SIMPLIFICATION = 3
+SIMPLIFICATION_MASKS = tuple(BitMask32.bit(1 + level) for level in range(MAX_SIMPLIFICATION + 1))
+
+# Bits of all sensor cameras
+SENSOR_CAMERA_MASK = BitMask32.range(1, MAX_SIMPLIFICATION + 1)
+
+
+def sensor_camera_mask(simplification: int = 0) -> BitMask32:
+    '''Camera mask of a sensor camera with the given simplification level (0 is full detail)'''
+    if not 0 <= simplification <= MAX_SIMPLIFICATION:
+        raise ValueError("Simplification level must be from 0 to %d, got %d" % (
+            MAX_SIMPLIFICATION, simplification))
+    return SIMPLIFICATION_MASKS[simplification]
+
+
+def hide_from_sensors(node: NodePath):
+    '''Hide the node (debug geometry, markers, etc.) from all sensor cameras, keeping it in the main view'''
+    node.hide(SENSOR_CAMERA_MASK)
+
+
+def hide_from_main_view(node: NodePath):
+    '''Hide the node from the main view, keeping it visible to sensor cameras'''
+    node.hide(MAIN_CAMERA_MASK)
+
+
+def set_detail_level(node: NodePath, level: int):
+    '''
+    Mark the node as detail that sensor cameras skip from simplification `level` (1 to `MAX_SIMPLIFICATION`) upwards.
+    Small parts that don't matter at low resolution should use low levels, so they are skipped first.
+    '''
+    if not 1 <= level <= MAX_SIMPLIFICATION:
+        raise ValueError("Detail level must be from 1 to %d, got %d" % (MAX_SIMPLIFICATION, level))
+    node.hide(BitMask32.range(1 + level, MAX_SIMPLIFICATION + 1 - level))
+
+
+__all__ = [
+    'MAIN_CAMERA_MASK',
+    'SENSOR_CAMERA_MASK',
+    'MAX_SIMPLIFICATION',
+    'SIMPLIFICATION_MASKS',
+    'sensor_camera_mask',
+    'hide_from_sensors',
+    'hide_from_main_view',
+    'set_detail_level'
+]
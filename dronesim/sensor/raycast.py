@@ -0,0 +1,415 @@
+
+'''Scene geometry representations that cast many rays at once, using vectorized operations'''
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from typing import Optional, List, Tuple
+
+
+def _sample_grid(h: np.ndarray, fx: np.ndarray, fy: np.ndarray) -> np.ndarray:
+    '''Bilinear interpolation of the grid at fractional (column, row) positions, which must be inside the grid'''
+    rows, cols = h.shape
+    x0 = np.minimum(fx.astype(np.intp), cols - 2 if cols > 1 else 0)
+    y0 = np.minimum(fy.astype(np.intp), rows - 2 if rows > 1 else 0)
+    x1 = np.minimum(x0 + 1, cols - 1)
+    y1 = np.minimum(y0 + 1, rows - 1)
+    tx, ty = fx - x0, fy - y0
+    return (h[y0, x0] * (1 - tx) + h[y0, x1] * tx) * (1 - ty) + \
+        (h[y1, x0] * (1 - tx) + h[y1, x1] * tx) * ty
+
+
+class RaycastGeometry:
+    '''Static scene geometry that rays can be cast against'''
+
+    def cast(self,
+             origins: np.ndarray,
+             directions: np.ndarray,
+             max_range: float,
+             min_range: float = 0.0) -> np.ndarray:
+        '''
+        Cast rays (N x 3 arrays of origins and unit directions), returning the float32 distance to the first hit
+        of each ray within `min_range` and `max_range`, or `inf` if it hits nothing.
+        '''
+        raise NotImplementedError()
+
+
+class HeightfieldGeometry(RaycastGeometry):
+    '''
+    Terrain given as a grid of heights, where `heights[row, col]` is the height at
+    (`origin[0] + col * cell_size`, `origin[1] + row * cell_size`). Outside the grid there is no terrain.
+
+    Rays are marched in steps of `step` (half a cell by default) and the hit is refined by bisection.
+    '''
+
+    def __init__(self,
+                 heights: np.ndarray,
+                 cell_size: float = 1.0,
+                 origin: tuple = (0.0, 0.0, 0.0),
+                 height_scale: float = 1.0,
+                 step: Optional[float] = None,
+                 refine_steps: int = 8):
+        self.heights = np.ascontiguousarray(heights, dtype=np.float32)
+        self.cell_size = cell_size
+        self.origin = np.array(origin, dtype=np.float32)
+        self.height_scale = height_scale
+        self.step = step if step is not None else cell_size / 2
+        self.refine_steps = refine_steps
+
+    def height_at(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        '''Bilinearly interpolated height at the given points. Points outside the grid are at -inf'''
+        rows, cols = self.heights.shape
+        fx = (np.asarray(x) - self.origin[0]) / self.cell_size
+        fy = (np.asarray(y) - self.origin[1]) / self.cell_size
+        inside = (fx >= 0) & (fy >= 0) & (fx <= cols - 1) & (fy <= rows - 1)
+        height = _sample_grid(self.heights, np.clip(fx, 0, cols - 1), np.clip(fy, 0, rows - 1))
+        height = height * self.height_scale + self.origin[2]
+        return np.where(inside, height, -np.inf)
+
+    def cast(self, origins, directions, max_range, min_range=0.0):
+        origins = np.asarray(origins, dtype=np.float32)
+        directions = np.asarray(directions, dtype=np.float32)
+        result = np.full(len(origins), np.inf, dtype=np.float32)
+
+        # Rays that are still marching, and the distance marched so far
+        active = np.arange(len(origins))
+        t_prev = np.full(len(origins), min_range, dtype=np.float32)
+        t = min_range
+        while active.size and t < max_range:
+            t = min(t + self.step, max_range)
+            points = origins[active] + directions[active] * t
+            below = points[:, 2] <= self.height_at(points[:, 0], points[:, 1])
+            if below.any():
+                hit = active[below]
+                result[hit] = self._refine(
+                    origins[hit], directions[hit], t_prev[hit], np.full(hit.size, t, np.float32))
+                active = active[~below]
+            t_prev[active] = t
+        return result
+
+    def _refine(self, origins, directions, t_above, t_below):
+        '''Bisect between distances above and below the terrain'''
+        for _ in range(self.refine_steps):
+            t_mid = (t_above + t_below) / 2
+            points = origins + directions * t_mid[:, np.newaxis]
+            below = points[:, 2] <= self.height_at(points[:, 0], points[:, 1])
+            t_below = np.where(below, t_mid, t_below)
+            t_above = np.where(below, t_above, t_mid)
+        return t_below
+
+
+class TiledHeightfield(HeightfieldGeometry):
+    '''
+    Large terrain heightfield that is split into square tiles, which are paged in from the `source` grid on use.
+
+    The source is any 2D array-like of heights (indexed like `HeightfieldGeometry.heights`), such as a memory-mapped
+    `.npy` file (see `from_file()`), so only the tiles that are used are read into memory. Tiles are
+    `tile_size` cells wide, and neighbouring tiles share their edge samples, so each tile has `tile_size + 1`
+    samples per side (fewer at the far edges of the grid). The least recently used tiles are evicted when the
+    resident tiles exceed `memory_budget` (bytes).
+
+    The same tiles are used by height queries and ray casts (in headless physics and sensors) and by the
+    rendered terrain (see `dronesim.app.terrain.TerrainStreamer`). Tiles can be loaded from any thread.
+    '''
+
+    def __init__(self,
+                 source,
+                 tile_size: int = 128,
+                 cell_size: float = 1.0,
+                 origin: tuple = (0.0, 0.0, 0.0),
+                 height_scale: float = 1.0,
+                 memory_budget: int = 64 * 1024 * 1024,
+                 step: Optional[float] = None,
+                 refine_steps: int = 8):
+        if np.ndim(source) != 2:
+            raise ValueError("Heightfield source must be a 2D grid, got shape %s" % (np.shape(source),))
+        if tile_size < 1:
+            raise ValueError("Tile size must be at least 1 cell")
+        self.source = source
+        self.tile_size = tile_size
+        self.cell_size = cell_size
+        self.origin = np.array(origin, dtype=np.float32)
+        self.height_scale = height_scale
+        self.memory_budget = memory_budget
+        self.step = step if step is not None else cell_size / 2
+        self.refine_steps = refine_steps
+
+        rows, cols = np.shape(source)
+        self.shape = (rows, cols)
+        self.num_tiles = (max(1, -(-(rows - 1) // tile_size)), max(1, -(-(cols - 1) // tile_size)))
+        # Resident tiles (row, column) in least to most recently used order
+        self._tiles: 'OrderedDict[Tuple[int, int], np.ndarray]' = OrderedDict()
+        self._memory_usage = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> 'TiledHeightfield':
+        '''Heightfield of a `.npy` grid, which is memory-mapped so that tiles are only read when used'''
+        return cls(np.load(path, mmap_mode='r'), **kwargs)
+
+    @property
+    def heights(self):
+        return self.source
+
+    @property
+    def memory_usage(self) -> int:
+        '''Bytes used by the resident tiles'''
+        return self._memory_usage
+
+    @property
+    def resident_tiles(self) -> List[Tuple[int, int]]:
+        with self._lock:
+            return list(self._tiles)
+
+    @property
+    def size(self) -> Tuple[float, float]:
+        '''Extent (x, y) of the heightfield in world units'''
+        rows, cols = self.shape
+        return ((cols - 1) * self.cell_size, (rows - 1) * self.cell_size)
+
+    def tile_at(self, x: float, y: float) -> Tuple[int, int]:
+        '''Tile (row, column) that contains the point, clamped to the heightfield'''
+        col = int((x - self.origin[0]) // (self.tile_size * self.cell_size))
+        row = int((y - self.origin[1]) // (self.tile_size * self.cell_size))
+        return (min(max(row, 0), self.num_tiles[0] - 1), min(max(col, 0), self.num_tiles[1] - 1))
+
+    def tile_bounds(self, tile: Tuple[int, int]) -> Tuple[float, float, float, float]:
+        '''World (min x, min y, max x, max y) of the tile'''
+        row, col = tile
+        rows, cols = self.shape
+        span = self.tile_size * self.cell_size
+        return (self.origin[0] + col * span,
+                self.origin[1] + row * span,
+                self.origin[0] + min((col + 1) * self.tile_size, cols - 1) * self.cell_size,
+                self.origin[1] + min((row + 1) * self.tile_size, rows - 1) * self.cell_size)
+
+    def tile_distance(self, tile: Tuple[int, int], x: float, y: float) -> float:
+        '''Horizontal distance from the point to the tile (0 inside it)'''
+        x0, y0, x1, y1 = self.tile_bounds(tile)
+        dx = max(x0 - x, 0.0, x - x1)
+        dy = max(y0 - y, 0.0, y - y1)
+        return float(np.hypot(dx, dy))
+
+    def tile_heights(self, tile: Tuple[int, int]) -> np.ndarray:
+        '''Heights of the tile (float32, read-only), which is paged in if it isn't resident'''
+        with self._lock:
+            heights = self._tiles.get(tile)
+            if heights is not None:
+                self._tiles.move_to_end(tile)
+                return heights
+
+        # Read outside the lock, so that tiles can be paged in concurrently
+        row, col = tile
+        if not (0 <= row < self.num_tiles[0] and 0 <= col < self.num_tiles[1]):
+            raise IndexError("Tile %s is outside the heightfield (%d x %d tiles)" % ((tile,) + self.num_tiles))
+        ts = self.tile_size
+        heights = np.array(self.source[row * ts:(row + 1) * ts + 1, col * ts:(col + 1) * ts + 1], dtype=np.float32)
+        heights.flags.writeable = False
+
+        with self._lock:
+            # Another thread may have paged it in meanwhile
+            existing = self._tiles.get(tile)
+            if existing is not None:
+                self._tiles.move_to_end(tile)
+                return existing
+            self._tiles[tile] = heights
+            self._memory_usage += heights.nbytes
+            self._evict()
+        return heights
+
+    def evict(self, tile: Optional[Tuple[int, int]] = None):
+        '''Evict the tile, or all tiles'''
+        with self._lock:
+            for t in ([tile] if tile is not None else list(self._tiles)):
+                heights = self._tiles.pop(t, None)
+                if heights is not None:
+                    self._memory_usage -= heights.nbytes
+
+    def _evict(self):
+        # Keep the most recently used tile, even if it alone exceeds the budget
+        while self._memory_usage > self.memory_budget and len(self._tiles) > 1:
+            _, heights = self._tiles.popitem(last=False)
+            self._memory_usage -= heights.nbytes
+
+    def height_at(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        rows, cols = self.shape
+        fx = (np.asarray(x, dtype=np.float64) - self.origin[0]) / self.cell_size
+        fy = (np.asarray(y, dtype=np.float64) - self.origin[1]) / self.cell_size
+        fx, fy = np.broadcast_arrays(fx, fy)
+        inside = (fx >= 0) & (fy >= 0) & (fx <= cols - 1) & (fy <= rows - 1)
+        fx = np.clip(fx, 0, cols - 1)
+        fy = np.clip(fy, 0, rows - 1)
+
+        # Sample each tile that the points fall in
+        ts = self.tile_size
+        tile_col = np.minimum((fx // ts).astype(np.intp), self.num_tiles[1] - 1)
+        tile_row = np.minimum((fy // ts).astype(np.intp), self.num_tiles[0] - 1)
+        tile_key = tile_row * self.num_tiles[1] + tile_col
+        height = np.full(fx.shape, -np.inf, dtype=np.float32)
+        for key in np.unique(tile_key[inside]):
+            row, col = divmod(int(key), self.num_tiles[1])
+            sel = inside & (tile_key == key)
+            height[sel] = _sample_grid(self.tile_heights((row, col)), fx[sel] - col * ts, fy[sel] - row * ts) \
+                * self.height_scale + self.origin[2]
+        return height
+
+
+class TriangleBVHGeometry(RaycastGeometry):
+    '''
+    Triangle mesh in a bounding volume hierarchy, which is built once.
+
+    Rays are traversed through the tree together: each step tests all (ray, node) pairs still in play against
+    the node bounds, expands the pairs of inner nodes into their children and tests the pairs of leaf nodes
+    against all triangles of the leaf.
+
+    :param vertices: M x 3 array of vertex positions.
+    :param triangles: T x 3 array of vertex indices of each triangle.
+    :param int leaf_size: Maximum number of triangles in a leaf.
+    '''
+
+    def __init__(self, vertices: np.ndarray, triangles: np.ndarray, leaf_size: int = 8):
+        vertices = np.asarray(vertices, dtype=np.float32)
+        triangles = np.asarray(triangles, dtype=np.intp)
+        self.leaf_size = leaf_size
+        self.v0 = vertices[triangles[:, 0]]
+        self.e1 = vertices[triangles[:, 1]] - self.v0
+        self.e2 = vertices[triangles[:, 2]] - self.v0
+        self._build(vertices[triangles])
+
+    @classmethod
+    def from_nodepath(cls, node, relative_to=None, leaf_size: int = 8) -> 'TriangleBVHGeometry':
+        '''Collect the triangles of all geometry under a Panda3D NodePath, in the frame of `relative_to` (or `node`)'''
+        from panda3d.core import GeomVertexReader
+
+        if relative_to is None:
+            relative_to = node
+        vertices, triangles = [], []
+        offset = 0
+        for geom_np in node.find_all_matches('**/+GeomNode'):
+            mat = geom_np.get_mat(relative_to)
+            geom_node = geom_np.node()
+            for geom in geom_node.get_geoms():
+                vdata = geom.get_vertex_data()
+                reader = GeomVertexReader(vdata, 'vertex')
+                positions = []
+                while not reader.is_at_end():
+                    positions.append(mat.xform_point(reader.get_data3()))
+                for prim in geom.get_primitives():
+                    prim = prim.decompose()
+                    indices = np.array(prim.get_vertex_list(), dtype=np.intp)
+                    if len(indices) and prim.get_num_vertices_per_primitive() == 3:
+                        triangles.append(indices.reshape(-1, 3) + offset)
+                vertices.append(np.array(positions, dtype=np.float32).reshape(-1, 3))
+                offset += len(positions)
+        if not triangles:
+            raise ValueError("No triangles found under '%s'" % node)
+        return cls(np.concatenate(vertices), np.concatenate(triangles), leaf_size)
+
+    def _build(self, tri_vertices: np.ndarray):
+        centroids = tri_vertices.mean(axis=1)
+        tri_min, tri_max = tri_vertices.min(axis=1), tri_vertices.max(axis=1)
+
+        bounds_min, bounds_max, children, leaves = [], [], [], []
+        # Nodes to build, as (node index, triangle indices)
+        stack = [(0, np.arange(len(tri_vertices)))]
+        bounds_min.append(None)
+        bounds_max.append(None)
+        children.append(None)
+        while stack:
+            node, tris = stack.pop()
+            bounds_min[node] = tri_min[tris].min(axis=0)
+            bounds_max[node] = tri_max[tris].max(axis=0)
+            if len(tris) <= self.leaf_size:
+                leaf = np.full(self.leaf_size, -1, dtype=np.intp)
+                leaf[:len(tris)] = tris
+                children[node] = (-1, len(leaves))
+                leaves.append(leaf)
+                continue
+            # Split at the median along the longest axis
+            axis = np.argmax(bounds_max[node] - bounds_min[node])
+            order = np.argsort(centroids[tris, axis], kind='stable')
+            half = len(tris) // 2
+            left, right = len(bounds_min), len(bounds_min) + 1
+            bounds_min.extend((None, None))
+            bounds_max.extend((None, None))
+            children.extend((None, None))
+            children[node] = (left, right)
+            stack.append((left, tris[order[:half]]))
+            stack.append((right, tris[order[half:]]))
+
+        self.node_min = np.array(bounds_min, dtype=np.float32)
+        self.node_max = np.array(bounds_max, dtype=np.float32)
+        children = np.array(children, dtype=np.intp)
+        self.node_left, self.node_right = children[:, 0], children[:, 1]
+        self.leaf_triangles = np.array(leaves, dtype=np.intp)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_min)
+
+    def cast(self, origins, directions, max_range, min_range=0.0):
+        origins = np.asarray(origins, dtype=np.float32)
+        directions = np.asarray(directions, dtype=np.float32)
+        best = np.full(len(origins), max_range, dtype=np.float32)
+        with np.errstate(divide='ignore'):
+            inv_dir = 1.0 / np.where(np.abs(directions) < 1e-12, 1e-12, directions)
+
+        # (ray, node) pairs to test, starting with all rays at the root
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=np.intp)
+        with np.errstate(invalid='ignore', over='ignore'):
+            while rays.size:
+                o, inv = origins[rays], inv_dir[rays]
+                t1 = (self.node_min[nodes] - o) * inv
+                t2 = (self.node_max[nodes] - o) * inv
+                t_near = np.minimum(t1, t2).max(axis=1)
+                t_far = np.maximum(t1, t2).min(axis=1)
+                # Skip nodes that are missed, behind the ray or farther than the closest hit so far
+                keep = (t_near <= t_far) & (t_far >= min_range) & (t_near <= best[rays])
+                rays, nodes = rays[keep], nodes[keep]
+
+                is_leaf = self.node_left[nodes] < 0
+                if is_leaf.any():
+                    leaf_rays = rays[is_leaf]
+                    hit_t = self._intersect_leaves(
+                        origins[leaf_rays], directions[leaf_rays],
+                        self.leaf_triangles[self.node_right[nodes[is_leaf]]], min_range)
+                    np.minimum.at(best, leaf_rays, hit_t)
+
+                inner_rays, inner_nodes = rays[~is_leaf], nodes[~is_leaf]
+                rays = np.concatenate((inner_rays, inner_rays))
+                nodes = np.concatenate(
+                    (self.node_left[inner_nodes], self.node_right[inner_nodes]))
+
+        best[best >= max_range] = np.inf
+        return best
+
+    def _intersect_leaves(self, origins, directions, leaf_tris, min_range):
+        '''Closest hit (Moller-Trumbore) of each ray with the triangles of its leaf'''
+        valid = leaf_tris >= 0
+        tris = np.where(valid, leaf_tris, 0)
+        v0, e1, e2 = self.v0[tris], self.e1[tris], self.e2[tris]
+        o = origins[:, np.newaxis]
+        d = np.broadcast_to(directions[:, np.newaxis], e1.shape)
+
+        p = np.cross(d, e2)
+        det = np.einsum('ijk,ijk->ij', e1, p)
+        inv_det = 1.0 / np.where(np.abs(det) < 1e-12, 1e-12, det)
+        s = o - v0
+        u = np.einsum('ijk,ijk->ij', s, p) * inv_det
+        q = np.cross(s, e1)
+        v = np.einsum('ijk,ijk->ij', d, q) * inv_det
+        t = np.einsum('ijk,ijk->ij', e2, q) * inv_det
+
+        hit = valid & (np.abs(det) >= 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= min_range)
+        return np.where(hit, t, np.inf).min(axis=1).astype(np.float32)
+
+
+__all__ = [
+    'RaycastGeometry',
+    'HeightfieldGeometry',
+    'TiledHeightfield',
+    'TriangleBVHGeometry'
+]
@@ -2,3 +2,7 @@
 class SensorBase:
     def attach_to(self, sim: 'DroneSimulator'):
         pass
+
+    def update(self):
+        '''Returns the current reading of the sensor'''
+        return None
@@ -16,11 +16,14 @@ class DroneSimulator:
                  default_reset_state: Dict = None,
                  objective: ObjectiveBase = None,
                  default_sensors: bool = True,
+                 renderer: Any = None,
                  **additional_sensors: SensorBase
                  ):
         self.__physics: DronePhysicsEngine = physics_engine
         self.__sensors: Dict[str, SensorBase] = {}
         self.__sensor_state = {}
+        # Renders the camera sensors on demand (such as `dronesim.app.headless.HeadlessRenderer`)
+        self.__renderer = renderer
 
         self.set_default_reset_state(default_reset_state)
         self.set_objective(objective)
@@ -102,10 +105,23 @@ class DroneSimulator:
     def set_objective(self, objective: ObjectiveBase):
         self.__objective = objective
 
+    def set_renderer(self, renderer: Any):
+        '''Set the renderer whose `render_frame()` is called before reading the sensors in `update_sensors()`'''
+        self.__renderer = renderer
+
+    def update_sensors(self) -> dict:
+        '''
+        Render a new frame (if a renderer is set) and update the state of all sensors.
+        The sensor state is returned, and is also available in the 'sensors' field of `get_state()` info.
+        '''
+        if self.__renderer is not None:
+            self.__renderer.render_frame()
+        self._update_sensors()
+        return self.__sensor_state
+
     def _update_sensors(self):
-        # TODO: Left to implement
         self.__sensor_state = {
-            sensor_name: None for sensor_name, sensor in self.__sensors.items()}
+            sensor_name: sensor.update() for sensor_name, sensor in self.__sensors.items()}
 
     def _reset_metrics(self):
         '''Reset default metric values'''
@@ -121,6 +137,10 @@ class DroneSimulator:
     def sensors(self):
         return self.__sensors
 
+    @property
+    def renderer(self):
+        return self.__renderer
+
     # Physics engine API passthrough
 
     @property
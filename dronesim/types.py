@@ -1,15 +1,11 @@
 
 '''Type aliases for use in the simulator'''
 
-import os
-from panda3d.core import Filename
-
 from dronesim.interface.types import StepRC, StepAction, StepActionType
 
 from typing import Union, Tuple, TypedDict, NamedTuple, Dict, Any
 
 
-PandaFilePath = Union[str, os.PathLike, Filename]
 Vec3Tuple = Tuple[float, float, float]
 Vec4Tuple = Tuple[float, float, float, float]
 PhysicsStateType = Dict[str, Any]
@@ -33,8 +29,15 @@ class InputState(TypedDict):
     is_dash: bool
 
 
+def __getattr__(name: str):
+    # Panda3D-dependent types (see `dronesim.panda3d_types`), only imported when used
+    if name == 'PandaFilePath':
+        from dronesim.panda3d_types import PandaFilePath
+        return PandaFilePath
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
 __all__ = [
-    'PandaFilePath',
     'Vec3Tuple',
     'Vec4Tuple',
     'PhysicsStateType',
@@ -10,6 +10,29 @@ modulo = np.mod
 sin, cos = np.sin, np.cos
 
 
+def hpr_to_matrix(hpr: np.ndarray) -> np.ndarray:
+    '''
+    Rotation matrices (... x 3 x 3) for heading, pitch and roll angles (... x 3, radians) in Panda3D's
+    convention, which rotate row vectors: `world = local @ matrix`.
+    '''
+    hpr = np.asarray(hpr, dtype=np.float64)
+    ch, sh = np.cos(hpr[..., 0]), np.sin(hpr[..., 0])
+    cp, sp = np.cos(hpr[..., 1]), np.sin(hpr[..., 1])
+    cr, sr = np.cos(hpr[..., 2]), np.sin(hpr[..., 2])
+    mat = np.empty(hpr.shape[:-1] + (3, 3), dtype=np.float32)
+    # Roll (about Y), then pitch (about X), then heading (about Z)
+    mat[..., 0, 0] = cr * ch - sr * sp * sh
+    mat[..., 0, 1] = cr * sh + sr * sp * ch
+    mat[..., 0, 2] = -sr * cp
+    mat[..., 1, 0] = -cp * sh
+    mat[..., 1, 1] = cp * ch
+    mat[..., 1, 2] = sp
+    mat[..., 2, 0] = sr * ch + cr * sp * sh
+    mat[..., 2, 1] = sr * sh - cr * sp * ch
+    mat[..., 2, 2] = cr * cp
+    return mat
+
+
 def square_aspect2d_frame(size: float = 1.0):
     '''
     Returns a box spanning the given size in aspect2d space in Panda3d.
@@ -3,18 +3,22 @@ from dronesim import SimulatorApplication, Panda3DEnvironment, make_uav
 
 from common import mount_examples_assets_dir
 
+from dronesim.app.terrain import TerrainStreamer, load_heightmap
+from dronesim.sensor.raycast import TiledHeightfield
+
 from panda3d.core import (
-    GeoMipTerrain,
     NodePath,
     DirectionalLight,
-    LVecBase3f,
-    Spotlight,
     TextureStage
 )
 
 from direct.showbase.Loader import Loader
 
 
+CELL_SIZE = 10
+HEIGHT_SCALE = 100
+
+
 def main():
     mount_examples_assets_dir()
 
@@ -22,28 +26,28 @@ def main():
 
     tex_grass = LOADER.loadTexture('/examples/assets/grass_texture_hd_31.jpg')
 
-    terrain = GeoMipTerrain("mySimpleTerrain")
-    terrain.set_heightfield("/examples/assets/simple_heightmap.png")
-    terrain.set_block_size(32)
-    # terrain.setBruteforce(True)
-    terrain.generate()
-
-    terrain_holder = NodePath("terrain_holder")
-    terrain_root = terrain.get_root()
-    terrain_root.reparent_to(terrain_holder)
+    # For large heightmaps, save the heights with `numpy.save()` and use `TiledHeightfield.from_file()`,
+    # so that only the tiles that are used are read
+    heights = load_heightmap("/examples/assets/simple_heightmap.png")
 
     # Center align the terrain
-    terrain_bbox_p1, terrain_bbox_p2 = terrain_root.get_tight_bounds()
-    terrain_mid = (terrain_bbox_p2 + terrain_bbox_p1)/2
-    height_at_origin = terrain.get_elevation(*terrain_mid.xy)
-    terrain_mid.z = height_at_origin
-    print(terrain_bbox_p1, terrain_bbox_p2, terrain_mid, height_at_origin)
-    terrain_holder.set_pos(-terrain_mid)
-    terrain_holder.set_scale(10,10,100)
-
-    terrain_root.set_texture(TextureStage.get_default(), tex_grass)
-    terrain_root.set_tex_scale(TextureStage.get_default(), 500)
-    terrain_root.set_shader_auto() # Don't use PBR shader for this model
+    rows, cols = heights.shape
+    height_at_origin = heights[rows // 2, cols // 2] * HEIGHT_SCALE
+    heightfield = TiledHeightfield(
+        heights,
+        tile_size=64,
+        cell_size=CELL_SIZE,
+        height_scale=HEIGHT_SCALE,
+        origin=(-(cols - 1) * CELL_SIZE / 2, -(rows - 1) * CELL_SIZE / 2, -height_at_origin)
+    )
+
+    # Tiles of the terrain are loaded (and their level of detail updated) around the active vehicle
+    terrain = TerrainStreamer(heightfield, load_radius=1000)
+
+    # Texture coordinates span each tile
+    terrain.set_texture(TextureStage.get_default(), tex_grass)
+    terrain.set_tex_scale(TextureStage.get_default(), 60)
+    terrain.set_shader_auto() # Don't use PBR shader for this model
 
     # Lighting
     dlight = DirectionalLight('dlight')
@@ -54,11 +58,14 @@ def main():
 
     _, _, uav = make_uav()
 
-    env = Panda3DEnvironment("basic_env", scene_model=terrain_holder, attach_lights=[dlnp])
+    env = Panda3DEnvironment("basic_env", scene_model=terrain, attach_lights=[dlnp])
 
     droneWindow = SimulatorApplication(env, uav)
+    terrain.set_focus(droneWindow.activeVehicleNode)
+    droneWindow.entities.on('active_vehicle', terrain.set_focus)
     def print_elev(task):
-        #print(terrain.getElevation(*uav.get_pos().xy) * terrain_root.get_scale().z)
+        # Same heights as the rendered terrain, also available without rendering (eg. for physics)
+        #print(heightfield.height_at(*uav.get_pos(terrain).xy))
         return task.cont
     droneWindow.task_mgr.add(print_elev)
     droneWindow.run()
@@ -37,7 +37,8 @@ PACKAGE_DATA = {
         'assets/models/**',
         'assets/scenes/**',
         'assets/textures/**',
-        'assets/shaders/**'
+        'assets/shaders/**',
+        'assets.mf'                     # Packed asset bundle, if built (python -m dronesim.app.bundle)
     ]
 }
 
@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+from dronesim.dataset import FrameSink, OverflowPolicy
+
+
+def test_interleaved_cameras_fill_their_own_chunks(tmp_path):
+    cameras = ('front', 'down', 'left')
+    frames_per_camera = 20
+    with FrameSink(str(tmp_path), 'npy', chunk_size=8, queue_size=8, policy=OverflowPolicy.BLOCK) as sink:
+        for seq in range(frames_per_camera):
+            for idx, name in enumerate(cameras):
+                frame = np.full((4, 6, 3), seq * len(cameras) + idx, dtype=np.uint8)
+                assert sink.submit(frame, name, seq)
+
+    assert sink.dropped == 0
+    assert sink.written == frames_per_camera * len(cameras)
+    # 20 frames per camera: two full chunks of 8 and the remainder written on close
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        "%s_%08d.npy" % (name, first) for name in cameras for first in (0, 8, 16))
+    for idx, name in enumerate(cameras):
+        frames = np.concatenate([np.load(os.path.join(tmp_path, "%s_%08d.npy" % (name, first))) for first in (0, 8, 16)])
+        assert frames.shape == (frames_per_camera, 4, 6, 3)
+        np.testing.assert_array_equal(frames[:, 0, 0, 0], np.arange(frames_per_camera) * len(cameras) + idx)
+
+
+def test_queue_size_is_rounded_up_to_whole_chunks(tmp_path):
+    sink = FrameSink(str(tmp_path), 'npy', chunk_size=16, queue_size=40)
+    try:
+        assert len(sink._slots) == 3
+        sink.submit(np.zeros((2, 2), np.uint8), 'front')
+        sink.submit(np.zeros((2, 2), np.uint8), 'down')
+        # Each camera gets a slot for its open chunk, besides the ones for chunks waiting to be written
+        assert len(sink._slots) == 5
+        assert sink.pending == 0
+    finally:
+        sink.close()